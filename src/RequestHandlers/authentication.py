@@ -1,11 +1,14 @@
 """
 authenticating user logging in details and signing up users
+an AUTH request is handled in three steps so that the asyncio server can run
+the slow password hashing in passwords.pool() instead of its database executor:
+find_user() -> check_password() -> complete()
 """
-import hashlib
-import os
-from dotenv import load_dotenv
 from Utilities import codes, message_serializer
 from Utilities import database_manager as database
+from Utilities import passwords
+from Utilities import tokens
+from Utilities import writer
 
 
 def response(email: str, password: str) -> tuple:
@@ -15,77 +18,116 @@ def response(email: str, password: str) -> tuple:
     :param password:
     :return: (response message, response data)
     """
-    authenticated = check_user(email, password)  # authenticate or register user result
-    files_string = ''
-    access_key = 'null'
+    while True:
+        user = find_user(email)
+        authenticated, password_hash = check_password(email, password, user)
+        completed = complete(email, password, user, authenticated, password_hash)
+        if completed is not None:
+            return completed
 
-    code = None
-    if authenticated:
-        code = codes.SUCCESS
-        access_key = generate_access_key_decoded(email)
-    else:
-        code = codes.INCORRECT_CREDENTIALS
 
-    response_string = message_serializer.build_response_string(code, access_key=access_key)
-    return response_string, files_string.strip('\r\n')
+def find_user(email):
+    """
+    :param email:
+    :return: the user_id and password of the user, or None if the user does not exist
+    """
+    query = "SELECT user_id, password FROM Users WHERE email = %s"
+    return database.query_one(query, (email,))
 
 
-# register new
-def register_user(email, password):
+def is_remembered(email, password, user) -> bool:
     """
-    Registers a user. i.e. adds user information to the database
+    Cheap, checked before the AUTH is handed to passwords.pool()
     :param email:
     :param password:
-    :return:
+    :param user: as returned by find_user()
+    :return: True if the user exists and the credentials were verified recently
     """
-    done = False
+    return user is not None and passwords.is_remembered(email, password, user['password'] or '')
 
-    # sql command
-    command = "INSERT INTO Users (email, password) VALUES (%s, %s)"
-    creds = (email, password)
-    database.query(command, creds)
-    database.commit()
-    done = True
 
-    return done
+def check_password(email, password, user) -> tuple:
+    """
+    Checks the password against the Users row. Slow unless the credentials were
+    verified recently, does not use the database.
+    :param email:
+    :param password:
+    :param user: as returned by find_user()
+    :return: (True if the user may log in, password hash to store or None). A hash is
+    returned for new users and for users whose password is still stored in plain text.
+    """
+    if user is None:
+        # user not found, the user is created with this password
+        return True, passwords.hash_password(password)
+
+    stored = user['password'] or ''
+    if is_remembered(email, password, user):
+        return True, None
+    if not passwords.verify_password(password, stored):
+        return False, None
 
+    return True, None if passwords.is_hashed(stored) else passwords.hash_password(password)
 
-# check member
-def check_user(email, password) -> bool:
+
+def complete(email, password, user, authenticated: bool, password_hash) -> tuple:
     """
+    Registers new users, stores the password hash and generates the response
     :param email:
     :param password:
-    :return: True if user exists
+    :param user: as returned by find_user()
+    :param authenticated: as returned by check_password()
+    :param password_hash: as returned by check_password()
+    :return: (response message, response data), or None if another connection registered
+    the user since it was looked up, the password then has to be checked again from find_user()
     """
-    found = False
+    if user is None:
+        user_id = writer.write(register_user, email, password_hash)
+        if user_id is None:
+            return None
+        user = {'user_id': user_id, 'password': password_hash}
 
-    #  check user_exists
-    command_find_user = "SELECT email FROM Users WHERE email = %s"
-    creds_find_user = (email,)
-    result_find_user = database.query(command_find_user, creds_find_user)
-    if len(result_find_user) > 0:
-        # user found, check credentials
-        # sql command
-        command_check_credentials = "SELECT email FROM Users WHERE email = %s AND password = %s"
-        creds_check_credentials = (email, password)
-        result = database.query(command_check_credentials, creds_check_credentials)
+    if not authenticated:
+        response_string = message_serializer.build_response(codes.INCORRECT_CREDENTIALS, access_key='null')
+        return response_string, ''
 
-        if result is not None and len(result) > 0:
-            found = True
-    else:
-        # user not found, create user
-        found = register_user(email, password)
+    stored = user['password']
+    if password_hash is not None and stored != password_hash:
+        # the response does not wait for the hash to be stored
+        writer.submit(update_password, user['user_id'], password_hash)
+        stored = password_hash
+    passwords.remember(email, password, stored)
 
-    return found
+    access_key = tokens.issue(user['user_id'], email)
+    response_string = message_serializer.build_response(codes.SUCCESS, access_key=access_key)
+    return response_string, ''
 
 
-def generate_access_key_decoded(email) -> str:
+# register new
+def register_user(email, password_hash):
     """
-    Generates an access key for the provided email
+    Registers a user. i.e. adds user information to the database
+    Not committed, run by writer.write().
     :param email:
-    :return: str -> access key
+    :param password_hash: as returned by passwords.hash_password()
+    :return: int -> user_id of the new user, or None if the email was registered in the meantime
+    """
+    if find_user(email) is not None:
+        return None
+
+    # sql command
+    command = "INSERT INTO Users (email, password) VALUES (%s, %s)"
+    creds = (email, password_hash)
+    database.query(command, creds)
+
+    return database.query_scalar("SELECT user_id FROM Users WHERE email = %s", (email,))
+
+
+def update_password(user_id, password_hash):
+    """
+    Replaces a password stored in plain text with its hash
+    Not committed, run by writer.submit().
+    :param user_id:
+    :param password_hash: as returned by passwords.hash_password()
     """
-    load_dotenv()
-    server_key = os.getenv('SERVER_KEY')
-    pre_hash = server_key + email
-    return hashlib.sha256(pre_hash.encode()).hexdigest()
+    command = "UPDATE Users SET password = %s WHERE user_id = %s"
+    database.query(command, (password_hash, user_id))
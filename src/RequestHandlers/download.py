@@ -4,103 +4,165 @@ functions to handle the downloading of a file
 from the server to the client
 """
 import os
+from Utilities import acl
 from Utilities import codes
-from Utilities import database_manager as database
+from Utilities import storage
+from Utilities import blob_store
+from Utilities import compression
+from Utilities import integrity
 from Utilities import message_serializer as m_builder
 
+MIN_COMPRESSION_SIZE = 1024  # smaller files are always sent as they are
 
-def response(email, filename):
+
+def response(email, filename, file_range=None, compression_options=None, digest_algorithm=None):
     """
     generates a response message to send back to the client
     :param filename:
     :param email:
-    :return: (response message, response data)
+    :param file_range: (offset, length) of the part of the file to send, length may be None
+    for the rest of the file. The whole file is sent if no range is given.
+    :param compression_options: (codec, level) negotiated with the client, or None.
+    Ranges and files of already compressed types are never compressed.
+    :param digest_algorithm: integrity algorithm the client chose, or None. The digest
+    of the data sent is added to the response when the client chose one.
+    :return: (response message, response data) the data is a storage.OutgoingFile
+    when the file is sent
     """
     response_string = ''
     file_bytes = b''
     code = codes.SUCCESS
     file_size = 0
+    content_range = None
+    content_compression = None
+    payload_digest = None
 
     if not valid_filename(filename):
         code = codes.FILE_NOT_FOUND
-    elif not is_public(filename) and not has_access(filename, email):
+    elif not has_access(filename, email):
         code = codes.ACCESS_DENIED
+    elif file_range is None and compression_options is not None and \
+            not compression.is_compressed_type(get_file_type(filename)):
+        file_bytes, file_size, content_compression = send_compressed(filename, *compression_options)
     else:
-        file_bytes, file_size = send(filename)
-
-    response_string = m_builder.build_response_string(code, file_size=file_size)
+        try:
+            file_bytes, file_size = send(filename, file_range)
+        except ValueError:
+            code = codes.RANGE_NOT_SATISFIABLE
+        else:
+            if file_range is not None:
+                code = codes.PARTIAL_CONTENT
+                content_range = (file_bytes.offset, file_bytes.total_size)
+
+    if digest_algorithm is not None and isinstance(file_bytes, storage.OutgoingFile):
+        payload_digest = (digest_algorithm, file_digest(filename, file_bytes, digest_algorithm, content_compression))
+
+    response_string = m_builder.build_response(code, file_size=file_size, content_range=content_range,
+                                               compression=content_compression, payload_digest=payload_digest)
     return response_string, file_bytes
 
 
 # checks if file name entered is valid
 def valid_filename(filename):
     """
-    Validate that the file exists in the database
+    Validate that the file exists, from the authorization index
     :param filename:
     :return:
     """
-    valid = False
-    query = "SELECT resource_path FROM resources WHERE resource_path = %s"
-    results = database.query(query, (filename,))
+    return acl.resource(filename) is not None
 
-    file_exists = results
 
-    if file_exists is not None and len(file_exists) > 0:
-        valid = True
+# checks if an access ID exists for the client
+def has_access(filename, email):
+    """
 
-    return valid
+    :param filename:
+    :param email:
+    :return: True if the user has access to this file, public files included
+    """
+    return acl.may_read(email, filename)
 
 
-# this method works when valid_filename is true
-def is_public(filename):
+def content_path(filename) -> str:
     """
     :param filename:
-    :return: True if the file is public
+    :return: str -> where the content of the file is stored, see blob_store.resource_path()
     """
-    public = False
-    query = "SELECT public FROM Resources WHERE resource_path = %s"
-    access = database.query(query, (filename,))
-
-    public = access[0]['public'] == 1
-
-    return public
+    resource = acl.resource(filename)
+    if resource is not None and resource['blob_hash']:
+        return blob_store.blob_path(resource['blob_hash'])
+    return blob_store.resource_path(filename)
 
 
-# checks if an access ID exists for the client
-def has_access(filename, email):
+# uploading the actual contents of the file to the client :)
+def send(filename, file_range=None):
     """
-
     :param filename:
-    :param email:
-    :return: True if the user has access to this file
+    :param file_range: (offset, length) of the part of the file to send, or None
+    :return: (storage.OutgoingFile to stream the file from, number of bytes to send)
+    :raises ValueError: if the range starts after the end of the file
     """
-    access = False
-    query = "SELECT resource_id FROM Resources where resource_path = %s"
-
-    resource_id = database.query(query, (filename,))[0]['resource_id']
+    outgoing_file = storage.OutgoingFile(content_path(filename))
+    if file_range is not None:
+        try:
+            outgoing_file.select_range(*file_range)
+        except ValueError:
+            outgoing_file.close()
+            raise
 
-    query = "SELECT user_id FROM Users where email = %s"
-    user_id = database.query(query, (email,))[0]['user_id']
+    return outgoing_file, outgoing_file.size
 
-    query = "SELECT access_id FROM Access where user_id=%s AND file_id=%s"
-    info = (int(user_id), int(resource_id))
 
-    key = database.query(query, info)
-
-    access = len(key) > 0
+def send_compressed(filename, codec, level):
+    """
+    Sends a compressed copy of the file, unless compressing does not make it smaller
+    or the copy is not ready yet
+    :param filename:
+    :param codec:
+    :param level:
+    :return: (storage.OutgoingFile to stream the file from, number of bytes to send,
+    (codec:level, original file size) or None if the file is sent as it is)
+    """
+    path = content_path(filename)
+    original_size = os.path.getsize(path)
+    if original_size >= MIN_COMPRESSION_SIZE:
+        compressed_path = storage.cache_path(path, codec + str(level))
+        if not compression.is_cached(path, compressed_path):
+            # sent as it is this time, the compressed copy is made in the background
+            compression.compress_later(path, compressed_path, codec, level)
+        elif os.path.getsize(compressed_path) < original_size:
+            outgoing_file = storage.OutgoingFile(compressed_path)
+            return outgoing_file, outgoing_file.size, (codec + ':' + str(level), original_size)
+
+    outgoing_file = storage.OutgoingFile(path)
+    return outgoing_file, outgoing_file.size, None
+
+
+def file_digest(filename, outgoing_file: storage.OutgoingFile, algorithm: str, content_compression=None) -> str:
+    """
+    :param filename:
+    :param outgoing_file: the file or part of the file that is sent
+    :param algorithm: integrity algorithm the client chose
+    :param content_compression: (codec:level, original file size) if a compressed copy is sent, or None
+    :return: str -> hex digest of the data sent. The sha256 of a whole blob is its name,
+    other digests of whole files are cached with the compressed copies, see storage.cache_path().
+    """
+    path = content_path(filename)
+    if content_compression is not None:
+        return integrity.file_digest(outgoing_file, algorithm,
+                                     storage.cache_path(path, content_compression[0].replace(':', '') + '.' + algorithm))
 
-    return access
+    resource = acl.resource(filename)
+    whole_file = outgoing_file.offset == 0 and outgoing_file.size == outgoing_file.total_size
+    if whole_file and algorithm == integrity.DEFAULT_ALGORITHM and resource is not None and resource['blob_hash']:
+        return resource['blob_hash']
+    return integrity.file_digest(outgoing_file, algorithm, storage.cache_path(path, algorithm))
 
 
-# uploading the actual contents of the file to the client :)
-def send(filename):
+def get_file_type(filename):
     """
     :param filename:
-    :return: (bytes of the file, file size)
+    :return: the type recorded for the file when it was uploaded
     """
-    file = open(filename, "rb")
-    file_size = os.path.getsize(filename)
-    data = file.read()
-    file.close()
-
-    return data, file_size
+    resource = acl.resource(filename)
+    return resource['type'] if resource is not None else None
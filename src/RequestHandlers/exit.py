@@ -2,12 +2,19 @@
 Function to handle an exit request
 """
 from Utilities import codes, message_serializer
+from Utilities import tokens
 
 
-def response() -> tuple:
+def response(email=None, access_key=None) -> tuple:
     """
     generates a response message for the exit request
+    and revokes the access key the client exits with, if it sent one
+    :param email:
+    :param access_key:
     :return:
     """
-    response_string = message_serializer.build_response_string(codes.SUCCESS, file_size=0)
+    if email is not None and access_key is not None and tokens.verify(access_key, email) is not None:
+        tokens.revoke(access_key)
+
+    response_string = message_serializer.build_response(codes.SUCCESS, file_size=0)
     return response_string, ''
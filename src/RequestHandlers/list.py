@@ -1,78 +1,146 @@
 """
 listing all the available files
 functions to handle the listing of accessible files
+Files are listed a page at a time, in the order they were uploaded. The rows
+are read from the cursor in batches and only the names on the page are kept,
+so a LIST never holds more than a page of files in memory.
 """
+import os
+
+from Utilities import acl
 from Utilities import codes
 from Utilities import database_manager as database
 from Utilities import message_serializer as message_serializer
 
+LIST_PAGE_SIZE = 1000  # files listed when the client does not ask for a page size
+MAX_LIST_PAGE_SIZE = 10000  # most files listed by a single LIST
+LINE_SEPARATOR = b'\r\n'
+
+# files the user may see: public, owned by the user or shared with the user. Each is
+# selected on its own and the selections are merged, so that every one is read from an index
+VISIBLE_CONDITIONS = (
+    "public = 1",
+    "user_id = %s",
+    "resource_id IN (SELECT file_id FROM Access WHERE user_id = %s)",
+)
 
-def response(email: str, access_key=None) -> tuple:
+
+def response(email: str, access_key=None, list_filters: dict = None) -> tuple:
     """
     generates a response message to send back to the client
     :param email:
     :param access_key:
-    :return: (response message, list of files)
+    :param list_filters: as returned by message_parser.get_list_filters(), None for the first page of every file
+    :return: (response message, names of the files on the page, one per line). The response
+    ends with the CURSOR of the next page when there are more files to list.
     """
-    files = return_list(email)
-    files_string = ''
-    for file in files:
-        files_string += file['resource_path'] + '\r\n'
+    list_filters = list_filters or {}
+    limit = page_size(list_filters.get('page_size'))
+
+    files = bytearray()
+    listed = 0
+    next_cursor = None
+    user_id = get_user_id(email)
+    if user_id is not None:
+        # one more file than the page holds tells whether there is a next page
+        query, values = visible_query(user_id, list_filters, 'resource_id, resource_path', limit + 1)
+        for row in database.stream(query, values):
+            if listed == limit:
+                next_cursor = last_resource_id
+                break
+            if listed > 0:
+                files += LINE_SEPARATOR
+            files += row['resource_path'].encode()
+            last_resource_id = row['resource_id']
+            listed += 1
 
     code = None
-    if len(files_string) > 0:
+    file_size = 0
+    if listed > 0:
         code = codes.SUCCESS
+        file_size = len(files)
     else:
         code = codes.NO_FILES_FOUND
 
-    response_string = message_serializer.build_response_string(code, file_size=len(files_string))
-    return response_string, files_string.strip('\r\n')
+    response_string = message_serializer.build_response(code, file_size=file_size, next_cursor=next_cursor)
+    return response_string, bytes(files)
 
 
-def is_public(filename):
+def page_size(requested) -> int:
     """
-
-    :param filename:
-    :return: True if the file is public
+    :param requested: PAGE_SIZE the client asked for, or None
+    :return: int -> files listed on a page, LIST_PAGE_SIZE unless the client asked for a size,
+    at most MAX_LIST_PAGE_SIZE. Both can be set with environment variables of the same name.
     """
-    public = False
-    query = "SELECT public FROM Resources WHERE resource_path = %s"
-    access = database.query(query, (filename,))
+    maximum = int(os.getenv('MAX_LIST_PAGE_SIZE', MAX_LIST_PAGE_SIZE))
+    if requested is None:
+        requested = int(os.getenv('LIST_PAGE_SIZE', LIST_PAGE_SIZE))
+    return min(requested, maximum)
 
-    public = access[0]['public'] == 1
 
-    return public
+def get_user_id(email):
+    """
+    :param email:
+    :return: the user_id of the user, or None if the user does not exist
+    """
+    return acl.user_id(email)
 
 
-def has_access(filename, email):
+def visible_query(user_id, list_filters: dict, columns: str = '*', limit: int = None) -> tuple:
     """
-
-    :param filename:
-    :param email:
-    :return: True if the user has access
+    Builds the query for the files a user may see, in resource_id order
+    :param user_id:
+    :param list_filters: as returned by message_parser.get_list_filters()
+    :param columns: columns of Resources to select
+    :param limit: most rows returned, None for every row
+    :return: (query, values)
     """
-    access = False
-    query = "SELECT resource_id FROM Resources where resource_path = %s"
+    conditions = []
+    values = []
+
+    if list_filters.get('cursor') is not None:
+        conditions.append('resource_id > %s')
+        values.append(list_filters['cursor'])
 
-    resource_id = database.query(query, (filename,))[0]['resource_id']
+    prefix = list_filters.get('prefix')
+    if prefix:
+        # a range rather than LIKE, so that it is case-sensitive and uses the resource_path index
+        conditions.append('resource_path >= %s AND resource_path < %s')
+        values += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
 
-    query = "SELECT user_id FROM Users where email = %s"
-    user_id = database.query(query, (email,))[0]['user_id']
+    if list_filters.get('type') is not None:
+        conditions.append('type = %s')
+        values.append(list_filters['type'])
 
-    query = "SELECT access_id FROM Access where user_id=%s AND file_id=%s"
-    info = (int(user_id), int(resource_id))
+    if list_filters.get('uploaded_from') is not None:
+        conditions.append('upload_date >= %s')
+        values.append(list_filters['uploaded_from'])
 
-    key = database.query(query, info)
+    if list_filters.get('uploaded_to') is not None:
+        conditions.append('upload_date < %s')
+        values.append(list_filters['uploaded_to'])
 
-    access = len(key) > 0
+    selections = []
+    selection_values = []
+    for visible_condition in VISIBLE_CONDITIONS:
+        selections.append('SELECT ' + columns + ' FROM Resources WHERE ' + ' AND '.join([visible_condition] + conditions))
+        selection_values += ([user_id] if '%s' in visible_condition else []) + values
 
-    return access
+    # UNION also drops the files found by more than one selection
+    query = ' UNION '.join(selections) + ' ORDER BY resource_id'
+    if limit is not None:
+        query += ' LIMIT %s'
+        selection_values.append(limit)
 
+    return query, tuple(selection_values)
 
-def return_list(email) -> list[dict]:
+
+def return_list(email, list_filters: dict = None) -> list[dict]:
     """
-    A method that will return a list of files that are public or that the user owns
-    :param
+    A method that will return a list of files that are public, that the user owns
+    or that the user was given access to. The files are found with a single query.
+    :param email:
+    :param list_filters: as returned by message_parser.get_list_filters(), None for every file
     :return: dict -> {
         'resource_id': int,
         'type': str,
@@ -82,27 +150,10 @@ def return_list(email) -> list[dict]:
         'public': bool
     }
     """
-
-    users_query = "SELECT * FROM Users WHERE email = %s"
-    users_parameters = (email,)
-    users: list[dict] = database.query(users_query, users_parameters)
-
-    if len(users) == 0:
+    user_id = get_user_id(email)
+    if user_id is None:
         return []
 
-    resources_query = "SELECT * FROM Resources WHERE public = 1"
-    if users[0]['user_id']:
-        resources_query = "SELECT * FROM Resources"
-        # resources_parameters = (users[0]['user_id'],)
-        rows = database.query(resources_query, ())
-    else:
-        rows = database.query(resources_query)
-
-    list_to_return = []
-    for row in rows:
-        row['public'] = row['public'] == 1
-        filename = row['resource_path']
-        if row not in list_to_return and (is_public(filename) or has_access(filename, email)):
-            list_to_return.append(row)
+    rows = database.query(*visible_query(user_id, list_filters or {}))
 
-    return list_to_return
+    return [dict(row, public=row['public'] == 1) for row in rows]
@@ -4,86 +4,184 @@ functions to handle the uploading of a file
 from the client to the server
 """
 from datetime import *
+from Utilities import acl
 from Utilities import message_serializer
 from Utilities import database_manager as database
 from Utilities import message_parser as m_breaker
 from Utilities import constants
 from Utilities import codes
+from Utilities import storage
+from Utilities import blob_store
+from Utilities import writer
 import os
 
 
-def response(message: str, file: bytes, access_key=None) -> tuple:
+def response(message: m_breaker.Message, file: storage.IncomingFile, access_key=None) -> tuple:
     """
     generates a response message to send back to the client
-    :param message:
-    :param file:
+    :param message: the parsed UPLOAD request
+    :param file: storage.IncomingFile holding the received bytes of the file
     :param access_key:
     :return: (response message, response data)
     """
     files_string = ''
 
-    save_file(message, file)
+    code = save_file(message, file)
 
-    code = codes.SUCCESS
-
-    response_string = message_serializer.build_response_string(code, file_size=0)
+    response_string = message_serializer.build_response(code, file_size=0)
     return response_string, files_string.strip('\r\n')
 
 
-def save_file(message, file_bytes):
+def save_file(message: m_breaker.Message, incoming_file: storage.IncomingFile) -> codes.Status:
     """
-    saves the file to the server and calls to save the file to the database
-    :param message:
-    :param file_bytes: the bytes of the file to save
+    stores the received file and, once it is safely on disk,
+    calls to save the file to the database.
+    If the client provides the sha256 of the file in a FILE_HASH header and sends
+    no body, the file is saved only if the same content is already stored.
+    The checks that depend on the database are made by the writer, in the
+    transaction that saves the file, see save_filename_to_db().
+    A compressed body has been decompressed by the time it gets here, FILE_HASH and
+    ORIGINAL_SIZE describe the original file.
+    :param message: the parsed UPLOAD request
+    :param incoming_file: storage.IncomingFile holding the received bytes of the file
+    :return: codes.Status -> the outcome of the upload
     """
-    message = m_breaker.get_message_string(message)
-    file_name = m_breaker.get_data_parameters(message)['file_name']
-    email = m_breaker.get_headers(message)[constants.USER]
+    headers = message.headers
+    file_name = os.path.basename(message.parameters['file_name'])
+    email = headers[constants.USER]
+    file_hash = headers.get(constants.FILE_HASH)
 
     try:
-        authorized = m_breaker.get_headers(message)[constants.AUTHORIZED]
+        authorized = headers[constants.AUTHORIZED]
     except KeyError as e:
         # file is public
         authorized = None
-    except Exception as e:
-        # TODO: find the exact exception
-        raise e
 
-    file = open(file_name, 'wb')
-    file.write(file_bytes)
-    file.close()
-    save_filename_to_db(file_name, email, authorized)
+    if file_hash is not None and message.file_size == 0 and file_hash != blob_store.EMPTY_HASH:
+        # the client did not send content that may already be stored
+        return save_to_db(file_name, email, authorized, file_hash)
+
+    if not incoming_file.valid or (file_hash is not None and file_hash != incoming_file.hexdigest()):
+        return codes.MESSAGE_CORRUPTED
+
+    if constants.ORIGINAL_SIZE in headers and int(headers[constants.ORIGINAL_SIZE]) != incoming_file.size:
+        return codes.MESSAGE_CORRUPTED
+
+    return save_incoming_file(file_name, email, authorized, incoming_file)
+
+
+def save_incoming_file(file_name: str, email: str, authorized, incoming_file: storage.IncomingFile) -> codes.Status:
+    """
+    saves a received file to the database, moving it into the blob store unless the same content is stored
+    :param file_name:
+    :param email: the owner of the file
+    :param authorized: emails of the users allowed to access the file, or None if it is public
+    :param incoming_file: storage.IncomingFile holding the received bytes of the file
+    :return: codes.Status -> the outcome of the upload
+    """
+    return save_to_db(file_name, email, authorized, incoming_file.hexdigest(), incoming_file)
+
+
+def name_taken(filename: str, owner_email: str) -> bool:
+    """
+    :param filename:
+    :param owner_email:
+    :return: True if another user already uploaded a file with this name
+    """
+    user_id = get_user_id(owner_email)
+    query = "SELECT user_id FROM Resources WHERE resource_path = %s"
+    rows = database.query(query, (filename,))
+    return any(row['user_id'] != user_id for row in rows)
 
 
-def save_filename_to_db(filename, owner_email, authorized=None):
+def save_filename_to_db(filename, owner_email, authorized=None, blob_hash=None, incoming_file=None):
     """
     Performs appropriate queries to keep track of this file
-    and user that can access it
+    and user that can access it.
+    A file the owner uploaded before under the same name is replaced.
+    Everything that may fail is checked before anything is changed.
+    Not committed, run by writer.write().
     :param filename:
     :param owner_email:
     :param authorized:
-    :return: None
+    :param blob_hash: sha256 of the content in the blob store
+    :param incoming_file: storage.IncomingFile holding the content, see blob_store.add_reference()
+    :return: (codes.Status, resource, user ids given access, generation, released blob hashes) ->
+    what acl.record_upload() and blob_store.reclaim() need
+    :raises RuntimeError: if the owner or an authorized user does not exist, nothing is changed
     """
     throwaway, file_type = os.path.splitext(filename)
 
     user_id = get_user_id(owner_email)
+    authorized_ids = [get_user_id(email) for email in authorized] if authorized else []
+
+    # checked here, so that no other upload can take the name in between
+    if name_taken(filename, owner_email):
+        return codes.FILE_NAME_TAKEN, None, [], None, []
+
+    if blob_hash and not blob_store.add_reference(blob_hash, incoming_file):
+        # the client sent only the hash of content that is not stored
+        return codes.CONTENT_NOT_FOUND, None, [], None, []
+
+    released = []
+    existing_command = 'SELECT resource_id, blob_hash FROM Resources WHERE resource_path = %s AND user_id = %s'
+    existing = database.query(existing_command, (filename, user_id))
+    if len(existing) > 0:
+        command = 'UPDATE Resources SET type = %s, upload_date = %s, public = %s, blob_hash = %s WHERE resource_id = %s'
+        cred = (file_type, datetime.now(), authorized is None, blob_hash, existing[0]['resource_id'])
+        database.query(command, cred)
+        database.query('DELETE FROM Access WHERE file_id = %s', (existing[0]['resource_id'],))
+        if existing[0]['blob_hash']:
+            blob_store.release(existing[0]['blob_hash'])
+            released.append(existing[0]['blob_hash'])
+        file_id = existing[0]['resource_id']
+    else:
+        command = ('INSERT INTO Resources (type, resource_path, upload_date, user_id, public, blob_hash) '
+                   'VALUES (%s, %s, %s, %s, %s, %s)')
+        cred = (file_type, filename, datetime.now(), user_id, authorized is None, blob_hash)
+        database.query(command, cred)
+        file_id = database.query_one(existing_command, (filename, user_id))['resource_id']
+
+    if authorized_ids:
+        access_query = 'INSERT INTO Access (user_id, file_id) VALUES (%s, %s)'
+        access_params = [(authorized_id, file_id) for authorized_id in authorized_ids]
+        database.executemany(access_query, access_params)
+
+    resource = {
+        'resource_id': file_id,
+        'user_id': user_id,
+        'public': authorized is None,
+        'blob_hash': blob_hash,
+        'type': file_type,
+    }
+    return codes.SUCCESS, resource, authorized_ids, acl.advance(), released
+
+
+def save_to_db(filename, owner_email, authorized=None, blob_hash=None, incoming_file=None) -> codes.Status:
+    """
+    Saves the file to the database with the writer, then adds it to the
+    authorization index and deletes the blob it replaced once it is committed
+    :param filename:
+    :param owner_email:
+    :param authorized:
+    :param blob_hash: sha256 of the content in the blob store
+    :param incoming_file: see save_filename_to_db()
+    :return: codes.Status -> the outcome of the upload
+    """
+    try:
+        code, resource, authorized_ids, generation, released = writer.write(
+            save_filename_to_db, filename, owner_email, authorized, blob_hash, incoming_file)
+    except Exception:
+        if incoming_file is not None:
+            # the received content may have been moved into the blob store before the write failed
+            writer.write(blob_store.reclaim, [blob_hash])
+        raise
 
-    command = 'INSERT INTO Resources (type, resource_path, upload_date, user_id, public) VALUES (%s, %s, %s, %s, %s)'
-    cred = (file_type, filename, datetime.now(), user_id, authorized is None)
-    result = database.query(command, cred)
-    database.commit()
-
-    if authorized:
-        file_command = 'SELECT * FROM Resources WHERE resource_path = %s'
-        file_params = (filename,)
-        file_id = database.query(file_command, file_params)[0]['resource_id']
-
-        for email in authorized:
-            access_user_id = get_user_id(email)
-            access_query = 'INSERT INTO Access (user_id, file_id) VALUES (%s, %s)'
-            access_params = (access_user_id, file_id)
-            access_result = database.query(access_query, access_params)
-            database.commit()
+    if released:
+        writer.write(blob_store.reclaim, released)
+    if code == codes.SUCCESS:
+        acl.record_upload(filename, resource, authorized_ids, generation)
+    return code
 
 
 def get_user_id(email: str):
@@ -92,11 +190,11 @@ def get_user_id(email: str):
     :param email:
     :return: user id
     """
-    query = "SELECT * FROM Users WHERE email = %s"
+    query = "SELECT user_id FROM Users WHERE email = %s"
     params = (email,)
-    result = database.query(query, params)
+    user_id = database.query_scalar(query, params)
 
-    if len(result) > 0:
-        return result[0]['user_id']
+    if user_id is not None:
+        return user_id
     else:
         raise RuntimeError('User with the specified email,', email, ', not found.')
@@ -0,0 +1,264 @@
+"""
+functions to handle chunked upload sessions
+a file is uploaded in numbered chunks, from any number of connections,
+and saved once every chunk has arrived and the session is committed
+"""
+import json
+import os
+import secrets
+import shutil
+import string
+import time
+
+from RequestHandlers import upload
+from Utilities import codes
+from Utilities import message_serializer
+from Utilities import storage
+
+SESSIONS_DIRECTORY = '.upload-sessions'
+SESSION_FILE = 'session.json'
+SESSION_TIMEOUT = 24 * 60 * 60  # seconds an untouched session is kept
+MIN_CHUNK_SIZE = 64 * 1024
+COMMITTING_PREFIX = '.committing-'
+EXPIRE_INTERVAL = 60  # seconds between looks for expired sessions
+
+last_expired = 0.0  # time.monotonic() of the last look for expired sessions
+
+
+def session_timeout() -> float:
+    """
+    :return: float -> seconds an untouched session is kept, taken from the
+    UPLOAD_SESSION_TIMEOUT environment variable when it is set
+    """
+    return float(os.getenv('UPLOAD_SESSION_TIMEOUT', SESSION_TIMEOUT))
+
+
+def sessions_path() -> str:
+    """
+    :return: str -> the directory the upload sessions are kept in
+    """
+    return os.path.join(storage.storage_directory(), SESSIONS_DIRECTORY)
+
+
+def session_path(session_id: str) -> str:
+    """
+    :param session_id:
+    :return: str -> the directory of the session
+    :raises KeyError: if the session id is not valid
+    """
+    if not session_id or any(character not in string.hexdigits for character in session_id):
+        raise KeyError('Invalid session id ' + str(session_id))
+    return os.path.join(sessions_path(), session_id)
+
+
+def load_session(session_id: str, email: str) -> dict:
+    """
+    :param session_id:
+    :param email: the user making the request
+    :return: dict -> the session details saved by begin()
+    :raises KeyError: if the session does not exist or belongs to another user
+    """
+    try:
+        with open(os.path.join(session_path(session_id), SESSION_FILE)) as session_file:
+            session = json.load(session_file)
+    except (FileNotFoundError, NotADirectoryError):
+        raise KeyError('Upload session ' + session_id + ' not found')
+
+    if session['email'] != email:
+        raise KeyError('Upload session ' + session_id + ' belongs to another user')
+
+    return session
+
+
+def chunk_count(session: dict) -> int:
+    """
+    :param session: dict as returned by load_session()
+    :return: int -> the number of chunks the file is split into
+    """
+    return max(1, -(-session['file_size'] // session['chunk_size']))
+
+
+def missing_chunks(session_id: str, session: dict) -> list:
+    """
+    :param session_id:
+    :param session: dict as returned by load_session()
+    :return: list -> numbers of the chunks that have not been received
+    """
+    received = set(os.listdir(session_path(session_id)))
+    return [number for number in range(chunk_count(session)) if str(number) not in received]
+
+
+def expire_sessions():
+    """
+    Deletes sessions that have not been touched within the session timeout
+    """
+    try:
+        names = os.listdir(sessions_path())
+    except FileNotFoundError:
+        return
+
+    oldest = time.time() - session_timeout()
+    for name in names:
+        path = os.path.join(sessions_path(), name)
+        try:
+            if os.stat(path).st_mtime < oldest:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def expire_interval() -> float:
+    """
+    :return: float -> seconds between looks for expired sessions, taken from the
+    UPLOAD_SESSION_EXPIRE_INTERVAL environment variable when it is set
+    """
+    return float(os.getenv('UPLOAD_SESSION_EXPIRE_INTERVAL', EXPIRE_INTERVAL))
+
+
+def expire_sessions_periodically():
+    """
+    Runs expire_sessions() at most once every expire interval, so that every
+    request on a session can call it without listing the sessions each time
+    """
+    global last_expired
+    now = time.monotonic()
+    if now - last_expired < expire_interval():
+        return
+    last_expired = now
+    expire_sessions()
+
+
+def begin(file_name: str, email: str, authorized, file_size: int, chunk_size: int) -> tuple:
+    """
+    Starts an upload session
+    :param file_name:
+    :param email: the owner of the file
+    :param authorized: emails of the users allowed to access the file, or None if it is public
+    :param file_size: size of the whole file
+    :param chunk_size: size of every chunk except the last one
+    :return: (response message, session id)
+    """
+    expire_sessions_periodically()
+
+    if file_size < 0 or chunk_size < MIN_CHUNK_SIZE:
+        response_string = message_serializer.build_response(codes.INVALID_FORMAT, file_size=0)
+        return response_string, ''
+
+    # fail before any chunk is sent if the owner does not exist or the name is taken
+    if upload.name_taken(os.path.basename(file_name), email):
+        return message_serializer.build_response(codes.FILE_NAME_TAKEN, file_size=0), ''
+
+    session_id = secrets.token_hex(16)
+    path = session_path(session_id)
+    os.makedirs(path)
+
+    session = {
+        'file_name': os.path.basename(file_name),
+        'email': email,
+        'authorized': authorized,
+        'file_size': file_size,
+        'chunk_size': chunk_size,
+    }
+    with open(os.path.join(path, SESSION_FILE), 'w') as session_file:
+        json.dump(session, session_file)
+
+    response_string = message_serializer.build_response(codes.SUCCESS, file_size=len(session_id))
+    return response_string, session_id
+
+
+def put_chunk(session_id: str, email: str, number: int, offset: int, checksum: str,
+              incoming_file: storage.IncomingFile) -> tuple:
+    """
+    Stores a chunk of the file
+    :param session_id:
+    :param email: the user making the request
+    :param number: number of the chunk, starting at 0
+    :param offset: position of the chunk in the file
+    :param checksum: sha256 of the chunk
+    :param incoming_file: storage.IncomingFile holding the received bytes of the chunk
+    :return: (response message, response data)
+    """
+    expire_sessions_periodically()
+
+    try:
+        session = load_session(session_id, email)
+    except KeyError:
+        return message_serializer.build_response(codes.UPLOAD_SESSION_NOT_FOUND, file_size=0), ''
+
+    if not incoming_file.valid:
+        return message_serializer.build_response(codes.MESSAGE_CORRUPTED, file_size=0), ''
+
+    expected_size = min(session['chunk_size'], session['file_size'] - offset)
+    if (number < 0 or number >= chunk_count(session) or offset != number * session['chunk_size'] or
+            incoming_file.size != expected_size):
+        return message_serializer.build_response(codes.INVALID_FORMAT, file_size=0), ''
+
+    if incoming_file.hexdigest() != checksum:
+        return message_serializer.build_response(codes.MESSAGE_CORRUPTED, file_size=0), ''
+
+    incoming_file.move_to(os.path.join(session_path(session_id), str(number)))
+
+    return message_serializer.build_response(codes.SUCCESS, file_size=0), ''
+
+
+def status(session_id: str, email: str) -> tuple:
+    """
+    Lists the chunks that have not been received
+    :param session_id:
+    :param email: the user making the request
+    :return: (response message, chunk numbers separated by CRLF)
+    """
+    expire_sessions_periodically()
+
+    try:
+        session = load_session(session_id, email)
+    except KeyError:
+        return message_serializer.build_response(codes.UPLOAD_SESSION_NOT_FOUND, file_size=0), ''
+
+    missing = '\r\n'.join(str(number) for number in missing_chunks(session_id, session))
+    response_string = message_serializer.build_response(codes.SUCCESS, file_size=len(missing))
+    return response_string, missing
+
+
+def commit(session_id: str, email: str) -> tuple:
+    """
+    Assembles the chunks into the file and saves it once every chunk has been received
+    :param session_id:
+    :param email: the user making the request
+    :return: (response message, missing chunk numbers separated by CRLF)
+    """
+    expire_sessions_periodically()
+
+    try:
+        session = load_session(session_id, email)
+    except KeyError:
+        return message_serializer.build_response(codes.UPLOAD_SESSION_NOT_FOUND, file_size=0), ''
+
+    missing = '\r\n'.join(str(number) for number in missing_chunks(session_id, session))
+    if missing:
+        response_string = message_serializer.build_response(codes.UPLOAD_INCOMPLETE, file_size=len(missing))
+        return response_string, missing
+
+    # only one connection may commit a session
+    committing_path = os.path.join(sessions_path(), COMMITTING_PREFIX + session_id)
+    try:
+        os.rename(session_path(session_id), committing_path)
+    except FileNotFoundError:
+        return message_serializer.build_response(codes.UPLOAD_SESSION_NOT_FOUND, file_size=0), ''
+    # not expired by another request while the chunks are assembled
+    os.utime(committing_path)
+
+    incoming_file = storage.IncomingFile()
+    try:
+        for number in range(chunk_count(session)):
+            with open(os.path.join(committing_path, str(number)), 'rb') as chunk_file:
+                for chunk in iter(lambda: chunk_file.read(storage.CHUNK_SIZE), b''):
+                    incoming_file.write(chunk)
+
+        code = upload.save_incoming_file(session['file_name'], session['email'], session['authorized'],
+                                         incoming_file)
+    finally:
+        incoming_file.discard()
+        shutil.rmtree(committing_path, ignore_errors=True)
+
+    return message_serializer.build_response(code, file_size=0), ''
@@ -0,0 +1,197 @@
+"""
+File containing the in-memory index that DOWNLOAD requests are authorized from.
+It holds the resources by path, the user ids by email, the public resources
+and the resources every user was given access to, so that checking a request
+takes dictionary lookups instead of queries.
+The index is loaded on first use. Every upload increments the generation
+stored in the database, in the transaction that saves the file, and then
+updates the index of its own process. Other processes notice the new
+generation, checked at most every ACL_CHECK_INTERVAL seconds, and reload.
+"""
+import os
+import threading
+import time
+
+from Utilities import database_manager as database
+
+ACL_CHECK_INTERVAL = 1  # seconds between reads of the generation, 0 to read it for every check
+
+
+class Index:
+    """
+    The authorization data of the database at a generation
+    """
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.resources = {}  # resource_path -> {'resource_id', 'user_id', 'public', 'blob_hash', 'type'}
+        self.users = {}  # email -> user_id
+        self.public = set()  # resource ids
+        self.grants = {}  # user_id -> set of resource ids the user was given access to
+        self.grantees = {}  # resource_id -> set of user ids given access to it
+        self.checked = time.monotonic()  # when the generation was last read
+
+    def add_resource(self, resource_path: str, resource: dict, authorized_ids=()):
+        """
+        Adds a resource, or replaces it and the access given to it
+        :param resource_path:
+        :param resource: {'resource_id', 'user_id', 'public', 'blob_hash', 'type'}
+        :param authorized_ids: user ids given access to the resource
+        """
+        resource_id = resource['resource_id']
+        for user_id in self.grantees.pop(resource_id, ()):
+            self.grants[user_id].discard(resource_id)
+
+        # the first resource saved under a path is the one requests refer to
+        if self.resources.get(resource_path, resource)['resource_id'] == resource_id:
+            self.resources[resource_path] = resource
+
+        if resource['public']:
+            self.public.add(resource_id)
+        else:
+            self.public.discard(resource_id)
+
+        for user_id in authorized_ids:
+            self.grant(user_id, resource_id)
+
+    def grant(self, user_id: int, resource_id: int):
+        """
+        :param user_id:
+        :param resource_id:
+        """
+        self.grants.setdefault(user_id, set()).add(resource_id)
+        self.grantees.setdefault(resource_id, set()).add(user_id)
+
+
+index = None
+index_lock = threading.Lock()
+
+
+def check_interval() -> float:
+    """
+    :return: float -> seconds between reads of the generation, taken from the
+    ACL_CHECK_INTERVAL environment variable when it is set
+    """
+    return float(os.getenv('ACL_CHECK_INTERVAL', ACL_CHECK_INTERVAL))
+
+
+def current_generation() -> int:
+    """
+    :return: int -> the generation stored in the database
+    """
+    return database.query_scalar('SELECT generation FROM Generation') or 0
+
+
+def advance() -> int:
+    """
+    Increments the generation, to be called in the transaction that changes the
+    resources or the access given to them. Not committed, run by writer.write().
+    :return: int -> the new generation
+    """
+    database.query('UPDATE Generation SET generation = generation + 1')
+    return current_generation()
+
+
+def load() -> Index:
+    """
+    Reads the index from the database. The generation is read first, so the
+    index is never older than its generation, at worst it is reloaded once more.
+    :return: Index
+    """
+    loaded = Index(current_generation())
+    for row in database.stream('SELECT resource_id, resource_path, user_id, public, blob_hash, type '
+                               'FROM Resources ORDER BY resource_id'):
+        loaded.add_resource(row['resource_path'], {
+            'resource_id': row['resource_id'],
+            'user_id': row['user_id'],
+            'public': row['public'] == 1,
+            'blob_hash': row['blob_hash'],
+            'type': row['type'],
+        })
+    for row in database.stream('SELECT user_id, email FROM Users'):
+        loaded.users[row['email']] = row['user_id']
+    for row in database.stream('SELECT user_id, file_id FROM Access'):
+        loaded.grant(row['user_id'], row['file_id'])
+    return loaded
+
+
+def get_index() -> Index:
+    """
+    :return: Index -> the index of this process, loaded again if another process changed the database
+    """
+    global index
+    current = index
+    if current is not None and time.monotonic() - current.checked < check_interval():
+        return current
+
+    generation = current_generation() if current is not None else None
+    with index_lock:
+        if index is not current:
+            # another thread reloaded it in the meantime
+            return index
+        if current is not None and generation <= current.generation:
+            current.checked = time.monotonic()
+            return current
+        index = load()
+        return index
+
+
+def resource(resource_path: str):
+    """
+    :param resource_path:
+    :return: dict -> {'resource_id', 'user_id', 'public', 'blob_hash', 'type'}, or None if there is no such file
+    """
+    return get_index().resources.get(resource_path)
+
+
+def user_id(email: str):
+    """
+    :param email:
+    :return: the user_id of the user, or None if the user does not exist
+    """
+    users = get_index().users
+    found = users.get(email)
+    if found is None:
+        # users registered since the index was loaded, they never change once registered
+        found = database.query_scalar("SELECT user_id FROM Users WHERE email = %s", (email,))
+        if found is not None:
+            users[email] = found
+    return found
+
+
+def may_read(email: str, resource_path: str) -> bool:
+    """
+    :param email:
+    :param resource_path:
+    :return: True if the file is public, owned by the user or the user was given access to it,
+    the same files a LIST shows, see list.VISIBLE_CONDITIONS
+    """
+    current = get_index()
+    found = current.resources.get(resource_path)
+    if found is None:
+        return False
+    if found['resource_id'] in current.public:
+        return True
+    requester = user_id(email)
+    return found['user_id'] == requester or found['resource_id'] in current.grants.get(requester, ())
+
+
+def record_upload(resource_path: str, resource: dict, authorized_ids, generation: int):
+    """
+    Updates the index once an upload is committed
+    :param resource_path:
+    :param resource: {'resource_id', 'user_id', 'public', 'blob_hash', 'type'}
+    :param authorized_ids: user ids given access to the resource
+    :param generation: as returned by advance() in the transaction of the upload
+    """
+    global index
+    with index_lock:
+        if index is None or generation <= index.generation:
+            # loaded with the upload already in it, or loaded on first use
+            return
+        if generation != index.generation + 1:
+            # another upload committed in between is not in the index yet
+            index = None
+            return
+        index.add_resource(resource_path, resource, authorized_ids)
+        index.generation = generation
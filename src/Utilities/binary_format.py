@@ -0,0 +1,122 @@
+"""
+File containing the layout of the binary TOKDOC framing.
+A client that starts its first frame with MAGIC uses the binary framing,
+for requests and responses, for the rest of the connection.
+
+Request frame:
+<header><fields><digest>
+header -> REQUEST_HEADER: magic, version, method code, flags, field count, fields length, file size
+fields -> field count times FIELD_HEADER (key length, value length) followed by the key and the value
+digest -> raw digest of the header and the fields, sha256 unless the connection chose
+another integrity algorithm, zero padded
+
+Response frame:
+<header><values><digest><response data>
+header -> RESPONSE_HEADER: magic, version, status code, flags, value count, values length, response data size
+values -> value count times VALUE_HEADER (value length) followed by the value
+digest -> raw digest of the header and the values, like the request digest
+"""
+import hashlib
+import struct
+
+from Utilities import constants
+from Utilities import integrity
+
+MAGIC = b'TK'  # cannot be the start of a text frame, which starts with a hex checksum
+VERSION = 1
+FLAGS = 0  # reserved
+
+REQUEST_HEADER = struct.Struct('!2sBBBBIQ')
+RESPONSE_HEADER = struct.Struct('!2sBHBBIQ')
+FIELD_HEADER = struct.Struct('!BH')
+VALUE_HEADER = struct.Struct('!H')
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+METHOD_CODES = {
+    constants.AUTH: 1,
+    constants.EXIT: 2,
+    constants.LIST: 3,
+    constants.UPLOAD: 4,
+    constants.DOWNLOAD: 5,
+    constants.UPLOAD_BEGIN: 6,
+    constants.UPLOAD_CHUNK: 7,
+    constants.UPLOAD_STATUS: 8,
+    constants.UPLOAD_COMMIT: 9,
+}
+METHODS = {code: method for method, code in METHOD_CODES.items()}
+
+# fields that hold the parameters of the method line of a text message, every other field is a header
+PARAMETER_FIELDS = (constants.AUTH_EMAIL_KEY, constants.AUTH_PASSWORD_KEY, 'file_name', 'ip', 'port')
+
+
+def is_correct_digest(digest, message, algorithm: str = None) -> bool:
+    """
+    :param digest: the raw digest sent at the end of the frame
+    :param message: the frame without the digest
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :return: true if the digest matches the message
+    """
+    return integrity.is_correct_digest(digest, message, algorithm)
+
+
+def encode_fields(fields: dict) -> bytes:
+    """
+    :param fields: dict of str keys and str values
+    :return: bytes -> the length prefixed fields
+    """
+    encoded = bytearray()
+    for key, value in fields.items():
+        key = key.encode()
+        value = str(value).encode()
+        encoded += FIELD_HEADER.pack(len(key), len(value)) + key + value
+    return bytes(encoded)
+
+
+def decode_fields(data, count: int) -> dict:
+    """
+    :param data: bytes or memoryview of the fields
+    :param count: number of fields
+    :return: dict -> str keys and str values
+    :raises ValueError: if the fields do not fill data exactly
+    """
+    fields = {}
+    offset = 0
+    for field in range(count):
+        key_length, value_length = FIELD_HEADER.unpack_from(data, offset)
+        offset += FIELD_HEADER.size
+        key = bytes(data[offset:offset + key_length]).decode()
+        offset += key_length
+        value = bytes(data[offset:offset + value_length]).decode()
+        offset += value_length
+        fields[key] = value
+
+    if offset != len(data):
+        raise ValueError('The fields do not match the fields length')
+    return fields
+
+
+def encode_values(values: list) -> bytes:
+    """
+    :param values: list of str
+    :return: bytes -> the length prefixed values
+    """
+    encoded = bytearray()
+    for value in values:
+        value = str(value).encode()
+        encoded += VALUE_HEADER.pack(len(value)) + value
+    return bytes(encoded)
+
+
+def build_request(method: str, fields: dict, file_size: int = 0, algorithm: str = None) -> bytes:
+    """
+    Builds a binary request frame, as a client would
+    :param method: e.g. constants.LIST
+    :param fields: parameters and headers, AUTHORIZED as comma separated emails
+    :param file_size: size of the file body that follows the frame
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :return: bytes
+    """
+    encoded_fields = encode_fields(fields)
+    header = REQUEST_HEADER.pack(MAGIC, VERSION, METHOD_CODES[method], FLAGS, len(fields),
+                                 len(encoded_fields), file_size)
+    return header + encoded_fields + integrity.frame_digest(header + encoded_fields, algorithm, DIGEST_SIZE)
@@ -0,0 +1,140 @@
+"""
+File containing functions to handle the content-addressed blob store.
+Every distinct file content is stored once, named by its sha256, in a
+fan-out directory tree. Resources rows point at a blob and the Blobs
+table counts how many rows point at each blob. The tables are created by
+schema.create_blob_tables().
+Blobs are added and deleted by the writer, with the row of the blob locked,
+and a blob is only deleted by reclaim() once the release of its last
+reference is committed.
+"""
+import hashlib
+import os
+
+from Utilities import database_manager as database
+from Utilities import storage
+
+BLOBS_DIRECTORY = 'blobs'
+FAN_OUT_LEVELS = 2  # directory levels, each named after the next two characters of the hash
+EMPTY_HASH = hashlib.sha256(b'').hexdigest()
+
+# how each backend inserts a row unless one with the same key exists
+INSERT_IGNORE = {
+    database.SQLITE_BACKEND: 'INSERT OR IGNORE',
+    database.MYSQL_BACKEND: 'INSERT IGNORE',
+}
+
+# how each backend locks the row of a blob until the transaction ends, SQLite locks the whole database
+LOCK_ROW = {
+    database.SQLITE_BACKEND: '',
+    database.MYSQL_BACKEND: ' FOR UPDATE',
+}
+
+
+def blob_path(blob_hash: str) -> str:
+    """
+    :param blob_hash: sha256 of the content
+    :return: str -> the path the blob is stored at
+    """
+    if len(blob_hash) != 64 or any(character not in '0123456789abcdef' for character in blob_hash):
+        raise ValueError('Invalid blob hash ' + blob_hash)
+
+    levels = [blob_hash[2 * level: 2 * level + 2] for level in range(FAN_OUT_LEVELS)]
+    return os.path.join(storage.storage_directory(), BLOBS_DIRECTORY, *levels, blob_hash)
+
+
+def record(blob_hash: str, size: int):
+    """
+    Adds a blob to the Blobs table, unless it is there already. Not committed.
+    :param blob_hash: sha256 of the content
+    :param size: size of the content
+    """
+    query = INSERT_IGNORE[database.active_backend] + " INTO Blobs (blob_hash, size, reference_count) VALUES (%s, %s, 0)"
+    database.query(query, (blob_hash, size))
+
+
+def locked_reference_count(blob_hash: str):
+    """
+    Reads the reference count of a blob, locking its row until the transaction ends. Not committed.
+    :param blob_hash: sha256 of the content
+    :return: int -> the reference count, or None if the blob is not in the Blobs table
+    """
+    query = "SELECT reference_count FROM Blobs WHERE blob_hash = %s" + LOCK_ROW[database.active_backend]
+    return database.query_scalar(query, (blob_hash,))
+
+
+def add_reference(blob_hash: str, incoming_file: storage.IncomingFile = None) -> bool:
+    """
+    Counts a Resources row that points at the blob. The blob file is checked
+    while the row is locked, and moved into place from the incoming file if it
+    is missing, so a blob reclaimed by another process is never referenced.
+    Not committed, run by writer.write().
+    :param blob_hash: sha256 of the content
+    :param incoming_file: storage.IncomingFile holding the content, None if the client only sent its hash
+    :return: True if the reference was added, False if the content is not stored and was not received
+    """
+    if incoming_file is not None:
+        record(blob_hash, incoming_file.size)
+
+    if locked_reference_count(blob_hash) is None:
+        return False
+
+    path = blob_path(blob_hash)
+    if not os.path.exists(path):
+        if incoming_file is None:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        incoming_file.move_to(path)
+
+    query = "UPDATE Blobs SET reference_count = reference_count + 1 WHERE blob_hash = %s"
+    database.query(query, (blob_hash,))
+    return True
+
+
+def release(blob_hash: str):
+    """
+    Removes a reference to the blob. The blob is kept until reclaim() is called
+    once the change is committed. Not committed, run by writer.write().
+    :param blob_hash: sha256 of the content
+    """
+    query = "UPDATE Blobs SET reference_count = reference_count - 1 WHERE blob_hash = %s"
+    database.query(query, (blob_hash,))
+
+
+def reclaim(blob_hashes):
+    """
+    Deletes the blobs nothing points at, with their cached compressed copies.
+    Run by writer.write() after the writes that released the blobs are committed,
+    the reference count is read again with the row locked.
+    :param blob_hashes: sha256 of the contents released, or added by a write that failed
+    """
+    for blob_hash in blob_hashes:
+        reference_count = locked_reference_count(blob_hash)
+        if reference_count is not None and reference_count > 0:
+            continue
+
+        database.query("DELETE FROM Blobs WHERE blob_hash = %s", (blob_hash,))
+        path = blob_path(blob_hash)
+        storage.remove_cached(path)
+        directory = os.path.dirname(path)
+        # the blob and the compressed copies cached next to it by earlier versions
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if name == blob_hash or name.startswith(blob_hash + '.'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+def resource_path(filename: str) -> str:
+    """
+    :param filename: resource_path of a Resources row
+    :return: str -> where the content of the file is stored
+    """
+    query = "SELECT blob_hash FROM Resources WHERE resource_path = %s"
+    blob_hash = database.query_scalar(query, (filename,))
+    if blob_hash:
+        return blob_path(blob_hash)
+
+    # files uploaded before the blob store was introduced
+    return storage.storage_path(filename)
@@ -1,5 +1,5 @@
-import hashlib
 import Utilities.constants as constants
+from Utilities import integrity
 from Utilities.message_parser import get_message_string as get_message_string
 
 
@@ -12,10 +12,11 @@ def get_checksum(message) -> str:
     return message[:constants.CHECKSUM_LENGTH]
 
 
-def generate_checksum(message) -> str:
+def generate_checksum(message, algorithm: str = None) -> str:
     """
     :param message:
-    :return: str -> a sha256 checksum of the given message
+    :param algorithm: one of integrity.ALGORITHMS, sha256 by default
+    :return: str -> the checksum of the given message, as sent at the start of a frame
     """
     message = get_message_string(message)
-    return hashlib.sha256(message.encode()).hexdigest()
+    return integrity.frame_checksum(message.encode(), algorithm).decode()
@@ -2,6 +2,8 @@ class Status:
     def __init__(self, code: int, status: str):
         self.code = code
         self.status = status
+        # the status as it appears in a response line, encoded once
+        self.encoded = (str(code) + ' "' + status + '"').encode()
 
     def code(self):
         return self.code
@@ -11,14 +13,21 @@ class Status:
 
 
 SUCCESS = Status(**{'code': 201, 'status': 'Success'})
+PARTIAL_CONTENT = Status(**{'code': 202, 'status': 'Partial content'})
 SUCCESSFUL_AUTHENTICATION = Status(**{'code': 200, 'status': 'Successful authentication'})
 INCORRECT_CREDENTIALS = Status(**{'code': 501, 'status': 'Incorrect credentials'})
 MESSAGE_CORRUPTED = Status(**{'code': 502, 'status': 'Corrupted'})
 SIGN_UP_ERROR = Status(**{'code': 503, 'status': 'Sign up error'})
 FILE_NOT_FOUND = Status(**{'code': 301, 'status': 'File not found'})
 NO_FILES_FOUND = Status(**{'code': 303, 'status': 'No files found'})
+CONTENT_NOT_FOUND = Status(**{'code': 304, 'status': 'Content not found'})
 ACCESS_DENIED = Status(**{'code': 302, 'status': 'Access denied'}) #ACCESS_DENIED = Status(**{'code': 302, 'status': 'Access to this file is denied'})
 INTERNAL_SERVER_ERROR = Status(**{'code': 500, 'status': 'Internal Server Error'})
 EXITING_AUTHORIZED = Status(**{'code': 201, 'status': 'Exiting authorized'})
 INVALID_FORMAT = Status(**{'code': 504, 'status': 'Invalid format'})
-USER_NOT_EXIST = Status(**{'code': 505, 'status': 'User does not exist'})
\ No newline at end of file
+USER_NOT_EXIST = Status(**{'code': 505, 'status': 'User does not exist'})
+REQUEST_TIMEOUT = Status(**{'code': 506, 'status': 'Request timeout'})
+RANGE_NOT_SATISFIABLE = Status(**{'code': 507, 'status': 'Range not satisfiable'})
+UPLOAD_SESSION_NOT_FOUND = Status(**{'code': 508, 'status': 'Upload session not found'})
+UPLOAD_INCOMPLETE = Status(**{'code': 509, 'status': 'Upload incomplete'})
+FILE_NAME_TAKEN = Status(**{'code': 510, 'status': 'File name taken'})
@@ -0,0 +1,236 @@
+"""
+File containing the stdlib codecs that file bodies may be compressed with.
+The client lists the codecs it accepts in a COMPRESSION header:
+COMPRESSION:<codec>[:<level>][,<codec>[:<level>]...]
+and the first codec the server supports is used.
+Compressed copies of stored files are made in the background and cached,
+until a copy is ready the file is sent as it is.
+"""
+import bz2
+import lzma
+import os
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from Utilities import constants
+
+CHUNK_SIZE = 256 * 1024
+COMPRESSION_WORKERS = 1  # compressed copies made at once
+
+# codec -> (lowest level, highest level, default level)
+LEVELS = {
+    'zlib': (0, 9, 6),
+    'bz2': (1, 9, 9),
+    'lzma': (0, 9, 6),
+}
+
+# file types that are already compressed and are sent as they are
+COMPRESSED_TYPES = {
+    '.7z', '.aac', '.avi', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jar', '.jpeg',
+    '.jpg', '.lz4', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.pdf', '.png', '.pptx', '.rar',
+    '.tgz', '.webm', '.webp', '.xlsx', '.xz', '.zip', '.zst',
+}
+
+executor = None
+executor_lock = threading.Lock()
+pending = set()  # cached paths of the compressed copies being made
+pending_lock = threading.Lock()
+
+
+def negotiate(headers: dict):
+    """
+    Picks the codec to use from the COMPRESSION header
+    :param headers: dict as returned by message_parser.get_headers()
+    :return: (codec, level) or None if the client did not ask for a supported codec
+    """
+    if constants.COMPRESSION not in headers:
+        return None
+
+    for option in headers[constants.COMPRESSION].split(constants.COMMA):
+        codec, separator, level = option.partition(':')
+        if codec not in LEVELS:
+            continue
+
+        lowest, highest, default = LEVELS[codec]
+        try:
+            level = int(level) if level else default
+        except ValueError:
+            level = default
+        return codec, min(max(level, lowest), highest)
+
+    return None
+
+
+def request_codec(headers: dict):
+    """
+    :param headers: dict as returned by message_parser.get_headers()
+    :return: str -> the codec the body of the request was compressed with, or None
+    """
+    if constants.COMPRESSION not in headers:
+        return None
+    return headers[constants.COMPRESSION].partition(':')[0]
+
+
+def original_size(headers: dict):
+    """
+    :param headers: dict as returned by message_parser.get_headers()
+    :return: int -> the ORIGINAL_SIZE the client gave for a compressed body, or None
+    if it gave none or it is not a number
+    """
+    try:
+        return int(headers[constants.ORIGINAL_SIZE])
+    except (KeyError, ValueError):
+        return None
+
+
+def is_compressed_type(file_type: str) -> bool:
+    """
+    :param file_type: the type column of a Resources row, e.g. '.png'
+    :return: True if files of this type are already compressed
+    """
+    return (file_type or '').lower() in COMPRESSED_TYPES
+
+
+def compressor(codec: str, level: int):
+    """
+    :param codec: one of LEVELS
+    :param level:
+    :return: an object with compress(data) and flush() methods
+    """
+    if codec == 'zlib':
+        return zlib.compressobj(level)
+    elif codec == 'bz2':
+        return bz2.BZ2Compressor(level)
+    elif codec == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError('Unsupported codec ' + str(codec))
+
+
+class StreamDecompressor:
+    """
+    Decompresses a stream chunk by chunk, never producing more than
+    CHUNK_SIZE bytes at a time so that a small body cannot expand into
+    a large amount of memory.
+    """
+
+    def __init__(self, codec: str):
+        if codec == 'zlib':
+            self.decompressor = zlib.decompressobj()
+        elif codec == 'bz2':
+            self.decompressor = bz2.BZ2Decompressor()
+        elif codec == 'lzma':
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            raise ValueError('Unsupported codec ' + str(codec))
+        self.codec = codec
+
+    def decompress(self, data):
+        """
+        :param data: the next compressed bytes
+        :return: generator of decompressed chunks
+        :raises ValueError: if the data is not a valid stream
+        """
+        try:
+            if self.codec == 'zlib':
+                while data:
+                    yield self.decompressor.decompress(data, CHUNK_SIZE)
+                    data = self.decompressor.unconsumed_tail
+            else:
+                chunk = self.decompressor.decompress(data, CHUNK_SIZE)
+                yield chunk
+                while not self.decompressor.needs_input and not self.decompressor.eof:
+                    yield self.decompressor.decompress(b'', CHUNK_SIZE)
+        except (zlib.error, lzma.LZMAError, OSError, EOFError) as e:
+            raise ValueError('Invalid ' + self.codec + ' stream') from e
+
+    def finish(self) -> bytes:
+        """
+        :return: bytes -> output zlib may still hold back
+        :raises ValueError: if the stream ended early
+        """
+        remaining = self.decompressor.flush() if self.codec == 'zlib' else b''
+        if not self.decompressor.eof:
+            raise ValueError('Truncated ' + self.codec + ' stream')
+        return remaining
+
+
+def pool() -> ThreadPoolExecutor:
+    """
+    :return: ThreadPoolExecutor -> the pool compressed copies are made in, with
+    COMPRESSION_WORKERS threads (environment variable of the same name)
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            workers = int(os.getenv('COMPRESSION_WORKERS', COMPRESSION_WORKERS))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compression')
+    return executor
+
+
+def is_cached(path: str, cached_path: str) -> bool:
+    """
+    :param path: path of the original file
+    :param cached_path: where the compressed copy of the file is cached
+    :return: True if the compressed copy exists and is not older than the file
+    """
+    try:
+        return os.stat(cached_path).st_mtime >= os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def compress_later(path: str, cached_path: str, codec: str, level: int):
+    """
+    Makes the compressed copy of the file in pool(), unless it is already being made,
+    so that the request asking for it does not wait. Requests are answered with the
+    file as it is until the copy is ready.
+    :param path: path of the original file
+    :param cached_path: where the compressed copy of the file is cached
+    :param codec:
+    :param level:
+    """
+    with pending_lock:
+        if cached_path in pending:
+            return
+        pending.add(cached_path)
+
+    def compress():
+        try:
+            compress_file(path, cached_path, codec, level)
+        except OSError as e:
+            print('Could not compress ' + path + ': ' + str(e))
+        finally:
+            with pending_lock:
+                pending.discard(cached_path)
+
+    try:
+        pool().submit(compress)
+    except RuntimeError:
+        # the pool was shut down
+        with pending_lock:
+            pending.discard(cached_path)
+
+
+def compress_file(path: str, cached_path: str, codec: str, level: int):
+    """
+    Writes the compressed copy of the file, replacing the copy at cached_path once it is complete
+    :param path: path of the original file
+    :param cached_path: where the compressed copy of the file is cached
+    :param codec:
+    :param level:
+    """
+    directory = os.path.dirname(cached_path)
+    os.makedirs(directory, exist_ok=True)
+    stream_compressor = compressor(codec, level)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+    try:
+        with open(path, 'rb') as source, os.fdopen(file_descriptor, 'wb') as destination:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                destination.write(stream_compressor.compress(chunk))
+            destination.write(stream_compressor.flush())
+        os.replace(temporary_path, cached_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
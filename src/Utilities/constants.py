@@ -19,17 +19,38 @@ LIST = 'LIST'
 DOWNLOAD = 'DOWNLOAD'
 AUTH = 'AUTH'
 EXIT = 'EXIT'
+UPLOAD_BEGIN = 'UPLOAD_BEGIN'
+UPLOAD_CHUNK = 'UPLOAD_CHUNK'
+UPLOAD_STATUS = 'UPLOAD_STATUS'
+UPLOAD_COMMIT = 'UPLOAD_COMMIT'
 USER = 'USER'
 ACCESS_KEY = 'ACCESS_KEY'
 TIMESTAMP = 'TIMESTAMP'
 AUTHORIZED = 'AUTHORIZED'
 FILE_SIZE = 'FILE_SIZE'
+RANGE = 'RANGE'
+FILE_HASH = 'FILE_HASH'
+COMPRESSION = 'COMPRESSION'
+ORIGINAL_SIZE = 'ORIGINAL_SIZE'
+SESSION = 'SESSION'
+CHUNK = 'CHUNK'
+CHUNK_SIZE = 'CHUNK_SIZE'
+OFFSET = 'OFFSET'
+CHUNK_CHECKSUM = 'CHUNK_CHECKSUM'
+INTEGRITY = 'INTEGRITY'
+FILE_DIGEST = 'FILE_DIGEST'
+PAGE_SIZE = 'PAGE_SIZE'
+CURSOR = 'CURSOR'
+PREFIX = 'PREFIX'
+TYPE = 'TYPE'
+UPLOADED = 'UPLOADED'
 PARAMETERS_KEY = 'parameters'
 HEADERS = 'headers'
 FILE_SIZE_KEY = 'file_size'
 METHOD_KEY = 'method'
 METHOD_GROUP_KEY = 'method_group'
 QUOTES = '"'
+COMMA = ','
 STATUS_CODE_KEY = 'status_code'
 STATUS_MESSAGE_KEY = 'status_message'
 ACCESS_KEY_KEY = 'access_key'
@@ -1,94 +1,382 @@
 """
 File containing utility methods to handle database connections and database
 querying.
+Connections are kept in a pool. A thread checks one out with connection(),
+or implicitly with its first query(), and query() and commit() use the
+connection the calling thread has checked out, so request handlers can run
+in several threads at once without sharing a cursor.
+The backend is SQLite unless DATABASE_BACKEND is set to mysql.
 """
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
 from dotenv import load_dotenv
 
-connection = None
-cursor = None
+SQLITE_BACKEND = 'sqlite'
+MYSQL_BACKEND = 'mysql'
+SQLITE_PATH = 'database.db'
+POOL_SIZE = 8  # connections open at once
+POOL_TIMEOUT = 30  # seconds to wait for a connection when all of them are checked out
+HEALTH_CHECK_INTERVAL = 30  # seconds a connection may be idle before it is checked again
+STATEMENT_CACHE_SIZE = 256  # translated queries, and prepared statements per SQLite connection
+FETCH_SIZE = 256  # rows read from the cursor at a time by stream()
+
+# rows are returned as sqlite3.Row by SQLite and as dicts by MySQL, both indexed by column name
+CURSOR_OPTIONS = {MYSQL_BACKEND: {'dictionary': True, 'buffered': True}}
+
+pool = None
+active_backend = None
+translated = {}  # query template -> the query in the parameter style of active_backend
+# errors raised when the database is unreachable, busy or out of connections, extended by connect() for MySQL
+unavailable_errors = (TimeoutError, sqlite3.OperationalError)
+
+
+class ThreadConnection(threading.local):
+    """
+    The connection checked out by each thread, None while it has none
+    """
+    pooled = None
+
+
+local = ThreadConnection()
+
+
+class PooledConnection:
+    """
+    A database connection with the cursor used to query it
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor(**CURSOR_OPTIONS.get(active_backend, {}))
+        self.last_used = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        """
+        :return: True if the connection still answers queries
+        """
+        try:
+            self.cursor.execute('SELECT 1')
+            self.cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Hands out at most max_size connections, opening them as they are needed
+    and reusing the ones that are released
+    """
+
+    def __init__(self, connect, max_size: int, timeout: float):
+        """
+        :param connect: function returning a new database connection
+        :param max_size: most connections open at once
+        :param timeout: seconds acquire() waits for a connection to be released
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = []  # released connections, most recently used last
+        self.size = 0  # connections open, idle or checked out
+        self.condition = threading.Condition()
+
+    def acquire(self) -> PooledConnection:
+        """
+        :return: PooledConnection -> a connection for the caller alone, until it is released
+        :raises TimeoutError: if no connection was released within the timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.idle or self.size < self.max_size, self.timeout):
+                raise TimeoutError('No database connection was released within ' + str(self.timeout) + ' seconds')
+            pooled = self.idle.pop() if self.idle else None
+            if pooled is None:
+                self.size += 1
+
+        if pooled is not None and time.monotonic() - pooled.last_used < health_check_interval():
+            return pooled
+        if pooled is not None:
+            if pooled.is_healthy():
+                return pooled
+            pooled.close()
+
+        try:
+            return PooledConnection(self.connect())
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, pooled: PooledConnection, discard: bool = False):
+        """
+        Returns a connection to the pool. Changes that were not committed are rolled back.
+        :param pooled: a connection returned by acquire()
+        :param discard: True to close the connection instead, e.g. after it failed
+        """
+        if not discard:
+            try:
+                pooled.connection.rollback()
+            except Exception:
+                discard = True
+
+        with self.condition:
+            if discard:
+                pooled.close()
+                self.size -= 1
+            else:
+                pooled.last_used = time.monotonic()
+                self.idle.append(pooled)
+            self.condition.notify()
+
+    def close(self):
+        """
+        Closes the idle connections
+        """
+        with self.condition:
+            for pooled in self.idle:
+                pooled.close()
+            self.size -= len(self.idle)
+            self.idle = []
+
+
+def health_check_interval() -> float:
+    """
+    :return: float -> seconds a connection may be idle before it is checked, taken
+    from the DATABASE_HEALTH_CHECK_INTERVAL environment variable when it is set
+    """
+    return float(os.getenv('DATABASE_HEALTH_CHECK_INTERVAL', HEALTH_CHECK_INTERVAL))
+
+
+def backend() -> str:
+    """
+    :return: str -> SQLITE_BACKEND or MYSQL_BACKEND, taken from the
+    DATABASE_BACKEND environment variable when it is set
+    """
+    return os.getenv('DATABASE_BACKEND', SQLITE_BACKEND).lower()
+
+
+def connect_sqlite():
+    """
+    :return: a new SQLite connection. It may be used by one thread at a time,
+    not necessarily the one that opened it. The database is switched to WAL
+    journaling, so that reads are not blocked while the writer commits.
+    """
+    connection = sqlite3.connect(os.getenv('DATABASE_PATH', SQLITE_PATH), check_same_thread=False,
+                                 cached_statements=STATEMENT_CACHE_SIZE)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def connect_mysql():
+    """
+    :return: a new MySQL connection, configured by the HOST, DATABASE, USERNAME,
+    PASSWORD and SSL_CERT environment variables. Reads see the latest commit,
+    writes are made in the transactions of writer.
+    """
+    import mysql.connector
+
+    return mysql.connector.connect(
+        host=os.getenv("HOST"),
+        database=os.getenv("DATABASE"),
+        user=os.getenv("USERNAME"),
+        password=os.getenv("PASSWORD"),
+        ssl_ca=os.getenv("SSL_CERT"),
+        autocommit=True
+    )
 
 
 def connect():
     """
-    Initiates a connection to the database.
+    Creates the connection pool, connections are opened as they are needed.
     Should be called on server startup.
     """
     load_dotenv()
-    global connection, cursor
+    global pool, active_backend, unavailable_errors
 
-    if connection:
+    if pool:
         print('A connection to the database has already been established')
         return
 
-    connection = sqlite3.connect('database.db')
-    print(connection)
-    cursor = connection.cursor()
-
-
-#     print(cursor.execute('''SELECT
-#     name
-# FROM
-#     sqlite_schema
-# WHERE
-#     type ='table' AND
-#     name NOT LIKE 'sqlite_%';''').fetchall())
-
-# connection = mysql.connector.connect(
-#     host=os.getenv("HOST"),
-#     database=os.getenv("DATABASE"),
-#     user=os.getenv("USERNAME"),
-#     password=os.getenv("PASSWORD"),
-#     ssl_ca=os.getenv("SSL_CERT")
-# )
-#
-# try:
-#     if connection.is_connected():
-#         cursor = connection.cursor()
-#     cursor.execute("select @@version ")
-#     version = cursor.fetchone()
-#     if version:
-#         print('Running version: ', version)
-#     else:
-#         print('Not connected.')
-# except Error as e:
-#     raise Exception("Error while connecting to MySQL", e)
-
-
-def query(query_template, query_values=None) -> list[dict]:
+    active_backend = backend()
+    translated.clear()
+    connect_backend = connect_mysql if active_backend == MYSQL_BACKEND else connect_sqlite
+    if active_backend == MYSQL_BACKEND:
+        import mysql.connector
+
+        unavailable_errors = (TimeoutError, sqlite3.OperationalError, mysql.connector.errors.OperationalError,
+                              mysql.connector.errors.InterfaceError)
+    pool = ConnectionPool(connect_backend, int(os.getenv('DATABASE_POOL_SIZE', POOL_SIZE)),
+                          float(os.getenv('DATABASE_POOL_TIMEOUT', POOL_TIMEOUT)))
+    print('Database:', active_backend + ',', 'pool of', pool.max_size, 'connections')
+
+
+@contextmanager
+def connection():
+    """
+    Checks out a connection for the calling thread, used by query() and commit()
+    until the block ends. Nested blocks use the connection of the outer block.
+    :return: context manager giving the PooledConnection
+    """
+    pooled = local.pooled
+    if pooled is not None:
+        yield pooled
+        return
+
+    pooled = pool.acquire()
+    local.pooled = pooled
+    failed = False
+    try:
+        yield pooled
+    except Exception:
+        failed = not pooled.is_healthy()
+        raise
+    finally:
+        local.pooled = None
+        pool.release(pooled, failed)
+
+
+def run(function, *args):
+    """
+    Calls the function with a connection checked out, for work handed to an executor
+    :param function:
+    :param args: arguments of the function
+    :return: what the function returns
+    """
+    with connection():
+        return function(*args)
+
+
+def current() -> PooledConnection:
+    """
+    :return: PooledConnection -> the connection of the calling thread. A thread that is
+    not inside connection() checks one out and keeps it until release() is called.
+    """
+    pooled = local.pooled
+    if pooled is None:
+        pooled = pool.acquire()
+        local.pooled = pooled
+    return pooled
+
+
+def release():
+    """
+    Returns the connection a thread checked out outside connection() to the pool
+    """
+    pooled = local.pooled
+    if pooled is not None:
+        local.pooled = None
+        pool.release(pooled)
+
+
+def translate(query_template: str) -> str:
+    """
+    Translates a query written with %s parameters for the backend, once per query
+    :param query_template: A SQL query that may or may not contain parameters
+    :return: str -> the query in the parameter style of active_backend
+    """
+    query = translated.get(query_template)
+    if query is None:
+        query = query_template.replace('%s', '?') if active_backend == SQLITE_BACKEND else query_template
+        if len(translated) >= STATEMENT_CACHE_SIZE:
+            translated.clear()
+        translated[query_template] = query
+    return query
+
+
+def execute(query_template, query_values=None):
+    """
+    :param query_template: A SQL query that may or may not contain parameters
+    :param query_values: A tuple of values to be used as SQL query parameters
+    :return: the cursor of the calling thread, holding the result of the query
+    """
+    pooled = local.pooled
+    cursor = (pooled if pooled is not None else current()).cursor
+    query = translated.get(query_template)
+    cursor.execute(query if query is not None else translate(query_template), query_values or ())
+    return cursor
+
+
+def query(query_template, query_values=None) -> list:
     """
     Query the database.
     Leave query_values as none if you do not wish to use query parameters
     :param query_template: A SQL query that may or may not contain parameters
     :param query_values: A tuple of values to be used as SQL query parameters
-    :return: An array of dictionaries representing the rows returned from the query.
-    """
-    # get cursor
-    # cursor = connection.cursor()
-    # execute query
-    query_template = str(query_template).replace('%s', '?')
-    cursor.execute(query_template, query_values)
-    # get rows
-    result_rows = cursor.fetchall()
-    # get field names
-    try:
-        field_names = [i[0] for i in cursor.description]
-    except TypeError:
+    :return: An array of the rows returned from the query, indexed by column name
+    """
+    cursor = execute(query_template, query_values)
+    if cursor.description is None:
         return []
+    return cursor.fetchall()
 
-    # map field names to value in dictionary
-    entry = dict()
-    results = []
-    for row in result_rows:
-        entry = dict()
-        i = 0
-        for column_value in row:
-            entry[field_names[i]] = column_value
-            i += 1
-        results.append(entry)
 
-    return results
+def query_one(query_template, query_values=None):
+    """
+    :param query_template: A SQL query that may or may not contain parameters
+    :param query_values: A tuple of values to be used as SQL query parameters
+    :return: the first row returned from the query, indexed by column name, or None if there is none
+    """
+    cursor = execute(query_template, query_values)
+    if cursor.description is None:
+        return None
+    return cursor.fetchone()
+
+
+def query_scalar(query_template, query_values=None):
+    """
+    :param query_template: A SQL query that may or may not contain parameters
+    :param query_values: A tuple of values to be used as SQL query parameters
+    :return: the first column of the first row returned from the query, or None if there is none
+    """
+    cursor = execute(query_template, query_values)
+    if cursor.description is None:
+        return None
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0] if active_backend == SQLITE_BACKEND else next(iter(row.values()))
+
+
+def stream(query_template, query_values=None, batch_size: int = FETCH_SIZE):
+    """
+    Reads the rows returned from a query a batch at a time, rather than all at once.
+    The calling thread should not run other queries until it has read the rows it needs.
+    :param query_template: A SQL query that may or may not contain parameters
+    :param query_values: A tuple of values to be used as SQL query parameters
+    :param batch_size: rows fetched from the cursor at a time
+    :return: generator of the rows, indexed by column name
+    """
+    cursor = execute(query_template, query_values)
+    if cursor.description is None:
+        return
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany(batch_size)
+
+
+def executemany(query_template, query_values_list) -> int:
+    """
+    Runs a query once for each tuple of parameters, in a single call to the database
+    :param query_template: A SQL query that contains parameters
+    :param query_values_list: iterable of tuples of values to be used as SQL query parameters
+    :return: int -> number of rows changed
+    """
+    cursor = current().cursor
+    cursor.executemany(translate(query_template), query_values_list)
+    return cursor.rowcount
 
 
 def commit():
@@ -96,16 +384,21 @@ def commit():
     Save transactions to disk
     :return:
     """
-    if connection is not None:
-        connection.commit()
+    pooled = local.pooled
+    if pooled is not None:
+        pooled.connection.commit()
 
 
 def disconnect():
     """
-    Closes the database connection.
+    Closes the database connections.
     Should be called on server shutdown.
     """
-    try:
-        connection.close()
-    except AttributeError:
+    global pool
+    if pool is None:
         print('The database connection has already been closed.')
+        return
+
+    release()
+    pool.close()
+    pool = None
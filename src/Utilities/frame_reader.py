@@ -0,0 +1,172 @@
+"""
+File containing a buffered reader that receives TOKDOC frames from a socket.
+Data is received in large chunks into a reusable bytearray with recv_into,
+and frames are handed out as memoryview slices of that buffer.
+"""
+from socket import socket
+
+from Utilities import binary_format
+from Utilities import constants
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+MAX_FRAME_SIZE = 1024 * 1024  # largest message accepted, file bodies are not part of the frame
+FRAME_HEADER_LENGTH = (constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH +
+                       constants.MESSAGE_SIZE_LENGTH + constants.CRLF_LENGTH)
+
+
+class FrameReader:
+    """
+    Reads exact amounts of data and whole frames from a connection.
+    The memoryviews returned by this reader are only valid until the next read.
+    """
+
+    def __init__(self, connection_socket: socket, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.socket = connection_socket
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first byte that has not been consumed
+        self.end = 0  # end of the received data
+
+    def buffered(self) -> int:
+        """
+        :return: int -> number of received bytes that have not been consumed
+        """
+        return self.end - self.start
+
+    def fill(self, deadline=None) -> int:
+        """
+        Receives as much data as fits in the buffer with a single recv_into call
+        :param deadline: timeouts.Deadline for the call, or None to keep the socket timeout
+        :return: int -> number of bytes received
+        :raises EOFError: if the connection was closed between frames
+        :raises ConnectionAbortedError: if the connection was closed in the middle of a frame
+        """
+        if self.end == len(self.buffer):
+            self.make_room(len(self.buffer))
+
+        if deadline is not None:
+            self.socket.settimeout(deadline.remaining())
+
+        received = self.socket.recv_into(self.view[self.end:])
+        if received == 0:
+            if self.buffered() == 0:
+                raise EOFError('connection closed by peer')
+            raise ConnectionAbortedError('connection closed in the middle of a frame')
+
+        self.end += received
+        return received
+
+    def make_room(self, size: int):
+        """
+        Makes sure that size bytes fit in the buffer after the unconsumed data,
+        moving the unconsumed data to the front or growing the buffer as needed
+        :param size: number of bytes that must fit
+        """
+        buffered = self.buffered()
+        if self.start + buffered + size <= len(self.buffer):
+            return
+
+        if buffered + size <= len(self.buffer):
+            self.view[:buffered] = self.view[self.start:self.end]
+        else:
+            # views handed out earlier keep the old buffer alive
+            new_buffer = bytearray(max(buffered + size, 2 * len(self.buffer)))
+            new_buffer[:buffered] = self.view[self.start:self.end]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+
+        self.start = 0
+        self.end = buffered
+
+    def ensure(self, size: int, deadline=None):
+        """
+        Receives until at least size unconsumed bytes are buffered
+        :param size: number of bytes
+        :param deadline: timeouts.Deadline for the whole operation
+        """
+        if self.buffered() >= size:
+            return
+
+        self.make_room(size - self.buffered())
+        while self.buffered() < size:
+            self.fill(deadline)
+
+    def read_exactly(self, size: int, deadline=None) -> memoryview:
+        """
+        :param size: number of bytes to read
+        :param deadline: timeouts.Deadline for the whole operation
+        :return: memoryview -> exactly size bytes
+        """
+        self.ensure(size, deadline)
+        data = self.view[self.start:self.start + size]
+        self.start += size
+        return data
+
+    def read_frame(self, deadline=None) -> tuple:
+        """
+        Reads a whole frame: <checksum>\r\n<message_size>\r\n<message>
+        :param deadline: timeouts.Deadline for the whole frame
+        :return: (full message, checksum, message without the checksum) as memoryviews
+        :raises ValueError: if the message size is invalid or too large
+        """
+        self.ensure(FRAME_HEADER_LENGTH, deadline)
+
+        size_start = self.start + constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH
+        message_size = int(bytes(self.view[size_start:size_start + constants.MESSAGE_SIZE_LENGTH]))
+        if message_size < 0 or message_size > MAX_FRAME_SIZE:
+            raise ValueError('Invalid message size ' + str(message_size))
+
+        frame = self.read_exactly(FRAME_HEADER_LENGTH + message_size, deadline)
+        return frame, frame[:constants.CHECKSUM_LENGTH], frame[constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH:]
+
+    def starts_with(self, prefix: bytes, deadline=None) -> bool:
+        """
+        Looks at the next bytes without consuming them
+        :param prefix: bytes to compare them with
+        :param deadline: timeouts.Deadline for the whole operation
+        :return: bool -> True if the next bytes are prefix
+        """
+        self.ensure(len(prefix), deadline)
+        return self.view[self.start:self.start + len(prefix)] == prefix
+
+    def read_binary_frame(self, deadline=None) -> tuple:
+        """
+        Reads a whole frame of the binary framing: <header><fields><digest>
+        :param deadline: timeouts.Deadline for the whole frame
+        :return: (full message, digest, message without the digest) as memoryviews
+        :raises ValueError: if the frame does not start with the magic or the fields length is too large
+        """
+        self.ensure(binary_format.REQUEST_HEADER.size, deadline)
+
+        magic = self.view[self.start:self.start + len(binary_format.MAGIC)]
+        fields_length = binary_format.REQUEST_HEADER.unpack_from(self.view, self.start)[5]
+        if magic != binary_format.MAGIC or fields_length > MAX_FRAME_SIZE:
+            raise ValueError('Invalid binary frame header')
+
+        frame = self.read_exactly(binary_format.REQUEST_HEADER.size + fields_length + binary_format.DIGEST_SIZE,
+                                  deadline)
+        return frame, frame[-binary_format.DIGEST_SIZE:], frame[:-binary_format.DIGEST_SIZE]
+
+    def read_into(self, destination: memoryview, deadline=None) -> int:
+        """
+        Fills destination with the next bytes of the connection, using the
+        buffered data first and then receiving straight into destination
+        :param destination: writable memoryview
+        :param deadline: timeouts.Deadline for the whole operation
+        :return: int -> number of bytes read, always len(destination)
+        """
+        size = len(destination)
+        from_buffer = min(size, self.buffered())
+        destination[:from_buffer] = self.view[self.start:self.start + from_buffer]
+        self.start += from_buffer
+
+        filled = from_buffer
+        while filled < size:
+            if deadline is not None:
+                self.socket.settimeout(deadline.remaining())
+            received = self.socket.recv_into(destination[filled:])
+            if received == 0:
+                raise ConnectionAbortedError('connection closed in the middle of a file')
+            filled += received
+
+        return filled
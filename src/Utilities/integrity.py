@@ -0,0 +1,192 @@
+"""
+File containing the integrity algorithms that frames and file bodies may be checked with.
+A connection starts with sha256. A client switches algorithm with an
+INTEGRITY:<algorithm> header, starting with the response to that request.
+From then on downloads also carry a digest of the data sent, and uploads may be
+checked against a FILE_DIGEST:<hex digest> header while they are received.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from Utilities import constants
+
+DEFAULT_ALGORITHM = 'sha256'
+NO_ALGORITHM = 'none'  # nothing is checked, for trusted networks only
+ALLOWED_ALGORITHMS = 'sha256,blake2b,crc32,adler32'  # none has to be allowed explicitly
+CHUNK_SIZE = 256 * 1024
+RANGE_DIGEST_CACHE_SIZE = 1024  # digests of ranged downloads kept in memory
+
+# (path, modification time, offset, size, algorithm) -> hex digest, least recently used first
+range_digests = OrderedDict()
+range_digests_lock = threading.Lock()
+
+
+class Checksum:
+    """
+    Gives zlib.crc32 and zlib.adler32 the interface of the hashlib hashes
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.value = function(b'')
+
+    def update(self, data):
+        self.value = self.function(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+
+class NoChecksum:
+    """
+    Used when integrity checks are turned off
+    """
+
+    def update(self, data):
+        pass
+
+    def digest(self) -> bytes:
+        return b''
+
+    def hexdigest(self) -> str:
+        return ''
+
+
+# algorithm -> function returning a new hash object
+ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'crc32': lambda: Checksum(zlib.crc32),
+    'adler32': lambda: Checksum(zlib.adler32),
+    NO_ALGORITHM: NoChecksum,
+}
+
+
+def allowed_algorithms() -> list:
+    """
+    :return: list -> the algorithms clients may choose, taken from the
+    INTEGRITY_ALGORITHMS environment variable when it is set
+    """
+    return os.getenv('INTEGRITY_ALGORITHMS', ALLOWED_ALGORITHMS).split(constants.COMMA)
+
+
+def negotiate(headers: dict):
+    """
+    :param headers: dict as returned by message_parser.get_headers()
+    :return: str -> the algorithm asked for in the INTEGRITY header, or None if there is none
+    :raises ValueError: if the algorithm is not supported or not allowed
+    """
+    if constants.INTEGRITY not in headers:
+        return None
+
+    algorithm = headers[constants.INTEGRITY].lower()
+    if algorithm not in ALGORITHMS or algorithm not in allowed_algorithms():
+        raise ValueError('Unsupported integrity algorithm ' + algorithm)
+    return algorithm
+
+
+def new(algorithm: str = None):
+    """
+    :param algorithm: one of ALGORITHMS, or None for DEFAULT_ALGORITHM
+    :return: a hash object with update(), digest() and hexdigest() methods
+    """
+    return ALGORITHMS[algorithm or DEFAULT_ALGORITHM]()
+
+
+def frame_checksum(message: bytes, algorithm: str = None) -> bytes:
+    """
+    :param message: the frame after the checksum
+    :param algorithm: one of ALGORITHMS, or None for DEFAULT_ALGORITHM
+    :return: bytes -> the hex digest, padded with zeros to fill the checksum of a text frame
+    """
+    hash_object = new(algorithm)
+    hash_object.update(message)
+    return hash_object.hexdigest().encode().ljust(constants.CHECKSUM_LENGTH, b'0')
+
+
+def frame_digest(message: bytes, algorithm: str = None, size: int = 32) -> bytes:
+    """
+    :param message: the frame before the digest
+    :param algorithm: one of ALGORITHMS, or None for DEFAULT_ALGORITHM
+    :param size: size of the digest field
+    :return: bytes -> the raw digest, padded with zeros to fill the digest of a binary frame
+    """
+    hash_object = new(algorithm)
+    hash_object.update(message)
+    return hash_object.digest().ljust(size, b'\0')
+
+
+def is_correct_checksum(checksum, message, algorithm: str = None) -> bool:
+    """
+    :param checksum: the hex checksum of a text frame
+    :param message: the frame after the checksum
+    :param algorithm: one of ALGORITHMS, or None for DEFAULT_ALGORITHM
+    :return: true if the checksum matches the message or the algorithm checks nothing
+    """
+    return algorithm == NO_ALGORITHM or frame_checksum(message, algorithm) == bytes(checksum)
+
+
+def is_correct_digest(digest, message, algorithm: str = None) -> bool:
+    """
+    :param digest: the raw digest of a binary frame
+    :param message: the frame before the digest
+    :param algorithm: one of ALGORITHMS, or None for DEFAULT_ALGORITHM
+    :return: true if the digest matches the message or the algorithm checks nothing
+    """
+    return algorithm == NO_ALGORITHM or frame_digest(message, algorithm, len(digest)) == bytes(digest)
+
+
+def file_digest(outgoing_file, algorithm: str, cached_path: str = None) -> str:
+    """
+    Hashes the part of a file that is about to be sent. The digest of a whole
+    file is cached on disk at cached_path, the digests of the ranges sent most
+    recently are kept in memory, see RANGE_DIGEST_CACHE_SIZE.
+    :param outgoing_file: storage.OutgoingFile
+    :param algorithm: one of ALGORITHMS
+    :param cached_path: where the digest of the whole file is cached, see storage.cache_path(), or None
+    :return: str -> hex digest
+    """
+    whole_file = outgoing_file.offset == 0 and outgoing_file.size == outgoing_file.total_size
+    if whole_file and cached_path is not None:
+        try:
+            if os.stat(cached_path).st_mtime >= os.stat(outgoing_file.path).st_mtime:
+                with open(cached_path) as cached_file:
+                    return cached_file.read()
+        except FileNotFoundError:
+            pass
+
+    range_key = None
+    if not whole_file:
+        range_key = (outgoing_file.path, os.fstat(outgoing_file.file.fileno()).st_mtime_ns, outgoing_file.offset,
+                     outgoing_file.size, algorithm)
+        with range_digests_lock:
+            hexdigest = range_digests.get(range_key)
+            if hexdigest is not None:
+                range_digests.move_to_end(range_key)
+                return hexdigest
+
+    hash_object = new(algorithm)
+    for chunk in outgoing_file.chunks(CHUNK_SIZE):
+        hash_object.update(chunk)
+    hexdigest = hash_object.hexdigest()
+
+    if range_key is not None:
+        with range_digests_lock:
+            range_digests[range_key] = hexdigest
+            while len(range_digests) > int(os.getenv('RANGE_DIGEST_CACHE_SIZE', RANGE_DIGEST_CACHE_SIZE)):
+                range_digests.popitem(last=False)
+    elif cached_path is not None:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(cached_path))
+        with os.fdopen(file_descriptor, 'w') as temporary_file:
+            temporary_file.write(hexdigest)
+        os.replace(temporary_path, cached_path)
+
+    return hexdigest
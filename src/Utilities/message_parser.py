@@ -5,8 +5,10 @@ import datetime
 import hashlib
 import os
 import platform
+import re
 
 from dotenv import load_dotenv
+from Utilities import binary_format
 from Utilities import constants
 
 
@@ -18,7 +20,7 @@ def parse_message(message) -> dict:
     The message must be in one of the following forms:
     <checksum>\r\n<message_size>\r\n{START}\r\n\r\n{{START METHOD}}\r\nAUTH <email> <password>\r\n{{END METHOD}}\r\n\r\n{{END}}
     <checksum>\r\n<message_size>\r\n{START}\r\n\r\n{{START METHOD}}\r\nEXIT <email> <password>\r\n{{END METHOD}}\r\n\r\n{{END}}
-    <checksum>\r\n<message_size>\r\n{START}\r\n\r\n{{START METHOD}}\r\nDATA <method> <ip>:<port> [<file_name>]\r\n{{END METHOD}}\r\n\r\n{{START HEADERS}}\r\nUSER:<email>\r\nACCESS_KEY:<access_key>\r\n[TIMESTAMP:<iso format datetime>]\r\n[AUTHORIZED:(<email>,<email>,...)]\r\n{{END HEADERS}}\r\n\r\n{{START FILE}}\r\nFILE_SIZE:<size>\r\n{{END FILE}}\r\n\r\n{{END}}
+    <checksum>\r\n<message_size>\r\n{START}\r\n\r\n{{START METHOD}}\r\nDATA <method> <ip>:<port> [<file_name>]\r\n{{END METHOD}}\r\n\r\n{{START HEADERS}}\r\nUSER:<email>\r\nACCESS_KEY:<access_key>\r\n[TIMESTAMP:<iso format datetime>]\r\n[AUTHORIZED:(<email>,<email>,...)]\r\n[RANGE:<offset>[,<length>]]\r\n{{END HEADERS}}\r\n\r\n{{START FILE}}\r\nFILE_SIZE:<size>\r\n{{END FILE}}\r\n\r\n{{END}}
 
     [] -> optional
     <> -> replace with appropriate data
@@ -41,6 +43,7 @@ def parse_message(message) -> dict:
             'ACCESS_KEY' -> string,
             'TIMESTAMP' -> string?,
             'AUTHORIZED' -> string[]?,
+            'RANGE' -> string?,
         },
         'file_size' -> int?
     }
@@ -73,21 +76,161 @@ def parse_message(message) -> dict:
     }
     """
 
-    message = get_message_string(message)
+    if isinstance(message, str):
+        message = message.encode()
 
-    parsed = {}
+    return parse(message).to_dict()
 
-    method_group_type = get_method_group_type(message)
-    if method_group_type == constants.AUTH or method_group_type == constants.EXIT:
-        parsed[constants.PARAMETERS_KEY] = get_auth_exit_parameters(message)
-    elif method_group_type == constants.DATA:
-        parsed[constants.PARAMETERS_KEY] = get_data_parameters(message)
-        parsed[constants.HEADERS] = get_headers(message)
-        parsed[constants.FILE_SIZE_KEY] = get_file_size(message)
-    else:
-        raise TypeError('The method group type "' + method_group_type + '" is not supported')
 
-    return parsed
+# the sections of a message, matched in a single scan of the frame. Each section
+# ends at its own end marker, so names and header values may contain braces.
+MESSAGE_PATTERN = re.compile(
+    rb'\s*(?:' + re.escape(constants.START.encode()) + rb'\s*)?' +
+    re.escape(constants.START_METHOD.encode()) + rb'(?P<method>.*?)' + re.escape(constants.END_METHOD.encode()) +
+    rb'\s*(?:' + re.escape(constants.START_HEADERS.encode()) + rb'(?P<headers>.*?)' +
+    re.escape(constants.END_HEADERS.encode()) + rb'\s*)?' +
+    rb'(?:' + re.escape(constants.START_FILE.encode()) + rb'(?P<file>.*?)' + re.escape(constants.END_FILE.encode()) + rb')?',
+    re.DOTALL)
+FRAME_HEADER_LENGTH = (constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH +
+                       constants.MESSAGE_SIZE_LENGTH + constants.CRLF_LENGTH)
+
+
+class Message:
+    """
+    A parsed request. Holds the same elements as the dictionary returned
+    by parse_message(), the request handlers receive it directly.
+    """
+    __slots__ = ('method_group', 'method', 'parameters', 'headers', 'file_size')
+
+    def __init__(self, method_group: str, method: str, parameters: dict, headers: dict = None, file_size: int = 0):
+        self.method_group = method_group
+        self.method = method
+        self.parameters = parameters
+        self.headers = headers if headers is not None else {}
+        self.file_size = file_size
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict -> the message in the form returned by parse_message()
+        """
+        parsed = {constants.PARAMETERS_KEY: self.parameters}
+        if self.method_group == constants.DATA:
+            parsed[constants.HEADERS] = self.headers
+            parsed[constants.FILE_SIZE_KEY] = self.file_size
+        return parsed
+
+
+def parse(frame) -> Message:
+    """
+    Parses a whole frame, <checksum>\r\n<message_size>\r\n<message>, in a single pass.
+    The frame is not decoded or copied, only the method line, the headers
+    and the file size are.
+    :param frame: bytes, bytearray or memoryview of the frame, formatted as described in parse_message()
+    :return: Message
+    :raises ValueError: if a section of the message is missing or malformed
+    :raises TypeError: if the method group is not supported
+    """
+    match = MESSAGE_PATTERN.match(frame, FRAME_HEADER_LENGTH)
+    if match is None:
+        raise ValueError('The message has no method')
+
+    method_content = match.group('method').decode().split()
+    method_group = method_content[0]
+
+    if method_group == constants.AUTH or method_group == constants.EXIT:
+        parameters = {constants.METHOD_KEY: method_content[0]}
+        if method_group == constants.AUTH:
+            parameters[constants.AUTH_EMAIL_KEY] = method_content[1]
+            parameters[constants.AUTH_PASSWORD_KEY] = method_content[2]
+        # an EXIT may carry the access key to revoke
+        headers = parse_headers(match.group('headers')) if match.group('headers') is not None else {}
+        return Message(method_group, method_group, parameters, headers)
+    elif method_group != constants.DATA:
+        raise TypeError('The method group type "' + method_group + '" is not supported')
+
+    if match.group('headers') is None or match.group('file') is None:
+        raise ValueError('The message has no headers or file section')
+
+    ip, separator, port = method_content[2].partition(':')
+    parameters = {
+        constants.METHOD_GROUP_KEY: method_group,
+        constants.METHOD_KEY: method_content[1],
+        'ip': ip,
+        'port': int(port),
+    }
+    if len(method_content) > 3:
+        parameters['file_name'] = method_content[3]
+
+    headers = parse_headers(match.group('headers'))
+    file_size = int(match.group('file').split(b':')[1])
+
+    return Message(method_group, parameters[constants.METHOD_KEY], parameters, headers, file_size)
+
+
+def parse_headers(section: bytes) -> dict:
+    """
+    :param section: the headers section of a frame
+    :return: dict -> str keys and str values, AUTHORIZED as a list of emails
+    :raises ValueError: if a header has no value separator
+    """
+    headers = {}
+    for header in section.decode().split():
+        key, separator, value = header.partition(':')
+        if not separator:
+            raise ValueError('Invalid header ' + header)
+        if key == constants.AUTHORIZED:
+            value = value[1:-1].split(',')
+        if value:
+            headers[key] = value
+    return headers
+
+
+def parse_binary(frame) -> Message:
+    """
+    Parses a whole frame of the binary framing, see binary_format, with struct.
+    :param frame: bytes, bytearray or memoryview of the frame
+    :return: Message -> the same Message parse() returns for the equivalent text message
+    :raises ValueError: if the frame is malformed or of an unsupported version
+    :raises TypeError: if the method code is not supported
+    """
+    (magic, version, method_code, flags, field_count,
+     fields_length, file_size) = binary_format.REQUEST_HEADER.unpack_from(frame)
+    if magic != binary_format.MAGIC or version != binary_format.VERSION:
+        raise ValueError('Unsupported binary frame version ' + str(version))
+    if method_code not in binary_format.METHODS:
+        raise TypeError('The method code ' + str(method_code) + ' is not supported')
+
+    start = binary_format.REQUEST_HEADER.size
+    fields = binary_format.decode_fields(frame[start:start + fields_length], field_count)
+    method = binary_format.METHODS[method_code]
+
+    headers = {}
+    for key, value in fields.items():
+        if key in binary_format.PARAMETER_FIELDS or not value:
+            continue
+        headers[key] = value.split(',') if key == constants.AUTHORIZED else value
+
+    if method == constants.AUTH:
+        parameters = {
+            constants.METHOD_KEY: method,
+            constants.AUTH_EMAIL_KEY: fields[constants.AUTH_EMAIL_KEY],
+            constants.AUTH_PASSWORD_KEY: fields[constants.AUTH_PASSWORD_KEY],
+        }
+        return Message(method, method, parameters, headers)
+    elif method == constants.EXIT:
+        # an EXIT may carry the access key to revoke
+        return Message(method, method, {constants.METHOD_KEY: method}, headers)
+
+    parameters = {
+        constants.METHOD_GROUP_KEY: constants.DATA,
+        constants.METHOD_KEY: method,
+        'ip': fields.get('ip', ''),
+        'port': int(fields.get('port', 0)),
+    }
+    if 'file_name' in fields:
+        parameters['file_name'] = fields['file_name']
+
+    return Message(constants.DATA, method, parameters, headers, file_size)
 
 
 # START TESTING STUFF
@@ -338,6 +481,70 @@ def get_headers(message) -> dict:
     return headers
 
 
+def get_range(headers: dict):
+    """
+    Reads the optional RANGE header of a DOWNLOAD request: RANGE:<offset>[,<length>]
+    :param headers: dict as returned by get_headers()
+    :return: (offset, length) where length is None for the rest of the file,
+    or None if no range was requested
+    :raises ValueError: if the range is not formatted correctly
+    """
+    if constants.RANGE not in headers:
+        return None
+
+    values = headers[constants.RANGE].split(constants.COMMA)
+    offset = int(values[0])
+    length = int(values[1]) if len(values) > 1 and values[1] else None
+    if offset < 0 or (length is not None and length < 0) or len(values) > 2:
+        raise ValueError('Invalid range ' + headers[constants.RANGE])
+
+    return offset, length
+
+
+def get_list_filters(headers: dict) -> dict:
+    """
+    Reads the optional headers of a LIST request:
+    PAGE_SIZE:<files>, CURSOR:<resource id>, PREFIX:<start of the file name>, TYPE:<extension>
+    and UPLOADED:[<iso format datetime>],[<iso format datetime>]
+    :param headers: dict as returned by get_headers()
+    :return: dict -> {
+        'page_size': int or None,
+        'cursor': int or None, files after this resource id are listed,
+        'prefix': str or None,
+        'type': str or None, with its leading dot,
+        'uploaded_from': datetime.datetime or None, inclusive,
+        'uploaded_to': datetime.datetime or None, exclusive
+    }
+    :raises ValueError: if a header is not formatted correctly
+    """
+    page_size = int(headers[constants.PAGE_SIZE]) if constants.PAGE_SIZE in headers else None
+    if page_size is not None and page_size < 1:
+        raise ValueError('Invalid page size ' + headers[constants.PAGE_SIZE])
+
+    cursor = int(headers[constants.CURSOR]) if constants.CURSOR in headers else None
+
+    file_type = headers.get(constants.TYPE)
+    if file_type is not None and not file_type.startswith('.'):
+        file_type = '.' + file_type
+
+    uploaded_from = uploaded_to = None
+    if constants.UPLOADED in headers:
+        values = headers[constants.UPLOADED].split(constants.COMMA)
+        if len(values) != 2:
+            raise ValueError('Invalid upload date range ' + headers[constants.UPLOADED])
+        uploaded_from = datetime.datetime.fromisoformat(values[0]) if values[0] else None
+        uploaded_to = datetime.datetime.fromisoformat(values[1]) if values[1] else None
+
+    return {
+        'page_size': page_size,
+        'cursor': cursor,
+        'prefix': headers.get(constants.PREFIX),
+        'type': file_type,
+        'uploaded_from': uploaded_from,
+        'uploaded_to': uploaded_to,
+    }
+
+
 def get_file_size(message) -> int:
     """
     :param message:
@@ -355,7 +562,7 @@ def get_message_string(message) -> str:
     :param message: string or bytes of the message
     :return: the string formatted message
     """
-    if isinstance(message, bytes):
+    if isinstance(message, (bytes, bytearray, memoryview)):
         return bytes(message).decode()
     elif isinstance(message, str):
         return message
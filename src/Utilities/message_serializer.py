@@ -1,53 +1,194 @@
 """
 File containing functions to build a response message
 """
+from Utilities import binary_format
+from Utilities import codes
+from Utilities import integrity
 from Utilities.codes import *
-from Utilities.checksum_utility import generate_checksum
 from Utilities.constants import *
 
+# the parts of every text response around the status line and its values
+RESPONSE_PREFIX = (START + CRLF + CRLF + START_RESPONSE + CRLF).encode()
+RESPONSE_SUFFIX = (CRLF + END_RESPONSE + CRLF + CRLF + END).encode()
+FIXED_FILE_SIZES = (None, 0)  # file sizes of the responses that are built once
 
-def build_response_string(status: Status, access_key=None, file_size: int = None) -> str:
+
+class Response:
+    """
+    A response built by build_response(). It holds the status and the values that
+    follow it, and is encoded in the framing of the connection when it is sent,
+    so a binary response is never built from a text one.
+    """
+    __slots__ = ('status', 'values')
+
+    def __init__(self, status: Status, values: list):
+        self.status = status
+        self.values = values  # str values that follow the status, e.g. the access key or file size
+
+    def encode(self, data_size: int, binary: bool = False, algorithm: str = None) -> bytes:
+        """
+        :param data_size: number of bytes of response data that follow the response
+        :param binary: True if the connection uses the binary framing
+        :param algorithm: integrity algorithm of the connection, None for sha256
+        :return: bytes -> the framed response
+        """
+        if binary:
+            return build_response_binary(self.status.code, self.values, data_size, algorithm)
+        return text_response(self.status, self.values, algorithm)
+
+    def to_bytes(self) -> bytes:
+        """
+        :return: bytes -> the response in the text framing, with a sha256 checksum
+        """
+        return text_response(self.status, self.values)
+
+
+def build_response(status: Status, access_key=None, file_size: int = None, content_range=None, compression=None,
+                   payload_digest=None, next_cursor=None) -> Response:
+    """
+    :param status: codes.Status object
+    :param access_key:
+    :param file_size:
+    :param content_range: (offset, total file size) of a partial file, sent after the file size
+    :param compression: (codec:level, original file size) of a compressed file, sent after the file size
+    :param payload_digest: (integrity algorithm, hex digest) of the response data, sent last
+    :param next_cursor: CURSOR of the next page of a LIST response, sent after the file size
+    :return: Response -> the response, encoded by the server in the framing of the connection
+    """
+    return Response(status, response_values(access_key, file_size, content_range, compression, payload_digest,
+                                            next_cursor))
+
+
+def build_response_string(status: Status, access_key=None, file_size: int = None, content_range=None,
+                          compression=None, payload_digest=None, next_cursor=None) -> str:
     """
     :param file_size:
     :param status: codes.Status object
     :param access_key:
+    :param content_range: see build_response()
+    :param compression: see build_response()
+    :param payload_digest: see build_response()
+    :param next_cursor: see build_response()
     :return: str -> string formatted response message according to TOKDOC protocol
     """
-    message = (
-            START +
-            CRLF + CRLF +
-            START_RESPONSE +
-            CRLF +
-            str(status.code) + SPACE + QUOTES + status.status + QUOTES
-    )
+    return build_response_bytes(status, access_key, file_size, content_range, compression, payload_digest,
+                                next_cursor).decode()
 
+
+def build_response_bytes(status_code: Status, access_key=None, file_size: int = None, content_range=None,
+                         compression=None, payload_digest=None, next_cursor=None) -> bytes:
+    """
+    Builds the response described in build_response_string() as bytes.
+    :param file_size:
+    :param status_code:
+    :param access_key:
+    :param content_range:
+    :param compression:
+    :param payload_digest:
+    :param next_cursor:
+    :return: bytes
+    """
+    return text_response(status_code, response_values(access_key, file_size, content_range, compression,
+                                                      payload_digest, next_cursor))
+
+
+def response_values(access_key=None, file_size: int = None, content_range=None, compression=None,
+                    payload_digest=None, next_cursor=None) -> list:
+    """
+    :param access_key:
+    :param file_size:
+    :param content_range:
+    :param compression:
+    :param payload_digest:
+    :param next_cursor:
+    :return: list -> the str values that follow the status, in the order they are sent
+    """
+    values = []
     if access_key:
-        message += SPACE + access_key
+        values.append(access_key)
 
     if file_size is not None:
-        message += SPACE + str(file_size)
+        values.append(str(file_size))
+
+    if next_cursor is not None:
+        values.append(str(next_cursor))
+
+    if content_range is not None:
+        values += [str(content_range[0]), str(content_range[1])]
 
-    message += (
-            CRLF +
-            END_RESPONSE +
-            CRLF + CRLF +
-            END
-    )
+    if compression is not None:
+        values += [compression[0], str(compression[1])]
 
-    message_size = len(message.encode())
-    message = (str(message_size) + (MESSAGE_SIZE_LENGTH - len(str(message_size))) * " " +
-               CRLF + message)
+    if payload_digest is not None:
+        values.append(payload_digest[0] + ':' + payload_digest[1])
 
-    checksum = generate_checksum(message)
-    return checksum + CRLF + message
+    return values
 
 
-def build_response_bytes(status_code: Status, access_key=None, file_size: int = None) -> bytes:
+def text_response(status: Status, values: list, algorithm: str = None) -> bytes:
     """
-    Encodes the build_response_string() return value
-    :param file_size:
-    :param status_code:
-    :param access_key:
-    :return: bytes
+    Responses without variable fields are framed once for each integrity
+    algorithm and kept in fixed_responses.
+    :param status: codes.Status object
+    :param values: as returned by response_values()
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :return: bytes -> the response in the text framing
+    """
+    algorithm = algorithm or integrity.DEFAULT_ALGORITHM
+    fixed = len(values) == 0 or (len(values) == 1 and values[0] == '0')
+    if not fixed:
+        return frame_response(status, values, algorithm)
+
+    key = (status.encoded, tuple(values), algorithm)
+    response = fixed_responses.get(key)
+    if response is None:
+        response = frame_response(status, values, algorithm)
+        fixed_responses[key] = response
+    return response
+
+
+def frame_response(status: Status, values: list, algorithm: str = None) -> bytes:
+    """
+    Fills the response template with the status and the values
+    :param status: codes.Status object
+    :param values: as returned by response_values()
+    :param algorithm: integrity algorithm of the checksum, None for sha256
+    :return: bytes -> the framed response, with its size and checksum
+    """
+    message = RESPONSE_PREFIX + status.encoded + ''.join(SPACE + value for value in values).encode() + RESPONSE_SUFFIX
+    message = str(len(message)).ljust(MESSAGE_SIZE_LENGTH).encode() + CRLF.encode() + message
+
+    return integrity.frame_checksum(message, algorithm) + CRLF.encode() + message
+
+
+def build_fixed_responses() -> dict:
+    """
+    :return: dict -> (encoded status, values, integrity algorithm) to the sha256 framed
+    response of every status in codes that has no variable fields. Responses framed
+    with other algorithms are added as they are first sent.
+    """
+    statuses = [value for value in vars(codes).values() if isinstance(value, Status)]
+    fixed = {}
+    for status in statuses:
+        for file_size in FIXED_FILE_SIZES:
+            values = response_values(file_size=file_size)
+            fixed[(status.encoded, tuple(values), integrity.DEFAULT_ALGORITHM)] = frame_response(status, values)
+    return fixed
+
+
+fixed_responses = build_fixed_responses()
+
+
+def build_response_binary(status_code: int, values: list, data_size: int, algorithm: str = None) -> bytes:
+    """
+    :param status_code: the code of a codes.Status
+    :param values: the values that follow the status in a text response, e.g. the access key or file size
+    :param data_size: number of bytes of response data that follow the frame
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :return: bytes -> response frame of the binary framing, see binary_format
     """
-    return build_response_string(status_code, access_key, file_size).encode()
+    encoded_values = binary_format.encode_values(values)
+    header = binary_format.RESPONSE_HEADER.pack(binary_format.MAGIC, binary_format.VERSION, status_code,
+                                                binary_format.FLAGS, len(values), len(encoded_values), data_size)
+    return header + encoded_values + integrity.frame_digest(header + encoded_values, algorithm,
+                                                            binary_format.DIGEST_SIZE)
@@ -0,0 +1,169 @@
+"""
+File containing the password hashing used by AUTH requests.
+Passwords are stored as salted scrypt hashes, or pbkdf2 where the Python
+build has no scrypt. Hashing is deliberately slow, so it runs in a small
+bounded pool of its own, see pool(), and recently verified credentials are
+remembered for a short while so that clients reconnecting do not redo it.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+SCRYPT_COST = 2 ** 14
+SCRYPT_BLOCK_SIZE = 8
+SCRYPT_PARALLELISM = 1
+PBKDF2_ITERATIONS = 600000
+SALT_SIZE = 16
+HASH_SIZE = 32
+SEPARATOR = '$'
+
+PASSWORD_WORKERS = 2  # passwords hashed at once
+CREDENTIAL_CACHE_SIZE = 1024  # verified credentials remembered
+CREDENTIAL_CACHE_TTL = 5 * 60  # seconds a verified credential is remembered
+
+executor = None
+executor_lock = threading.Lock()
+
+# email -> (password digest, stored hash, expiry), least recently used first
+verified = OrderedDict()
+verified_lock = threading.Lock()
+cache_key = secrets.token_bytes(32)  # only digests made with this key are remembered, never passwords
+
+
+def pool() -> ThreadPoolExecutor:
+    """
+    :return: ThreadPoolExecutor -> the pool passwords are hashed in, with
+    PASSWORD_WORKERS threads (environment variable of the same name). hashlib
+    releases the GIL while hashing, so the pool does not stall the server.
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            workers = int(os.getenv('PASSWORD_WORKERS', PASSWORD_WORKERS))
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+    return executor
+
+
+def encode(data: bytes) -> str:
+    """
+    :param data:
+    :return: str -> unpadded base64 of the data
+    """
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def decode(text: str) -> bytes:
+    """
+    :param text: as returned by encode()
+    :return: bytes
+    """
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def derive(password: str, salt: bytes, algorithm: str, cost: int) -> bytes:
+    """
+    :param password:
+    :param salt:
+    :param algorithm: SCRYPT or PBKDF2
+    :param cost: the scrypt cost or the pbkdf2 iterations
+    :return: bytes -> the derived key
+    """
+    if algorithm == SCRYPT:
+        return hashlib.scrypt(password.encode(), salt=salt, n=cost, r=SCRYPT_BLOCK_SIZE, p=SCRYPT_PARALLELISM,
+                              dklen=HASH_SIZE)
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, cost, HASH_SIZE)
+
+
+def hash_password(password: str) -> str:
+    """
+    Slow, should be run in pool()
+    :param password:
+    :return: str -> <algorithm>$<cost>$<salt>$<hash> to store in the Users table
+    """
+    if hasattr(hashlib, 'scrypt'):
+        algorithm, cost = SCRYPT, SCRYPT_COST
+    else:
+        algorithm, cost = PBKDF2, PBKDF2_ITERATIONS
+
+    salt = secrets.token_bytes(SALT_SIZE)
+    derived = derive(password, salt, algorithm, cost)
+    return SEPARATOR.join((algorithm, str(cost), encode(salt), encode(derived)))
+
+
+def is_hashed(stored: str) -> bool:
+    """
+    :param stored: password column of a Users row
+    :return: True if the password was stored by hash_password(), False if it is
+    a plain text password stored before passwords were hashed
+    """
+    return stored.startswith(SCRYPT + SEPARATOR) or stored.startswith(PBKDF2 + SEPARATOR)
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """
+    Slow, should be run in pool()
+    :param password: the password the client sent
+    :param stored: password column of a Users row
+    :return: True if the password matches
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    try:
+        algorithm, cost, salt, expected = stored.split(SEPARATOR)
+        derived = derive(password, decode(salt), algorithm, int(cost))
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, decode(expected))
+
+
+def digest(password: str) -> bytes:
+    """
+    :param password:
+    :return: bytes -> keyed digest of the password, cheap to compute
+    """
+    return hmac.new(cache_key, password.encode(), hashlib.sha256).digest()
+
+
+def is_remembered(email: str, password: str, stored: str) -> bool:
+    """
+    :param email:
+    :param password: the password the client sent
+    :param stored: password column of the Users row
+    :return: True if these credentials were verified within the last CREDENTIAL_CACHE_TTL seconds
+    """
+    with verified_lock:
+        entry = verified.get(email)
+        if entry is None:
+            return False
+        if entry[2] < time.time() or entry[1] != stored:
+            del verified[email]
+            return False
+        verified.move_to_end(email)
+
+    return hmac.compare_digest(entry[0], digest(password))
+
+
+def remember(email: str, password: str, stored: str):
+    """
+    Remembers credentials that have been verified
+    :param email:
+    :param password: the password the client sent
+    :param stored: password column of the Users row
+    """
+    ttl = float(os.getenv('CREDENTIAL_CACHE_TTL', CREDENTIAL_CACHE_TTL))
+    size = int(os.getenv('CREDENTIAL_CACHE_SIZE', CREDENTIAL_CACHE_SIZE))
+    entry = (digest(password), stored, time.time() + ttl)
+    with verified_lock:
+        verified[email] = entry
+        verified.move_to_end(email)
+        while len(verified) > size:
+            verified.popitem(last=False)
@@ -0,0 +1,233 @@
+"""
+File containing the database schema and the migrations that build it.
+Every migration runs once, in order, and the version reached is recorded in
+the SchemaVersion table. Migrations are written so that they also apply to
+databases created before the schema was versioned.
+migrate() should be called on server startup. It also checks that the
+statements run by the request handlers are answered from an index.
+"""
+from Utilities import database_manager as database
+
+LOCK_NAME = 'tokdoc_schema'  # MySQL lock held while migrating
+LOCK_TIMEOUT = 30  # seconds to wait for another process that is migrating
+
+# the primary keys, spelled the way each backend wants them
+AUTO_INCREMENT = {
+    database.SQLITE_BACKEND: 'integer NOT NULL PRIMARY KEY AUTOINCREMENT',
+    database.MYSQL_BACKEND: 'integer NOT NULL PRIMARY KEY AUTO_INCREMENT',
+}
+
+# statements the request handlers run, none of them may scan a whole table
+HOT_QUERIES = (
+    ("SELECT user_id FROM Users WHERE email = %s", ('',)),
+    ("SELECT user_id, password FROM Users WHERE email = %s", ('',)),
+    ("UPDATE Users SET password = %s WHERE user_id = %s", ('', 0)),
+    ("SELECT user_id FROM Resources WHERE resource_path = %s", ('',)),
+    ("SELECT blob_hash FROM Resources WHERE resource_path = %s", ('',)),
+    ("SELECT resource_id, blob_hash FROM Resources WHERE resource_path = %s AND user_id = %s", ('', 0)),
+    ("UPDATE Resources SET type = %s, upload_date = %s, public = %s, blob_hash = %s WHERE resource_id = %s",
+     ('', '', 0, '', 0)),
+    ("DELETE FROM Access WHERE file_id = %s", (0,)),
+    ("SELECT reference_count FROM Blobs WHERE blob_hash = %s", ('',)),
+    ("UPDATE Blobs SET reference_count = reference_count + 1 WHERE blob_hash = %s", ('',)),
+    ("DELETE FROM Blobs WHERE blob_hash = %s", ('',)),
+    # the first and the following pages of a LIST, as built by list.visible_query()
+    ("SELECT resource_id, resource_path FROM Resources WHERE public = 1 "
+     "UNION SELECT resource_id, resource_path FROM Resources WHERE user_id = %s "
+     "UNION SELECT resource_id, resource_path FROM Resources "
+     "WHERE resource_id IN (SELECT file_id FROM Access WHERE user_id = %s) "
+     "ORDER BY resource_id LIMIT %s", (0, 0, 0)),
+    ("SELECT resource_id, resource_path FROM Resources WHERE public = 1 AND resource_id > %s "
+     "UNION SELECT resource_id, resource_path FROM Resources WHERE user_id = %s AND resource_id > %s "
+     "UNION SELECT resource_id, resource_path FROM Resources "
+     "WHERE resource_id IN (SELECT file_id FROM Access WHERE user_id = %s) AND resource_id > %s "
+     "ORDER BY resource_id LIMIT %s", (0, 0, 0, 0, 0, 0)),
+)
+
+
+def create_tables():
+    """
+    Creates the Users, Resources and Access tables
+    """
+    primary_key = AUTO_INCREMENT[database.active_backend]
+    database.query('''CREATE TABLE IF NOT EXISTS `Users` (
+  `user_id` ''' + primary_key + '''
+,  `email` varchar(50) DEFAULT NULL
+,  `password` varchar(50) DEFAULT NULL
+,  UNIQUE (`email`)
+)''')
+    database.query('''CREATE TABLE IF NOT EXISTS `Resources` (
+  `resource_id` ''' + primary_key + '''
+,  `type` varchar(15) DEFAULT NULL
+,  `resource_path` varchar(100) NOT NULL
+,  `upload_date` datetime NOT NULL
+,  `user_id` integer NOT NULL
+,  `public` integer NOT NULL DEFAULT '1'
+)''')
+    database.query('''CREATE TABLE IF NOT EXISTS `Access` (
+  `access_id` ''' + primary_key + '''
+,  `user_id` integer DEFAULT NULL
+,  `file_id` integer DEFAULT NULL
+)''')
+
+
+def create_blob_tables():
+    """
+    Creates the Blobs table and the Resources.blob_hash column, see blob_store
+    """
+    database.query('''CREATE TABLE IF NOT EXISTS `Blobs` (
+  `blob_hash` char(64) NOT NULL PRIMARY KEY
+,  `size` integer NOT NULL
+,  `reference_count` integer NOT NULL DEFAULT 0
+)''')
+
+    if not has_column('Resources', 'blob_hash'):
+        database.query('ALTER TABLE Resources ADD COLUMN `blob_hash` char(64) DEFAULT NULL')
+
+
+def create_lookup_indexes():
+    """
+    Indexes the columns every request looks rows up by. The Resources index
+    holds the columns read by those lookups, so they never read the table.
+    Users.email is already indexed by its UNIQUE constraint, and resource_id and
+    access_id are the row ids SQLite keeps in every index.
+    """
+    create_index('resources_resource_path', 'Resources', ('resource_path', 'user_id', 'public', 'blob_hash'))
+    create_index('access_user_file', 'Access', ('user_id', 'file_id'))
+    create_index('access_file', 'Access', ('file_id',))
+
+
+def create_visibility_indexes():
+    """
+    Indexes the public files and the files of each owner, so that every part
+    of the query listing the files a user may see is read from an index
+    """
+    create_index('resources_public', 'Resources', ('public',))
+    create_index('resources_user', 'Resources', ('user_id',))
+
+
+def create_generation_table():
+    """
+    Creates the Generation table, a single row counting the changes made to the
+    resources and the access given to them, see acl
+    """
+    database.query('CREATE TABLE IF NOT EXISTS `Generation` (`generation` integer NOT NULL)')
+    if database.query_one('SELECT generation FROM Generation') is None:
+        database.query('INSERT INTO Generation (generation) VALUES (0)')
+
+
+# (version, what the migration does, function applying it), in the order they are applied
+MIGRATIONS = (
+    (1, 'Users, Resources and Access tables', create_tables),
+    (2, 'Blobs table and Resources.blob_hash', create_blob_tables),
+    (3, 'indexes for the lookups made by every request', create_lookup_indexes),
+    (4, 'Generation table', create_generation_table),
+    (5, 'indexes for the files a user may see', create_visibility_indexes),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def has_column(table: str, column: str) -> bool:
+    """
+    :param table:
+    :param column:
+    :return: True if the table has the column
+    """
+    if database.active_backend == database.SQLITE_BACKEND:
+        return any(row['name'] == column for row in database.query('PRAGMA table_info(' + table + ')'))
+
+    query = ("SELECT COUNT(*) FROM information_schema.columns "
+             "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s")
+    return database.query_scalar(query, (table, column)) > 0
+
+
+def create_index(name: str, table: str, columns: tuple, unique: bool = False):
+    """
+    Creates an index unless an index with this name exists
+    :param name:
+    :param table:
+    :param columns: column names, in the order they are indexed
+    :param unique: True for a UNIQUE index
+    """
+    if database.active_backend == database.SQLITE_BACKEND:
+        exists = database.query_one("SELECT name FROM sqlite_master WHERE type = 'index' AND name = %s", (name,))
+    else:
+        exists = database.query_one("SELECT index_name FROM information_schema.statistics "
+                                    "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                                    (table, name))
+    if exists is None:
+        database.query('CREATE ' + ('UNIQUE ' if unique else '') + 'INDEX `' + name + '` ON `' + table + '` (' +
+                       ', '.join('`' + column + '`' for column in columns) + ')')
+
+
+def current_version() -> int:
+    """
+    :return: int -> the last migration applied, 0 for a database that was never migrated
+    """
+    database.query('CREATE TABLE IF NOT EXISTS `SchemaVersion` (`version` integer NOT NULL)')
+    return database.query_scalar('SELECT MAX(version) FROM SchemaVersion') or 0
+
+
+def migrate() -> int:
+    """
+    Applies the migrations the database is missing. Other processes migrating
+    the same database at the same time wait for this one to finish.
+    :return: int -> the schema version of the database
+    """
+    with database.connection() as pooled:
+        lock(pooled)
+        try:
+            version = current_version()
+            for migration_version, description, apply in MIGRATIONS:
+                if migration_version > version:
+                    print('Migrating the database to version', migration_version, '(' + description + ')')
+                    apply()
+                    database.query('INSERT INTO SchemaVersion (version) VALUES (%s)', (migration_version,))
+                    version = migration_version
+            database.commit()
+        finally:
+            unlock(pooled)
+
+        for problem in check_query_plans():
+            print('Warning:', problem)
+
+    return version
+
+
+def lock(pooled):
+    """
+    Keeps other processes from migrating until unlock() is called
+    :param pooled: the connection migrating
+    """
+    if database.active_backend == database.SQLITE_BACKEND:
+        pooled.connection.commit()
+        pooled.cursor.execute('BEGIN IMMEDIATE')
+    else:
+        database.query_scalar('SELECT GET_LOCK(%s, %s)', (LOCK_NAME, LOCK_TIMEOUT))
+
+
+def unlock(pooled):
+    """
+    :param pooled: the connection passed to lock()
+    """
+    if database.active_backend == database.SQLITE_BACKEND:
+        pooled.connection.rollback()
+    else:
+        database.query_scalar('SELECT RELEASE_LOCK(%s)', (LOCK_NAME,))
+
+
+def check_query_plans() -> list:
+    """
+    Asks SQLite how it answers each of HOT_QUERIES
+    :return: list -> a description of every hot query that scans a whole table
+    """
+    if database.active_backend != database.SQLITE_BACKEND:
+        return []
+
+    problems = []
+    for query, values in HOT_QUERIES:
+        for row in database.query('EXPLAIN QUERY PLAN ' + query, values):
+            detail = row['detail']
+            if detail.startswith('SCAN') and 'CONSTANT ROW' not in detail:
+                problems.append(query + ' -> ' + detail)
+    return problems
@@ -0,0 +1,251 @@
+"""
+File containing functions to handle where uploaded files are stored on disk.
+Uploads are streamed into a temporary file in the storage directory and
+atomically renamed into place once they are durably written.
+"""
+import hashlib
+import os
+import tempfile
+
+from Utilities import compression
+from Utilities import integrity
+
+STORAGE_DIRECTORY = '.'
+CHUNK_SIZE = 256 * 1024  # bytes read from a connection at a time when streaming a file
+TEMPORARY_PREFIX = '.upload-'
+CACHE_DIRECTORY = '.cache'  # copies derived from stored files, apart from the files clients upload
+MAX_DECOMPRESSED_SIZE = 1024 ** 3  # largest file a compressed body may expand to
+
+
+def storage_directory() -> str:
+    """
+    :return: str -> the directory files are stored in, taken from the
+    STORAGE_DIRECTORY environment variable when it is set
+    """
+    return os.getenv('STORAGE_DIRECTORY', STORAGE_DIRECTORY)
+
+
+def storage_path(file_name: str) -> str:
+    """
+    :param file_name: the name of the file as provided by the client
+    :return: str -> the path the file is stored at
+    """
+    # clients may not write outside the storage directory
+    return os.path.join(storage_directory(), os.path.basename(file_name))
+
+
+def max_decompressed_size() -> int:
+    """
+    :return: int -> largest file a compressed body may expand to when the client did
+    not give ORIGINAL_SIZE, taken from the MAX_DECOMPRESSED_SIZE environment variable when it is set
+    """
+    return int(os.getenv('MAX_DECOMPRESSED_SIZE', MAX_DECOMPRESSED_SIZE))
+
+
+def cache_path(path: str, suffix: str) -> str:
+    """
+    :param path: path of a stored file
+    :param suffix: what the cached copy holds, e.g. the codec and level of a compressed copy
+    :return: str -> where a copy derived from the file is cached. Caches are kept in their
+    own directory, named by the sha256 of the path of the file, so they never share a
+    name with a stored file.
+    """
+    key = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(storage_directory(), CACHE_DIRECTORY, key[:2], key + '.' + suffix)
+
+
+def remove_cached(path: str):
+    """
+    Deletes every copy of the file cached by cache_path()
+    :param path: path of a stored file
+    """
+    directory, prefix = os.path.split(cache_path(path, ''))
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+class IncomingFile:
+    """
+    A file that is being received. Chunks are written to a temporary file
+    and hashed as they arrive, so memory use does not depend on the file size.
+    A compressed body is decompressed as it arrives, the hash and size are
+    those of the original file. A payload digest, if one is expected, is
+    computed over the body as it was sent and checked once it is complete.
+    A compressed body stops being written, and is not valid, once the original
+    file grows past max_size.
+    """
+
+    def __init__(self, codec: str = None, payload_digest: str = None, algorithm: str = None, max_size: int = None):
+        directory = storage_directory()
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, self.temporary_path = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=directory)
+        self.file = os.fdopen(file_descriptor, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.valid = True  # False once the body turned out to be corrupt
+        self.decompressor = None
+        self.max_size = None  # most bytes the original file may have, only for a compressed body
+        self.payload_digest = payload_digest.lower() if payload_digest and algorithm != integrity.NO_ALGORITHM else None
+        self.payload_hash = None
+        if self.payload_digest is not None and (codec is not None or
+                                                (algorithm or integrity.DEFAULT_ALGORITHM) != 'sha256'):
+            # otherwise the hash of the file is the payload digest
+            self.payload_hash = integrity.new(algorithm)
+        if codec is not None:
+            self.max_size = min(max_size, max_decompressed_size()) if max_size is not None else max_decompressed_size()
+            try:
+                self.decompressor = compression.StreamDecompressor(codec)
+            except ValueError:
+                self.valid = False
+
+    def write(self, chunk):
+        """
+        :param chunk: bytes-like chunk of the body
+        """
+        if not self.valid:
+            return
+
+        if self.payload_hash is not None:
+            self.payload_hash.update(chunk)
+
+        if self.decompressor is None:
+            self.append(chunk)
+            return
+
+        try:
+            for data in self.decompressor.decompress(chunk):
+                self.append(data)
+                if not self.valid:
+                    # the rest of the body is received but no longer decompressed
+                    return
+        except ValueError:
+            self.valid = False
+
+    def append(self, data):
+        """
+        :param data: bytes-like chunk of the original file
+        """
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            self.valid = False
+            return
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def finish(self) -> bool:
+        """
+        Should be called once the whole body was written
+        :return: bool -> True if the body was received intact
+        """
+        if self.valid and self.decompressor is not None:
+            try:
+                self.append(self.decompressor.finish())
+            except ValueError:
+                self.valid = False
+
+        if self.valid and self.payload_digest is not None:
+            payload_hash = self.payload_hash if self.payload_hash is not None else self.hash
+            self.valid = payload_hash.hexdigest() == self.payload_digest
+        return self.valid
+
+    def hexdigest(self) -> str:
+        """
+        :return: str -> sha256 of the data written so far
+        """
+        return self.hash.hexdigest()
+
+    def move_to(self, path: str) -> str:
+        """
+        Flushes the file to disk and renames it to the given path
+        :param path: path in the storage directory
+        :return: str -> the path
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        os.replace(self.temporary_path, path)
+        sync_directory(os.path.dirname(path))
+        return path
+
+    def discard(self):
+        """
+        Deletes the temporary file of a transfer that did not complete
+        """
+        self.file.close()
+        try:
+            os.remove(self.temporary_path)
+        except FileNotFoundError:
+            pass
+
+
+def sync_directory(directory: str):
+    """
+    Makes a rename in the directory durable
+    :param directory: path of the directory
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        # directories cannot be opened on this platform
+        return
+
+    file_descriptor = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+class OutgoingFile:
+    """
+    A stored file, or a part of it, that is to be sent to a client.
+    Only the open file is kept in memory, the bytes are sent straight from
+    the file with sendfile where the socket supports it.
+    """
+
+    def __init__(self, path: str, offset: int = 0, size: int = None):
+        self.path = path
+        self.file = open(self.path, 'rb')
+        self.total_size = os.fstat(self.file.fileno()).st_size
+        self.offset = offset
+        self.size = self.total_size - offset if size is None else size
+
+    def select_range(self, offset: int, length: int = None):
+        """
+        Limits the transfer to a part of the file. Ranges that run past the
+        end of the file are shortened to end with the file.
+        :param offset: first byte to send
+        :param length: number of bytes to send, or None for the rest of the file
+        :raises ValueError: if the range starts after the end of the file
+        """
+        if offset < 0 or offset > self.total_size:
+            raise ValueError('The range starts after the end of ' + self.path)
+
+        available = self.total_size - offset
+        self.offset = offset
+        self.size = available if length is None else min(length, available)
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE):
+        """
+        Reads the file through a reusable buffer, for sockets that cannot use sendfile
+        :param chunk_size: largest chunk to read at a time
+        :return: generator of memoryviews, each valid until the next one is read
+        """
+        buffer = memoryview(bytearray(min(chunk_size, self.size)))
+        self.file.seek(self.offset)
+        remaining = self.size
+        while remaining > 0:
+            read = self.file.readinto(buffer[:min(remaining, len(buffer))])
+            if not read:
+                raise EOFError('The file ' + self.path + ' is shorter than expected')
+            yield buffer[:read]
+            remaining -= read
+
+    def close(self):
+        """
+        Closes the file
+        """
+        self.file.close()
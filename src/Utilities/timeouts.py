@@ -0,0 +1,71 @@
+"""
+File containing the deadlines used to drop idle and slow clients,
+and a count of the connections that have been dropped.
+Every timeout can be overridden with the environment variable of the same name.
+"""
+import os
+import socket
+import threading
+import time
+
+IDLE_TIMEOUT = 300  # seconds a connection may wait before sending a request
+HEADER_TIMEOUT = 30  # seconds to receive the rest of a message once it has started
+MIN_TRANSFER_RATE = 1024  # minimum bytes per second for file bodies
+TRANSFER_GRACE_PERIOD = 10  # seconds added to every file body deadline
+
+reaped_connections = 0
+reaped_lock = threading.Lock()
+
+
+def idle_timeout() -> float:
+    """
+    :return: float -> seconds a connection may stay idle between requests
+    """
+    return float(os.getenv('IDLE_TIMEOUT', IDLE_TIMEOUT))
+
+
+def header_timeout() -> float:
+    """
+    :return: float -> seconds allowed to receive a message once its first bytes arrived
+    """
+    return float(os.getenv('HEADER_TIMEOUT', HEADER_TIMEOUT))
+
+
+def body_timeout(size: int) -> float:
+    """
+    :param size: number of bytes in the file body
+    :return: float -> seconds allowed to transfer a file body of the given size
+    """
+    grace_period = float(os.getenv('TRANSFER_GRACE_PERIOD', TRANSFER_GRACE_PERIOD))
+    min_transfer_rate = float(os.getenv('MIN_TRANSFER_RATE', MIN_TRANSFER_RATE))
+    return grace_period + size / min_transfer_rate
+
+
+def record_reaped_connection() -> int:
+    """
+    Counts a connection that was closed because it was idle or too slow
+    :return: int -> the number of connections reaped so far by this process
+    """
+    global reaped_connections
+    with reaped_lock:
+        reaped_connections += 1
+        return reaped_connections
+
+
+class Deadline:
+    """
+    A point in time by which a blocking socket operation must complete
+    """
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        :return: float -> seconds left before the deadline
+        :raises socket.timeout: if the deadline has passed
+        """
+        remaining = self.expires - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('deadline exceeded')
+        return remaining
@@ -0,0 +1,151 @@
+"""
+File containing the access tokens handed out by AUTH requests.
+A token is <key version>.<user id>.<expiry>.<signature>, the signature being
+an HMAC-SHA256 of the other fields and the email of the user, made with the
+server key of that version. Tokens are verified in memory, without the
+database or the disk.
+The server keys are loaded once, by load(), from SERVER_KEY and SERVER_KEY_VERSION.
+PREVIOUS_SERVER_KEY, if set, is accepted as the version before it so that
+tokens signed before a rotation stay valid until they expire.
+Rotations done with rotate() and revocations only apply to the process they are made in.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+TOKEN_TTL = 8 * 60 * 60  # seconds a token is valid for
+SEPARATOR = '.'
+
+signers = None  # key version -> hmac object holding the key, copied for every signature
+current_version = None
+revoked = {}  # signature -> expiry, kept until the token would have expired anyway
+revoked_lock = threading.Lock()
+
+
+def token_ttl() -> float:
+    """
+    :return: float -> seconds a token is valid for, taken from the
+    TOKEN_TTL environment variable when it is set
+    """
+    return float(os.getenv('TOKEN_TTL', TOKEN_TTL))
+
+
+def load():
+    """
+    Loads the server keys from the environment.
+    Should be called on server startup, after the .env file is loaded.
+    """
+    global signers, current_version
+    server_key = os.getenv('SERVER_KEY')
+    if not server_key:
+        raise RuntimeError('SERVER_KEY is not set')
+
+    version = int(os.getenv('SERVER_KEY_VERSION', 1))
+    signers = {version: new_signer(server_key)}
+    previous_key = os.getenv('PREVIOUS_SERVER_KEY')
+    if previous_key:
+        signers[version - 1] = new_signer(previous_key)
+    current_version = version
+
+
+def rotate(server_key: str) -> int:
+    """
+    Signs new tokens with a new key. Tokens signed with the key it replaces
+    stay valid, tokens signed with older keys are no longer accepted.
+    :param server_key: the new key
+    :return: int -> version of the new key
+    """
+    global signers, current_version
+    if signers is None:
+        load()
+
+    version = current_version + 1
+    signers = {version: new_signer(server_key), current_version: signers[current_version]}
+    current_version = version
+    return version
+
+
+def new_signer(server_key: str):
+    """
+    :param server_key:
+    :return: hmac object keyed with the server key
+    """
+    return hmac.new(server_key.encode(), digestmod=hashlib.sha256)
+
+
+def sign(version: int, user_id: int, expiry: int, email: str) -> str:
+    """
+    :param version: version of the key to sign with
+    :param user_id:
+    :param expiry: unix time the token expires at
+    :param email: email of the user
+    :return: str -> hex signature
+    :raises KeyError: if there is no key of this version
+    """
+    signer = signers[version].copy()
+    signer.update(SEPARATOR.join((str(version), str(user_id), str(expiry), email)).encode())
+    return signer.hexdigest()
+
+
+def issue(user_id: int, email: str) -> str:
+    """
+    :param user_id: user_id of the user in the Users table
+    :param email: email of the user
+    :return: str -> a token valid for token_ttl() seconds
+    """
+    if signers is None:
+        load()
+
+    expiry = int(time.time() + token_ttl())
+    signature = sign(current_version, user_id, expiry, email)
+    while signature in revoked:
+        # a user signing in again within the second it exited would get back the revoked token
+        expiry += 1
+        signature = sign(current_version, user_id, expiry, email)
+    return SEPARATOR.join((str(current_version), str(user_id), str(expiry), signature))
+
+
+def verify(token: str, email: str):
+    """
+    :param token: the token sent by the client
+    :param email: the email the client claims to be
+    :return: int -> the user id of the token, or None if the token is not valid for this email,
+    has expired or has been revoked
+    """
+    if signers is None:
+        load()
+
+    try:
+        version, user_id, expiry, signature = token.split(SEPARATOR)
+        version, user_id, expiry = int(version), int(user_id), int(expiry)
+    except ValueError:
+        return None
+
+    if expiry < time.time() or version not in signers or signature in revoked:
+        return None
+
+    if not hmac.compare_digest(sign(version, user_id, expiry, email), signature):
+        return None
+
+    return user_id
+
+
+def revoke(token: str):
+    """
+    Rejects a token from now on, e.g. once the client has exited
+    :param token: a token returned by issue()
+    """
+    try:
+        expiry = int(token.split(SEPARATOR)[2])
+        signature = token.split(SEPARATOR)[3]
+    except (IndexError, ValueError):
+        return
+
+    now = time.time()
+    with revoked_lock:
+        # forget revoked tokens that have expired since
+        for expired in [key for key, value in revoked.items() if value < now]:
+            del revoked[expired]
+        revoked[signature] = expiry
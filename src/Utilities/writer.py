@@ -0,0 +1,151 @@
+"""
+File containing the single writer every metadata write goes through.
+Writes are queued as functions that make their changes with database.query()
+and database.executemany() without committing. The writer thread runs the
+writes waiting in the queue on its own connection, each in a savepoint so
+that a failing write is undone on its own, and commits them together, so a
+burst of writes costs one commit instead of one per write.
+Callers get a concurrent.futures.Future that completes once the write is committed.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from Utilities import database_manager as database
+
+MAX_BATCH = 256  # writes committed together at most
+MAX_PENDING = 1024  # writes waiting in the queue before submit() blocks
+GROUP_COMMIT_DELAY = 0  # seconds to wait for more writes before committing a batch
+
+# how each backend starts a transaction, SQLite takes the write lock straight away
+BEGIN = {
+    database.SQLITE_BACKEND: 'BEGIN IMMEDIATE',
+    database.MYSQL_BACKEND: 'START TRANSACTION',
+}
+
+pending = queue.Queue(maxsize=MAX_PENDING)
+thread = None
+thread_lock = threading.Lock()
+
+
+def submit(function, *args) -> Future:
+    """
+    Queues a write
+    :param function: makes the changes with database.query(), does not commit
+    :param args: arguments of the function
+    :return: Future -> completes with what the function returns once its changes are committed,
+    or with the exception it raised, in which case none of its changes are kept
+    """
+    future = Future()
+    if threading.current_thread() is thread:
+        # a write made by another write is part of it
+        future.set_result(function(*args))
+        return future
+
+    start()
+    pending.put((function, args, future))
+    return future
+
+
+def write(function, *args):
+    """
+    Queues a write and waits until it is committed
+    :param function: makes the changes with database.query(), does not commit
+    :param args: arguments of the function
+    :return: what the function returns
+    :raises Exception: what the function raises
+    """
+    return submit(function, *args).result()
+
+
+def start():
+    """
+    Starts the writer thread if it is not running
+    """
+    global thread
+    with thread_lock:
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=run, name='writer', daemon=True)
+            thread.start()
+
+
+def stop():
+    """
+    Commits the writes that are queued and stops the writer thread
+    """
+    global thread
+    with thread_lock:
+        if thread is None:
+            return
+        pending.put(None)
+        thread.join()
+        thread = None
+
+
+def run():
+    """
+    Commits the queued writes in batches until stop() is called
+    """
+    delay = float(os.getenv('GROUP_COMMIT_DELAY', GROUP_COMMIT_DELAY))
+    max_batch = int(os.getenv('GROUP_COMMIT_BATCH', MAX_BATCH))
+    with database.connection() as pooled:
+        stopping = False
+        while not stopping:
+            batch = [pending.get()]
+            if batch[0] is None:
+                return
+            if delay > 0:
+                time.sleep(delay)
+
+            # every write queued while the last batch was committed
+            while len(batch) < max_batch:
+                try:
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            commit_batch(pooled, batch)
+
+
+def commit_batch(pooled, batch: list):
+    """
+    Runs the writes in a single transaction
+    :param pooled: the connection of the writer thread
+    :param batch: list of (function, args, future)
+    """
+    outcomes = []  # (future, result, exception)
+    try:
+        pooled.cursor.execute(BEGIN[database.active_backend])
+        for function, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            pooled.cursor.execute('SAVEPOINT write')
+            try:
+                outcomes.append((future, function(*args), None))
+            except Exception as e:
+                pooled.cursor.execute('ROLLBACK TO SAVEPOINT write')
+                outcomes.append((future, None, e))
+            pooled.cursor.execute('RELEASE SAVEPOINT write')
+        pooled.connection.commit()
+    except Exception as e:
+        # nothing in the batch was committed
+        try:
+            pooled.connection.rollback()
+        except Exception:
+            pass
+        for function, args, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    for future, result, exception in outcomes:
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
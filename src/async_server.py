@@ -0,0 +1,467 @@
+"""
+asyncio based TOKDOC server.
+Every connection is served by its own task so that one idle client does
+not block the others, and requests pipelined on a connection are handled
+concurrently where that is safe. Blocking database and disk work done by the
+request handlers is moved to an executor.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+from RequestHandlers import authentication as AuthRequestHandler
+from Utilities import binary_format
+from Utilities import codes
+from Utilities import compression
+from Utilities import constants
+from Utilities import database_manager as database
+from Utilities import integrity
+from Utilities import message_parser
+from Utilities import message_serializer
+from Utilities import passwords
+from Utilities import storage
+from Utilities import timeouts
+from Utilities.frame_reader import MAX_FRAME_SIZE
+
+# every executor thread checks out its own database connection, see database_manager
+EXECUTOR_WORKERS = 4
+MAX_IN_FLIGHT = 16  # pipelined requests handled at once per connection
+CONCURRENT_METHODS = (constants.LIST, constants.DOWNLOAD)  # requests that only read
+
+executor = None
+
+
+def max_in_flight() -> int:
+    """
+    :return: int -> the number of pipelined requests a connection may have in flight,
+    taken from the MAX_IN_FLIGHT environment variable when it is set
+    """
+    return int(os.getenv('MAX_IN_FLIGHT', MAX_IN_FLIGHT))
+
+
+async def receive_message(reader: asyncio.StreamReader, binary: bool = None) -> tuple:
+    """
+    Reads a full message from the stream.
+    The first bytes must arrive within the idle timeout, the rest of the
+    message within the header timeout.
+    :param reader: asyncio.StreamReader
+    :param binary: True if the connection uses the binary framing, None if no message was received yet,
+    in which case the framing is decided by the start of this message
+    :return: (full message, checksum, message without the checksum, binary)
+    :raises asyncio.TimeoutError: if the client is idle or too slow
+    """
+    start = await asyncio.wait_for(reader.readexactly(len(binary_format.MAGIC)), timeouts.idle_timeout())
+    if binary is None:
+        binary = start == binary_format.MAGIC
+
+    if binary:
+        frame = await asyncio.wait_for(receive_binary_message(reader, start), timeouts.header_timeout())
+        return frame, frame[-binary_format.DIGEST_SIZE:], frame[:-binary_format.DIGEST_SIZE], True
+
+    checksum, message_size, message = await asyncio.wait_for(receive_message_body(reader, start),
+                                                             timeouts.header_timeout())
+    return checksum + message_size + message, checksum[:-2], message_size + message, False
+
+
+async def receive_message_body(reader: asyncio.StreamReader, start: bytes) -> tuple:
+    """
+    Reads the rest of the checksum, the message size and the message
+    :param reader: asyncio.StreamReader
+    :param start: the first bytes of the checksum, already read
+    :return: (checksum, message size, message)
+    """
+    checksum = start + await reader.readexactly(server.CHECKSUM_CRLF_LENGTH - len(start))  # checksum + CRLF
+    message_size = await reader.readexactly(server.MESSAGE_SIZE_CRLF_LENGTH)  # message size + CRLF
+    size = int(message_size.decode())
+    if size < 0 or size > MAX_FRAME_SIZE:
+        raise ValueError('Invalid message size ' + str(size))
+    message = await reader.readexactly(size)  # receive the rest of the message
+    return checksum, message_size, message
+
+
+async def receive_binary_message(reader: asyncio.StreamReader, start: bytes) -> bytes:
+    """
+    Reads the rest of a frame of the binary framing, see binary_format
+    :param reader: asyncio.StreamReader
+    :param start: the first bytes of the frame, already read
+    :return: bytes -> the whole frame
+    """
+    if start != binary_format.MAGIC:
+        raise ValueError('Invalid binary frame header')
+
+    header = start + await reader.readexactly(binary_format.REQUEST_HEADER.size - len(start))
+    fields_length = binary_format.REQUEST_HEADER.unpack(header)[5]
+    if fields_length > MAX_FRAME_SIZE:
+        raise ValueError('Invalid fields length ' + str(fields_length))
+    return header + await reader.readexactly(fields_length + binary_format.DIGEST_SIZE)
+
+
+async def receive_file(reader: asyncio.StreamReader, file_size: int, codec: str = None, payload_digest: str = None,
+                       algorithm: str = None, max_size: int = None) -> storage.IncomingFile:
+    """
+    Streams the body of an UPLOAD request to a temporary file
+    :param reader: asyncio.StreamReader
+    :param file_size: number of bytes in the body
+    :param codec: the compression codec of the body, or None
+    :param payload_digest: the digest the body should have, or None
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :param max_size: most bytes a compressed body may expand to, see storage.IncomingFile
+    :return: storage.IncomingFile holding the received bytes
+    """
+    loop = asyncio.get_running_loop()
+    incoming_file = await loop.run_in_executor(None, storage.IncomingFile, codec, payload_digest, algorithm,
+                                               max_size)
+    try:
+        remaining = file_size
+        while remaining > 0:
+            chunk = await reader.readexactly(min(remaining, storage.CHUNK_SIZE))
+            await loop.run_in_executor(None, incoming_file.write, chunk)
+            remaining -= len(chunk)
+    except BaseException:
+        incoming_file.discard()
+        raise
+
+    incoming_file.finish()
+    return incoming_file
+
+
+async def drain_body(reader: asyncio.StreamReader, file_size: int) -> bool:
+    """
+    Reads and drops the body of a request that was refused, so that the next
+    request can be read from the stream
+    :param reader: asyncio.StreamReader
+    :param file_size: number of bytes in the body
+    :return: bool -> False if the body was too large or too slow to drain, or the client
+    disconnected, the connection should be closed
+    """
+    if file_size > server.MAX_DRAINED_BODY:
+        return False
+
+    try:
+        await asyncio.wait_for(reader.readexactly(file_size), timeouts.body_timeout(file_size))
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return False
+    return True
+
+
+async def send_response(writer: asyncio.StreamWriter, response_string, content=b'', binary: bool = False,
+                        algorithm: str = None):
+    """
+    Writes a response to the stream. In-memory data is written with the response
+    in a single write, files are sent with sendfile while the socket is corked.
+    :param writer: asyncio.StreamWriter
+    :param response_string: message_serializer.Response
+    :param content: str, bytes or storage.OutgoingFile
+    :param binary: True if the connection uses the binary framing
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    """
+    response = server.encode_response(response_string, content, binary, algorithm)
+    if not isinstance(content, storage.OutgoingFile):
+        writer.writelines([response, server.cast_bytes(content)])
+        await writer.drain()
+        return
+
+    connection_socket = writer.get_extra_info('socket')
+    try:
+        if content.size == 0:
+            writer.write(response)
+            await writer.drain()
+            return
+
+        server.set_cork(connection_socket, True)
+        try:
+            writer.write(response)
+            await writer.drain()
+            loop = asyncio.get_running_loop()
+            # falls back to sending chunks read from the file when the transport cannot sendfile
+            await loop.sendfile(writer.transport, content.file, content.offset, content.size, fallback=True)
+        finally:
+            server.set_cork(connection_socket, False)
+    finally:
+        content.close()
+
+
+def error_response(code: codes.Status) -> tuple:
+    """
+    :param code: Status
+    :return: (response message, response data) for the specified code
+    """
+    return message_serializer.build_response(code, file_size=0), b''
+
+
+async def completed(response: tuple) -> tuple:
+    """
+    :param response: (response message, response data)
+    :return: the response, so that it can be queued as a task
+    """
+    return response
+
+
+async def run_request(request: message_parser.Message, file, client_address, dependencies: list,
+                      algorithm: str = None) -> tuple:
+    """
+    Handles a request in the executor once the requests it depends on have completed
+    :param request: message_parser.Message
+    :param file: storage.IncomingFile holding the body of an UPLOAD or UPLOAD_CHUNK request, or None
+    :param client_address: address of the client
+    :param dependencies: tasks of earlier requests that must complete first
+    :param algorithm: integrity algorithm the client chose, None if it did not choose one
+    :return: (response message, response data)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        if dependencies:
+            await asyncio.wait(dependencies)
+
+        # protected endpoints LIST, UPLOAD, DOWNLOAD, checked in memory
+        error_code = server.check_access(request)
+        if error_code is not None:
+            print(client_address, error_code.status, sep=':\t')
+            return error_response(error_code)
+
+        if request.method == constants.AUTH:
+            return await run_auth(request)
+
+        return await loop.run_in_executor(executor, database.run, server.process_request, request, file,
+                                          algorithm)
+    except RuntimeError:
+        print(client_address, 'User does not exist', sep=':\t')
+        return error_response(codes.USER_NOT_EXIST)
+    except (KeyError, IndexError, ValueError):
+        print(client_address, 'Message formatted incorrectly', sep=':\t')
+        return error_response(codes.INVALID_FORMAT)
+    finally:
+        if file is not None:
+            file.discard()
+
+
+async def run_auth(request: message_parser.Message) -> tuple:
+    """
+    Handles an AUTH request. The password is checked in passwords.pool() so that
+    slow password hashing does not hold up the database executor, unless the
+    credentials were verified recently. Starts again if another connection
+    registered the user in the meantime.
+    :param request: message_parser.Message
+    :return: (response message, response data)
+    """
+    loop = asyncio.get_running_loop()
+    email = request.parameters[constants.AUTH_EMAIL_KEY]
+    password = request.parameters[constants.AUTH_PASSWORD_KEY]
+
+    while True:
+        user = await loop.run_in_executor(executor, database.run, AuthRequestHandler.find_user, email)
+        if AuthRequestHandler.is_remembered(email, password, user):
+            # verified recently, nothing to hash
+            authenticated, password_hash = True, None
+        else:
+            authenticated, password_hash = await loop.run_in_executor(
+                passwords.pool(), AuthRequestHandler.check_password, email, password, user)
+        completed = await loop.run_in_executor(executor, database.run, AuthRequestHandler.complete, email,
+                                               password, user, authenticated, password_hash)
+        if completed is not None:
+            return completed
+
+
+async def read_requests(reader: asyncio.StreamReader, responses: asyncio.Queue, client_address):
+    """
+    Reads requests from the stream until the client exits or disconnects.
+    Every request is started as a task and queued in the order it was received.
+    LIST and DOWNLOAD requests run concurrently with each other, any other
+    request waits for all earlier requests and holds back all later ones.
+    :param reader: asyncio.StreamReader
+    :param responses: queue of (task that produces the response, binary framing, integrity algorithm),
+    None marks the end
+    :param client_address: address of the client
+    """
+    binary = None  # framing of the connection, decided by its first message
+    algorithm = None  # integrity algorithm the client chose, sha256 until it chooses one
+    concurrent = []  # tasks started since the last sequential request
+    sequential = None  # task of the last request that may not run concurrently
+
+    while True:
+        # receive the message from the stream
+        try:
+            full_message, checksum, message_no_checksum, binary = await receive_message(reader, binary)
+        except asyncio.IncompleteReadError:
+            print('Disconnecting from:', client_address)
+            return
+        except asyncio.TimeoutError:
+            reaped = timeouts.record_reaped_connection()
+            print(client_address, 'Request timed out, connections reaped: ' + str(reaped), sep=':\t')
+            await responses.put((asyncio.create_task(completed(error_response(codes.REQUEST_TIMEOUT))), binary, algorithm))
+            return
+        except ValueError:
+            # message not appropriately formatted
+            print(client_address, 'Error in message retrieval', sep=':\t')
+            await responses.put((asyncio.create_task(completed(error_response(codes.INTERNAL_SERVER_ERROR))), binary, algorithm))
+            return
+
+        if not server.is_correct_checksum(checksum, message_no_checksum, binary, algorithm):
+            # message was changed during transmission
+            print(client_address, 'Message received incorrectly', sep=':\t')
+            await responses.put((asyncio.create_task(completed(error_response(codes.MESSAGE_CORRUPTED))), binary, algorithm))
+            continue
+
+        # parse message
+        try:
+            request = message_parser.parse_binary(full_message) if binary else message_parser.parse(full_message)
+            method = request.method
+        except Exception:
+            # message was incorrectly formatted
+            print(client_address, 'Message formatted incorrectly', sep=':\t')
+            await responses.put((asyncio.create_task(completed(error_response(codes.INVALID_FORMAT))), binary, algorithm))
+            continue
+
+        print(client_address, method, sep=':\t')
+
+        error_code = None
+        try:
+            # applies from the response to this request on
+            algorithm = integrity.negotiate(request.headers) or algorithm
+        except ValueError as e:
+            print(client_address, str(e), sep=':\t')
+            error_code = codes.INVALID_FORMAT
+        else:
+            if method in server.BODY_METHODS:
+                # the body of a refused upload is never written to disk, access keys are checked in memory
+                error_code = server.check_access(request)
+        if error_code is not None:
+            print(client_address, error_code.status, sep=':\t')
+            await responses.put((asyncio.create_task(completed(error_response(error_code))), binary, algorithm))
+            if method in server.BODY_METHODS and not await drain_body(reader, request.file_size):
+                print('Disconnecting from:', client_address)
+                return
+            continue
+
+        # Upload Request body
+        file = None
+        if method in server.BODY_METHODS:
+            file_size = request.file_size
+            try:
+                codec = compression.request_codec(request.headers)
+                payload_digest = request.headers.get(constants.FILE_DIGEST)
+                max_size = compression.original_size(request.headers)
+                file = await asyncio.wait_for(receive_file(reader, file_size, codec, payload_digest, algorithm,
+                                                           max_size),
+                                              timeouts.body_timeout(file_size))
+            except asyncio.IncompleteReadError:
+                # the client disconnected part way through the body
+                print('Disconnecting from:', client_address)
+                return
+            except asyncio.TimeoutError:
+                reaped = timeouts.record_reaped_connection()
+                print(client_address, 'Request timed out, connections reaped: ' + str(reaped), sep=':\t')
+                await responses.put((asyncio.create_task(completed(error_response(codes.REQUEST_TIMEOUT))), binary, algorithm))
+                return
+
+        if method in CONCURRENT_METHODS:
+            dependencies = [sequential] if sequential else []
+            task = asyncio.create_task(run_request(request, file, client_address, dependencies, algorithm))
+            concurrent.append(task)
+        else:
+            dependencies = concurrent + ([sequential] if sequential else [])
+            task = asyncio.create_task(run_request(request, file, client_address, dependencies, algorithm))
+            concurrent = []
+            sequential = task
+
+        # waits while the connection has too many requests in flight
+        await responses.put((task, binary, algorithm))
+
+        # Exit Request
+        if method == constants.EXIT:
+            print('Disconnecting from:', client_address)
+            return
+
+
+async def write_responses(writer: asyncio.StreamWriter, responses: asyncio.Queue, client_address):
+    """
+    Writes the responses to the stream in the order the requests were received
+    :param writer: asyncio.StreamWriter
+    :param responses: queue of (task that produces the response, binary framing, integrity algorithm),
+    None marks the end
+    :param client_address: address of the client
+    """
+    connected = True
+    while True:
+        queued = await responses.get()
+        if queued is None:
+            return
+
+        task, binary, algorithm = queued
+
+        try:
+            response_string, content = await task
+        except Exception as e:
+            print(client_address, 'Error handling request: ' + str(e), sep=':\t')
+            response_string, content = error_response(codes.INTERNAL_SERVER_ERROR)
+
+        if not connected:
+            if isinstance(content, storage.OutgoingFile):
+                content.close()
+            continue
+
+        send_timeout = timeouts.header_timeout()
+        if isinstance(content, storage.OutgoingFile):
+            send_timeout += timeouts.body_timeout(content.size)
+
+        try:
+            await asyncio.wait_for(send_response(writer, response_string, content, binary, algorithm),
+                                   send_timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            print(client_address, 'Disconnecting aborted socket', sep=':\t')
+            # closing the transport ends the reader, the remaining responses are discarded
+            connected = False
+            writer.close()
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Serves requests from a connected client until it exits or disconnects.
+    Requests may be pipelined, up to max_in_flight() of them are handled at once.
+    :param reader: asyncio.StreamReader
+    :param writer: asyncio.StreamWriter
+    """
+    client_address = writer.get_extra_info('peername')
+    print('Connecting to:', client_address)
+
+    responses = asyncio.Queue(maxsize=max_in_flight())
+    writer_task = asyncio.create_task(write_responses(writer, responses, client_address))
+    try:
+        await read_requests(reader, responses, client_address)
+    except (ConnectionError, OSError):
+        print(client_address, 'Disconnecting aborted socket', sep=':\t')
+    finally:
+        await responses.put(None)
+        await writer_task
+        writer.close()
+
+
+async def serve(server_socket=None):
+    """
+    Starts listening for connections and serves each one in its own task
+    :param server_socket: an already listening socket, a new one is created if not provided
+    """
+    global executor
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+    if server_socket is None:
+        server_socket = server.create_server_socket()
+    tokdoc_server = await asyncio.start_server(handle_client, sock=server_socket)
+
+    # print server details
+    server.print_server_details(server_socket)
+
+    try:
+        async with tokdoc_server:
+            await tokdoc_server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+
+
+def launch(server_socket=None):
+    """
+    Function that will start up the asyncio server.
+    :param server_socket: an already listening socket, a new one is created if not provided
+    """
+    asyncio.run(serve(server_socket))
@@ -0,0 +1,104 @@
+"""
+Compares the LIST visibility query with the way the visible files were found
+before, where every resource was checked with one query for is_public() and
+three for has_access().
+
+Run from the src directory:
+python -m benchmarks.list_benchmark [catalog size ...]
+"""
+import os
+import sys
+import timeit
+
+from RequestHandlers import list as list_handler
+from Utilities import database_manager as database
+from Utilities import schema
+
+CATALOG_SIZES = (100, 1000, 5000)  # rows in the Resources table
+USERS = 10
+EMAIL = 'user0@example.com'
+
+
+def legacy_is_public(filename):
+    query = "SELECT public FROM Resources WHERE resource_path = %s"
+    return database.query_scalar(query, (filename,)) == 1
+
+
+def legacy_has_access(filename, email):
+    query = "SELECT resource_id FROM Resources where resource_path = %s"
+    resource_id = database.query_scalar(query, (filename,))
+    query = "SELECT user_id FROM Users where email = %s"
+    user_id = database.query_scalar(query, (email,))
+    query = "SELECT access_id FROM Access where user_id=%s AND file_id=%s"
+    return database.query_one(query, (int(user_id), int(resource_id))) is not None
+
+
+def legacy_return_list(email) -> list[dict]:
+    """
+    list.return_list() as it was before the single visibility query
+    :param email:
+    :return: list of dicts
+    """
+    users = database.query("SELECT * FROM Users WHERE email = %s", (email,))
+    if len(users) == 0:
+        return []
+
+    rows = database.query("SELECT * FROM Resources", ())
+    list_to_return = []
+    for row in rows:
+        row = dict(row, public=row['public'] == 1)
+        filename = row['resource_path']
+        if row not in list_to_return and (legacy_is_public(filename) or legacy_has_access(filename, email)):
+            list_to_return.append(row)
+    return list_to_return
+
+
+def fill_catalog(size: int):
+    """
+    Replaces the resources with size new ones. Half of them are private, and
+    every user is given access to a tenth of the private ones.
+    :param size: rows in the Resources table
+    """
+    database.query('DELETE FROM Access')
+    database.query('DELETE FROM Resources')
+    database.executemany('INSERT INTO Resources (resource_id, type, resource_path, upload_date, user_id, public) '
+                         'VALUES (%s, %s, %s, %s, %s, %s)',
+                         [(number, '.txt', 'file' + str(number) + '.txt', '2023-02-26', number % USERS + 1,
+                           number % 2) for number in range(1, size + 1)])
+    database.executemany('INSERT INTO Access (user_id, file_id) VALUES (%s, %s)',
+                         [(user_id, number) for number in range(2, size + 1, 20) for user_id in range(1, USERS + 1)])
+    database.commit()
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or CATALOG_SIZES
+    # in memory, so that the time measured is the time spent answering the queries rather than on file locks
+    os.environ['DATABASE_PATH'] = ':memory:'
+    os.environ['DATABASE_BACKEND'] = database.SQLITE_BACKEND
+    database.connect()
+
+    with database.connection():
+        schema.migrate()
+        database.executemany('INSERT INTO Users (email, password) VALUES (%s, %s)',
+                             [('user' + str(number) + '@example.com', '') for number in range(USERS)])
+        database.commit()
+
+        for size in sizes:
+            fill_catalog(size)
+            # files owned by the user were only listed before when they were public or shared with their owner
+            visible = [row for row in list_handler.return_list(EMAIL) if row['public'] or row['user_id'] != 1]
+            assert visible == legacy_return_list(EMAIL)
+
+            iterations = max(1, 20000 // size)
+            legacy_time = timeit.timeit(lambda: legacy_return_list(EMAIL), number=iterations)
+            new_time = timeit.timeit(lambda: list_handler.return_list(EMAIL), number=iterations)
+            print('LIST,', size, 'resources:')
+            print('  before: ', round(legacy_time / iterations * 1e3, 2), 'ms per LIST')
+            print('  after:  ', round(new_time / iterations * 1e3, 2), 'ms per LIST')
+            print('  speedup:', round(legacy_time / new_time, 1), 'x')
+
+    database.disconnect()
+
+
+if __name__ == '__main__':
+    main()
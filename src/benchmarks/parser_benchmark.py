@@ -0,0 +1,83 @@
+"""
+Compares the single pass message_parser.parse() with parsing a request
+the way it was done before, where every element of the message was found
+by decoding and scanning the whole message again.
+
+Run from the src directory:
+python -m benchmarks.parser_benchmark [iterations]
+"""
+import hashlib
+import sys
+import timeit
+
+from Utilities import constants
+from Utilities import message_parser
+
+ITERATIONS = 20000
+
+
+def data_frame() -> bytes:
+    """
+    :return: bytes -> a DATA UPLOAD frame with the usual headers
+    """
+    message = (constants.START + constants.CRLF + constants.CRLF +
+               constants.START_METHOD + constants.CRLF +
+               'DATA UPLOAD 127.0.0.1:3000 tested.png' + constants.CRLF +
+               constants.END_METHOD + constants.CRLF + constants.CRLF +
+               constants.START_HEADERS + constants.CRLF +
+               constants.USER + ':test@test.com' + constants.CRLF +
+               constants.ACCESS_KEY + ':' + 64 * 'a' + constants.CRLF +
+               constants.TIMESTAMP + ':2023-02-26T23:14:23.562854' + constants.CRLF +
+               constants.AUTHORIZED + ':(test@test.com,test2@test2.com)' + constants.CRLF +
+               constants.END_HEADERS + constants.CRLF + constants.CRLF +
+               constants.START_FILE + constants.CRLF +
+               constants.FILE_SIZE + ':239937' + constants.CRLF +
+               constants.END_FILE + constants.CRLF + constants.CRLF +
+               constants.END)
+    message = str(len(message)).ljust(constants.MESSAGE_SIZE_LENGTH) + constants.CRLF + message
+    return (hashlib.sha256(message.encode()).hexdigest() + constants.CRLF + message).encode()
+
+
+def multi_pass(frame: bytes) -> dict:
+    """
+    Parses the frame the way the server did before parse() was introduced,
+    including the second parse done by the UPLOAD handler
+    :param frame:
+    :return: dict
+    """
+    message = message_parser.get_message_string(frame)
+    parsed = {
+        constants.PARAMETERS_KEY: message_parser.get_data_parameters(message),
+        constants.HEADERS: message_parser.get_headers(message),
+        constants.FILE_SIZE_KEY: message_parser.get_file_size(message),
+    }
+    message_parser.get_method_group_type(message)
+    message_parser.get_headers(message)
+    message_parser.get_data_parameters(message)
+    return parsed
+
+
+def single_pass(frame: bytes) -> message_parser.Message:
+    """
+    :param frame:
+    :return: message_parser.Message
+    """
+    return message_parser.parse(memoryview(frame))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    frame = data_frame()
+    assert multi_pass(frame) == single_pass(frame).to_dict()
+
+    multi_pass_time = timeit.timeit(lambda: multi_pass(frame), number=iterations)
+    single_pass_time = timeit.timeit(lambda: single_pass(frame), number=iterations)
+
+    print('frame size:  ', len(frame), 'bytes')
+    print('multi pass:  ', round(multi_pass_time / iterations * 1e6, 2), 'us per message')
+    print('single pass: ', round(single_pass_time / iterations * 1e6, 2), 'us per message')
+    print('speedup:     ', round(multi_pass_time / single_pass_time, 1), 'x')
+
+
+if __name__ == '__main__':
+    main()
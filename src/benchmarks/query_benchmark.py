@@ -0,0 +1,105 @@
+"""
+Compares database_manager.query() and its helpers with querying the way it
+was done before, where every query was translated again and every row was
+copied into a dict in Python.
+
+Run from the src directory:
+python -m benchmarks.query_benchmark [iterations]
+"""
+import os
+import sqlite3
+import sys
+import timeit
+
+from Utilities import database_manager as database
+
+ITERATIONS = 20000
+RESOURCES = 1000  # rows in the Resources table
+
+
+def legacy_query(cursor, query_template, query_values=None) -> list[dict]:
+    """
+    database_manager.query() as it was before the statement cache and sqlite3.Row
+    :param cursor: cursor of a connection without a row factory
+    :param query_template:
+    :param query_values:
+    :return: list of dicts
+    """
+    query_template = str(query_template).replace('%s', '?')
+    cursor.execute(query_template, query_values or ())
+    result_rows = cursor.fetchall()
+    try:
+        field_names = [i[0] for i in cursor.description]
+    except TypeError:
+        return []
+
+    entry = dict()
+    results = []
+    for row in result_rows:
+        entry = dict()
+        i = 0
+        for column_value in row:
+            entry[field_names[i]] = column_value
+            i += 1
+        results.append(entry)
+
+    return results
+
+
+def create_resources(connection):
+    """
+    :param connection: sqlite3 connection to fill with RESOURCES rows
+    """
+    connection.execute('''CREATE TABLE Resources (resource_id integer PRIMARY KEY, type varchar(15),
+    resource_path varchar(100) NOT NULL, upload_date datetime NOT NULL, user_id integer NOT NULL,
+    public integer NOT NULL DEFAULT 1, blob_hash char(64))''')
+    connection.executemany('INSERT INTO Resources (type, resource_path, upload_date, user_id, public) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           [('.txt', 'file' + str(number) + '.txt', '2023-02-26', number % 10, number % 2)
+                            for number in range(RESOURCES)])
+    connection.commit()
+
+
+def report(name: str, legacy_time: float, new_time: float, iterations: int):
+    print(name)
+    print('  before: ', round(legacy_time / iterations * 1e6, 2), 'us per query')
+    print('  after:  ', round(new_time / iterations * 1e6, 2), 'us per query')
+    print('  speedup:', round(legacy_time / new_time, 1), 'x')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    # in memory, so that the time measured is the time spent in Python rather than on file locks
+    os.environ['DATABASE_PATH'] = ':memory:'
+    os.environ['DATABASE_BACKEND'] = database.SQLITE_BACKEND
+    legacy_connection = sqlite3.connect(':memory:')
+    create_resources(legacy_connection)
+    legacy_cursor = legacy_connection.cursor()
+    database.connect()
+
+    with database.connection() as pooled:
+        create_resources(pooled.connection)
+        lookup = "SELECT public FROM Resources WHERE resource_id = %s"
+        assert legacy_query(legacy_cursor, lookup, (7,))[0]['public'] == database.query_scalar(lookup, (7,))
+        legacy_time = timeit.timeit(lambda: legacy_query(legacy_cursor, lookup, (7,))[0]['public'],
+                                    number=iterations)
+        new_time = timeit.timeit(lambda: database.query_scalar(lookup, (7,)), number=iterations)
+        report('single value (query_scalar):', legacy_time, new_time, iterations)
+
+        lookup = "SELECT * FROM Resources WHERE resource_id = %s"
+        legacy_time = timeit.timeit(lambda: legacy_query(legacy_cursor, lookup, (7,)), number=iterations)
+        new_time = timeit.timeit(lambda: database.query(lookup, (7,)), number=iterations)
+        report('single row (query):', legacy_time, new_time, iterations)
+
+        scan = "SELECT * FROM Resources"
+        scan_iterations = max(1, iterations // 100)
+        legacy_time = timeit.timeit(lambda: legacy_query(legacy_cursor, scan), number=scan_iterations)
+        new_time = timeit.timeit(lambda: database.query(scan), number=scan_iterations)
+        report('every row, ' + str(RESOURCES) + ' rows (query):', legacy_time, new_time, scan_iterations)
+
+    database.disconnect()
+    legacy_connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-import hashlib
+import argparse
+import socket as socket_module
 from socket import *
 import os
 from Utilities import database_manager as database
@@ -7,31 +8,44 @@ from RequestHandlers import authentication as AuthRequestHandler
 from RequestHandlers import upload as UploadRequestHandler
 from RequestHandlers import download as DownloadRequestHandler
 from RequestHandlers import exit as ExitRequestHandler
+from RequestHandlers import upload_session as UploadSessionRequestHandler
+from Utilities import binary_format
 from Utilities import message_parser
 from Utilities import message_serializer
 from Utilities import constants
 from Utilities import codes
+from Utilities import compression
+from Utilities import integrity
+from Utilities import schema
+from Utilities import storage
+from Utilities import timeouts
+from Utilities import tokens
+from Utilities import writer
+from Utilities.frame_reader import FrameReader
 
 # Server constants
 BACKLOG = 16
 PORT = 3000
 CHECKSUM_CRLF_LENGTH = 66
 MESSAGE_SIZE_CRLF_LENGTH = 18
-DEFAULT_BUFFER = 1024
+BODY_METHODS = (constants.UPLOAD, constants.UPLOAD_CHUNK)  # requests followed by a file body
+MAX_DRAINED_BODY = 64 * 1024  # largest body of a refused request read and dropped, larger ones close the connection
+SERIAL_MODE = 'serial'
+ASYNCIO_MODE = 'asyncio'
 
 
-def send_error_response(connection_socket: socket, code: codes.Status):
+def send_error_response(connection_socket: socket, code: codes.Status, binary: bool = False, algorithm: str = None):
     """
     Sends a response to the user with the specified code
     :param code: Status
     :param connection_socket: socket
+    :param binary: True if the connection uses the binary framing
+    :param algorithm: integrity algorithm of the connection, None for sha256
     """
-    response_string = message_serializer.build_response_string(code, file_size=0)
-    response_string = cast_bytes(response_string)
-    content = cast_bytes('')
+    response_string = encode_response(message_serializer.build_response(code, file_size=0), b'', binary,
+                                      algorithm)
     try:
-        connection_socket.send(response_string)
-        connection_socket.send(content)
+        send_response(connection_socket, response_string, b'')
     except ConnectionAbortedError as e:
         print('Disconnecting aborted socket')
         connection_socket.close()
@@ -40,6 +54,103 @@ def send_error_response(connection_socket: socket, code: codes.Status):
         connection_socket = None
 
 
+def send_response(connection_socket: socket, response: bytes, content):
+    """
+    Sends a response and its data. In-memory data is sent with the response in a
+    single write, files are sent with sendfile while the socket is corked so that
+    the response and the start of the file share a segment.
+    :param connection_socket: socket
+    :param response: bytes of the encoded response
+    :param content: str, bytes or storage.OutgoingFile
+    """
+    if not isinstance(content, storage.OutgoingFile):
+        send_buffers(connection_socket, [response, cast_bytes(content)])
+        return
+
+    try:
+        if content.size == 0:
+            connection_socket.sendall(response)
+            return
+
+        set_cork(connection_socket, True)
+        try:
+            connection_socket.sendall(response)
+            if hasattr(connection_socket, 'sendfile'):
+                connection_socket.sendfile(content.file, content.offset, content.size)
+            else:
+                for chunk in content.chunks():
+                    connection_socket.sendall(chunk)
+        finally:
+            set_cork(connection_socket, False)
+    finally:
+        content.close()
+
+
+def send_buffers(connection_socket: socket, buffers: list):
+    """
+    Sends the buffers one after the other with as few system calls as possible,
+    using scatter-gather writes where the platform supports them
+    :param connection_socket: socket
+    :param buffers: list of bytes-like objects
+    """
+    if not hasattr(connection_socket, 'sendmsg'):
+        connection_socket.sendall(b''.join(buffers))
+        return
+
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer) > 0]
+    while buffers:
+        sent = connection_socket.sendmsg(buffers)
+        # drop what was sent, a partial write may end in the middle of a buffer
+        while sent > 0:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+def set_cork(connection_socket, corked: bool):
+    """
+    Holds back partial segments while corked, uncorking sends what is left.
+    Does nothing on platforms without TCP_CORK.
+    :param connection_socket: socket
+    :param corked:
+    """
+    if hasattr(socket_module, 'TCP_CORK'):
+        connection_socket.setsockopt(IPPROTO_TCP, socket_module.TCP_CORK, 1 if corked else 0)
+
+
+def configure_connection(connection_socket: socket):
+    """
+    Disables Nagle's algorithm on a connection. Responses are written whole,
+    so small responses should not wait for the previous one to be acknowledged.
+    :param connection_socket: socket
+    """
+    connection_socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
+def encode_response(response: message_serializer.Response, content, binary: bool, algorithm: str = None) -> bytes:
+    """
+    :param response: message_serializer.Response built by message_serializer.build_response()
+    :param content: str, bytes or storage.OutgoingFile sent after the response
+    :param binary: True if the connection uses the binary framing
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :return: bytes -> the response in the framing and with the checksum of the connection
+    """
+    return response.encode(content_size(content), binary, algorithm)
+
+
+def content_size(content) -> int:
+    """
+    :param content: str, bytes or storage.OutgoingFile
+    :return: int -> number of bytes sent for the content
+    """
+    if isinstance(content, storage.OutgoingFile):
+        return content.size
+    return len(cast_bytes(content))
+
+
 def cast_bytes(content) -> bytes:
     """
     converts content to bytes
@@ -54,210 +165,392 @@ def cast_bytes(content) -> bytes:
         raise TypeError('The content must be bytes or string. Received', type(content))
 
 
-def launch():
+def get_server_port() -> int:
+    """
+    :return: int -> the port the server should listen on, taken from the PORT
+    environment variable when it is set
+    """
+    return int(os.getenv('PORT', PORT))
+
+
+def create_server_socket(reuse_port: bool = False) -> socket:
+    """
+    Creates a TCP socket listening on the server port
+    :param reuse_port: allow several processes to bind the port with SO_REUSEPORT
+    :return: socket
+    """
+    server_socket = socket(AF_INET, SOCK_STREAM)
+    server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    server_socket.bind(('', get_server_port()))
+    server_socket.listen(BACKLOG)
+    return server_socket
+
+
+def print_server_details(server_socket: socket):
+    """
+    Prints the name, ip and port of the server
+    :param server_socket: the listening socket
+    """
+    print("Server name:", gethostname())
+    print("Server ip:", gethostbyname(gethostname()))
+    print('Server port:', server_socket.getsockname()[1])
+
+
+def launch(server_socket: socket = None):
     """
     Function that will start up the server. Will start listening
     for connection requests and handle incoming and outgoing messages.
+    Connections are served one at a time, see async_server for the concurrent server.
+    :param server_socket: an already listening socket, a new one is created if not provided
     :return:
     """
 
     # listen to a TCP socket
-    server_port = int(os.getenv('PORT')) | PORT
-    server_socket = socket(AF_INET, SOCK_STREAM)
-    server_socket.bind(('', server_port))
-    server_socket.listen(BACKLOG)
+    if server_socket is None:
+        server_socket = create_server_socket()
 
     # print server details
-    print("Server name:", gethostname())
-    print("Server ip:", gethostbyname(gethostname()))
-    print('Server port:', server_port)
+    print_server_details(server_socket)
 
     while True:
         # accept queued connection
         connection_socket, client_address = server_socket.accept()
-        connected = True
         print('Connecting to:', client_address)
+        handle_connection(connection_socket, client_address)
 
-        # while a client is connected
-        while connected:
-
-            response_string = ''
-            content = b''
-            is_error = False
-
-            # receive the message from the socket
-            try:
-                full_message, checksum, message_no_checksum = receive_message(connection_socket)
-            except (ValueError, OSError) as e:
-                # message not appropriately formatted
-                print(client_address, 'Error in message retrieval', sep=':\t')
-                send_error_response(connection_socket, codes.INTERNAL_SERVER_ERROR)
-                connected = False
-                is_error = True
-
-            if not is_error and not is_correct_checksum(checksum, message_no_checksum):
-                # message was changed during transmission
-                print(client_address, 'Message received incorrectly', sep=':\t')
-                send_error_response(connection_socket, codes.MESSAGE_CORRUPTED)
-                is_error = True
-
-            # parse message
-            try:
-                parsed_request = message_parser.parse_message(full_message)  # parse the message
-            except:
-                # message was incorrectly formatted
-                print(client_address, 'Message formatted incorrectly', sep=':\t')
-                send_error_response(connection_socket, codes.INVALID_FORMAT)
-                is_error = True
-
-            # public endpoint AUTH
-            try:
-                if not is_error and parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY] == constants.AUTH:
-                    print(client_address, parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY], sep=':\t')
-                    email = parsed_request[constants.PARAMETERS_KEY][constants.AUTH_EMAIL_KEY]
-                    password = parsed_request[constants.PARAMETERS_KEY][constants.AUTH_PASSWORD_KEY]
-                    response_string, content = AuthRequestHandler.response(email, password)
-            except:
-                # key probably doesn't exist
-                # TODO: find exception name, and send appropriate response
-                is_error = True
-                pass
 
+def handle_connection(connection_socket: socket, client_address):
+    """
+    Serves requests from a connected client until it exits or disconnects
+    :param connection_socket: socket
+    :param client_address: address of the client
+    """
+    connected = True
+    configure_connection(connection_socket)
+    frame_reader = FrameReader(connection_socket)
+    binary = None  # framing of the connection, decided by its first frame
+    algorithm = None  # integrity algorithm the client chose, sha256 until it chooses one
+
+    # while a client is connected
+    while connected:
+
+        # receive the message from the socket
+        try:
+            frame, checksum, message_no_checksum, binary = receive_message(frame_reader, binary)
+        except timeout:
+            reap_connection(connection_socket, client_address, binary, algorithm)
+            break
+        except EOFError:
+            print('Disconnecting from:', client_address)
+            connection_socket.close()
+            break
+        except (ValueError, OSError) as e:
+            # message not appropriately formatted
+            print(client_address, 'Error in message retrieval', sep=':\t')
+            send_error_response(connection_socket, codes.INTERNAL_SERVER_ERROR, binary, algorithm)
+            connection_socket.close()
+            break
+
+        if not is_correct_checksum(checksum, message_no_checksum, binary, algorithm):
+            # message was changed during transmission
+            print(client_address, 'Message received incorrectly', sep=':\t')
+            send_error_response(connection_socket, codes.MESSAGE_CORRUPTED, binary, algorithm)
+            continue
+
+        # parse message
+        try:
+            # parse the message before the frame is reused
+            request = message_parser.parse_binary(frame) if binary else message_parser.parse(frame)
+            method = request.method
+        except Exception:
+            # message was incorrectly formatted
+            print(client_address, 'Message formatted incorrectly', sep=':\t')
+            send_error_response(connection_socket, codes.INVALID_FORMAT, binary, algorithm)
+            continue
+
+        print(client_address, method, sep=':\t')
+
+        try:
+            # applies from the response to this request on
+            algorithm = integrity.negotiate(request.headers) or algorithm
+        except ValueError as e:
+            print(client_address, str(e), sep=':\t')
+            error_code = codes.INVALID_FORMAT
+        else:
             # protected endpoints LIST, UPLOAD, DOWNLOAD
-            # Access key check
-            if not is_error:
-                method = parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY]
-            if not is_error and method != constants.EXIT and method != constants.AUTH:
-                if constants.ACCESS_KEY not in parsed_request[constants.HEADERS]:
-                    # access key was not provided
-                    print(client_address, 'Missing access key', sep=':\t')
-                    send_error_response(connection_socket, codes.ACCESS_DENIED)
-                    is_error = True
-                elif constants.ACCESS_KEY in parsed_request[constants.HEADERS]:
-                    access_key = parsed_request[constants.HEADERS][constants.ACCESS_KEY]
-                    email = parsed_request[constants.HEADERS][constants.USER]
-                    if AuthRequestHandler.generate_access_key_decoded(email) != access_key:
-                        # incorrect access key
-                        print(client_address, 'Incorrect access key', sep=':\t')
-                        send_error_response(connection_socket, codes.ACCESS_DENIED)
-                        is_error = True
-
-            # List Request
-            try:
-                if not is_error and parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY] == constants.LIST:
-                    print(client_address, parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY], sep=':\t')
-                    email = parsed_request[constants.HEADERS][constants.USER]
-                    access_key = None
-                    if not is_error:
-                        access_key = parsed_request[constants.HEADERS][constants.ACCESS_KEY]
-                    response_string, content = ListRequestHandler.response(email, access_key)
-                    if is_error:
-                        content = b''
-            except FileNotFoundError:
-                # key probably doesn't exist
-                # TODO: find exception name, and send appropriate response
-                is_error = True
-                pass
-
-            # Upload Request
-            try:
-                if not is_error and (
-                        parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY] == constants.UPLOAD) and \
-                        (parsed_request[constants.FILE_SIZE_KEY] > 0):
-
-                    file = b''
-
-                    while len(file) < parsed_request[constants.FILE_SIZE_KEY]:
-                        file += connection_socket.recv(DEFAULT_BUFFER)
-
-                    # email = parsed_request[constants.HEADERS][constants.USER]
-                    # access_key = parsed_request[constants.HEADERS][constants.ACCESS_KEY]
-                    response_string, content = UploadRequestHandler.response(full_message.decode(), file)
-                    if is_error:
-                        content = b''
-            except RuntimeError as e:
-                print(client_address, 'User does not exist', sep=':\t')
-                send_error_response(connection_socket, codes.USER_NOT_EXIST)
-                is_error = True
-            except Exception as e:
-                raise e
-                # key probably doesn't exist
-                # TODO: find exception name, and send appropriate response
-                pass
-
-            # Download Request
-            try:
-                if not is_error and parsed_request[constants.PARAMETERS_KEY][
-                    constants.METHOD_KEY] == constants.DOWNLOAD:
-                    print(client_address, parsed_request[constants.PARAMETERS_KEY][constants.METHOD_KEY], sep=':\t')
-                    email = parsed_request[constants.HEADERS][constants.USER]
-                    file_name = parsed_request[constants.PARAMETERS_KEY]['file_name']
-                    response_string, content = DownloadRequestHandler.response(email, file_name)
-                    if is_error:
-                        content = b''
-            except Exception as e:
-                raise e
-                # key probably doesn't exist
-                # TODO: find exception name, and send appropriate response
-                pass
-
-            # Exit Request
-            try:
-                if not is_error and \
-                        parsed_request[constants.PARAMETERS_KEY][
-                            constants.METHOD_KEY] == constants.EXIT and not is_error:
-                    response_string, content = ExitRequestHandler.response()
+            error_code = check_access(request)
+        if error_code is not None:
+            print(client_address, error_code.status, sep=':\t')
+            send_error_response(connection_socket, error_code, binary, algorithm)
+            if method in BODY_METHODS:
+                # the body of a refused upload is never written to disk
+                try:
+                    drain_body(frame_reader, request.file_size)
+                except (ValueError, OSError):
                     print('Disconnecting from:', client_address)
-                    response_string = cast_bytes(response_string)
-                    content = cast_bytes(content)
-                    connection_socket.send(response_string)
-                    connection_socket.send(content)
                     connection_socket.close()
-                    connected = False
-                    continue
-            except:
-                # key probably doesn't exist
-                # TODO: find exception name, and send appropriate response
-                pass
+                    break
+            continue
+
+        # Upload Request body
+        file = None
+        if method in BODY_METHODS:
+            try:
+                file = receive_file(frame_reader, request.file_size, compression.request_codec(request.headers),
+                                    request.headers.get(constants.FILE_DIGEST), algorithm,
+                                    compression.original_size(request.headers))
+            except timeout:
+                reap_connection(connection_socket, client_address, binary, algorithm)
+                break
+            except OSError:
+                print(client_address, 'Disconnecting aborted socket', sep=':\t')
+                connection_socket.close()
+                break
+
+        # bounds how long sending the response may stall
+        connection_socket.settimeout(timeouts.header_timeout())
+
+        try:
+            response_string, content = database.run(process_request, request, file, algorithm)
+        except RuntimeError as e:
+            print(client_address, 'User does not exist', sep=':\t')
+            send_error_response(connection_socket, codes.USER_NOT_EXIST, binary, algorithm)
+            continue
+        except database.unavailable_errors as e:
+            # no connection was released in time, or the database is locked or unreachable
+            print(client_address, 'Database unavailable: ' + str(e), sep=':\t')
+            send_error_response(connection_socket, codes.INTERNAL_SERVER_ERROR, binary, algorithm)
+            continue
+        except (KeyError, IndexError, ValueError) as e:
+            print(client_address, 'Message formatted incorrectly', sep=':\t')
+            send_error_response(connection_socket, codes.INVALID_FORMAT, binary, algorithm)
+            continue
+        except Exception as e:
+            # a failed request must not end the server, e.g. a file missing from the disk
+            print(client_address, 'Error handling request: ' + str(e), sep=':\t')
+            send_error_response(connection_socket, codes.INTERNAL_SERVER_ERROR, binary, algorithm)
+            continue
+        finally:
+            if file is not None:
+                file.discard()
+
+        # send response
+        try:
+            send_response(connection_socket, encode_response(response_string, content, binary, algorithm), content)
+        except OSError as e:
+            print(client_address, 'Disconnecting aborted socket', sep=':\t')
+            connection_socket.close()
+            break
+
+        # Exit Request
+        if method == constants.EXIT:
+            print('Disconnecting from:', client_address)
+            connection_socket.close()
+            connected = False
+
+
+def receive_file(frame_reader: FrameReader, file_size: int, codec: str = None, payload_digest: str = None,
+                 algorithm: str = None, max_size: int = None) -> storage.IncomingFile:
+    """
+    Streams the body of an UPLOAD request to a temporary file
+    :param frame_reader: FrameReader of the connection
+    :param file_size: number of bytes in the body
+    :param codec: the compression codec of the body, or None
+    :param payload_digest: the digest the body should have, or None
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    :param max_size: most bytes a compressed body may expand to, see storage.IncomingFile
+    :return: storage.IncomingFile holding the received bytes
+    :raises socket.timeout: if the client sends the body too slowly
+    """
+    deadline = timeouts.Deadline(timeouts.body_timeout(file_size))
+    chunk = memoryview(bytearray(min(file_size, storage.CHUNK_SIZE)))
+    incoming_file = storage.IncomingFile(codec, payload_digest, algorithm, max_size)
+    try:
+        remaining = file_size
+        while remaining > 0:
+            size = min(remaining, len(chunk))
+            frame_reader.read_into(chunk[:size], deadline)
+            incoming_file.write(chunk[:size])
+            remaining -= size
+    except BaseException:
+        incoming_file.discard()
+        raise
 
-            # send response
-            if not is_error:
-                response_string = cast_bytes(response_string)
-                content = cast_bytes(content)
-                connection_socket.send(response_string)
-                connection_socket.send(content)
+    incoming_file.finish()
+    return incoming_file
 
 
-def receive_message(connection_socket):
+def drain_body(frame_reader: FrameReader, file_size: int):
     """
-    Reads bytes from socket
-    :param connection_socket:
-    :return: bytes containing the full message received from the socket
+    Reads and drops the body of a request that was refused, so that the next
+    request can be read from the connection
+    :param frame_reader: FrameReader of the connection
+    :param file_size: number of bytes in the body
+    :raises ValueError: if the body is larger than MAX_DRAINED_BODY, the connection should be closed
+    :raises socket.timeout: if the client sends the body too slowly
     """
-    checksum = connection_socket.recv(CHECKSUM_CRLF_LENGTH)  # checksum + CRLF
-    message_size = connection_socket.recv(MESSAGE_SIZE_CRLF_LENGTH)  # message size + CRLF
-    message = connection_socket.recv(int(message_size.decode()))  # receive the rest of the message
+    if file_size > MAX_DRAINED_BODY:
+        raise ValueError('Refused body of ' + str(file_size) + ' bytes is too large to drain')
 
-    return checksum + message_size + message, checksum.decode()[
-                                              :-2].encode(), message_size + message  # message that was sent
+    if file_size > 0:
+        frame_reader.read_into(memoryview(bytearray(file_size)), timeouts.Deadline(timeouts.body_timeout(file_size)))
 
 
-def is_correct_checksum(checksum: bytes, message_no_checksum: bytes) -> bool:
+def reap_connection(connection_socket: socket, client_address, binary: bool = False, algorithm: str = None):
+    """
+    Closes a connection that was idle or too slow to send its request
+    :param connection_socket: socket
+    :param client_address: address of the client
+    :param binary: True if the connection uses the binary framing
+    :param algorithm: integrity algorithm of the connection, None for sha256
+    """
+    reaped = timeouts.record_reaped_connection()
+    print(client_address, 'Request timed out, connections reaped: ' + str(reaped), sep=':\t')
+    connection_socket.settimeout(timeouts.header_timeout())
+    send_error_response(connection_socket, codes.REQUEST_TIMEOUT, binary, algorithm)
+    connection_socket.close()
+
+
+def check_access(request: message_parser.Message):
+    """
+    Validates the access key of a request made to a protected endpoint (LIST, UPLOAD, DOWNLOAD)
+    :param request: message_parser.Message
+    :return: codes.Status describing why access was denied, or None if the request may proceed
+    """
+    method = request.method
+    if method == constants.EXIT or method == constants.AUTH:
+        return None
+
+    headers = request.headers
+    if constants.ACCESS_KEY not in headers or constants.USER not in headers:
+        # access key was not provided
+        return codes.ACCESS_DENIED
+
+    access_key = headers[constants.ACCESS_KEY]
+    email = headers[constants.USER]
+    if tokens.verify(access_key, email) is None:
+        # incorrect, expired or revoked access key
+        return codes.ACCESS_DENIED
+
+    return None
+
+
+def process_request(request: message_parser.Message, file: storage.IncomingFile = None,
+                    algorithm: str = None) -> tuple:
+    """
+    Hands a parsed request to the appropriate request handler.
+    May block on the database or the disk.
+    :param request: message_parser.Message
+    :param file: storage.IncomingFile holding the body of an UPLOAD or UPLOAD_CHUNK request
+    :param algorithm: integrity algorithm the client chose, None if it did not choose one
+    :return: (response message, response data)
+    """
+    parameters = request.parameters
+    headers = request.headers
+    method = request.method
+
+    if method == constants.AUTH:
+        email = parameters[constants.AUTH_EMAIL_KEY]
+        password = parameters[constants.AUTH_PASSWORD_KEY]
+        return AuthRequestHandler.response(email, password)
+    elif method == constants.LIST:
+        email = headers[constants.USER]
+        access_key = headers[constants.ACCESS_KEY]
+        try:
+            list_filters = message_parser.get_list_filters(headers)
+        except ValueError:
+            return message_serializer.build_response(codes.INVALID_FORMAT, file_size=0), b''
+        return ListRequestHandler.response(email, access_key, list_filters)
+    elif method == constants.UPLOAD:
+        return UploadRequestHandler.response(request, file)
+    elif method == constants.DOWNLOAD:
+        email = headers[constants.USER]
+        file_name = parameters['file_name']
+        try:
+            file_range = message_parser.get_range(headers)
+        except ValueError:
+            return message_serializer.build_response(codes.INVALID_FORMAT, file_size=0), b''
+        compression_options = compression.negotiate(headers)
+        digest_algorithm = algorithm if algorithm != integrity.NO_ALGORITHM else None
+        return DownloadRequestHandler.response(email, file_name, file_range, compression_options, digest_algorithm)
+    elif method == constants.EXIT:
+        return ExitRequestHandler.response(headers.get(constants.USER), headers.get(constants.ACCESS_KEY))
+    elif method == constants.UPLOAD_BEGIN:
+        return UploadSessionRequestHandler.begin(parameters['file_name'], headers[constants.USER],
+                                                 headers.get(constants.AUTHORIZED), request.file_size,
+                                                 int(headers[constants.CHUNK_SIZE]))
+    elif method == constants.UPLOAD_CHUNK:
+        return UploadSessionRequestHandler.put_chunk(headers[constants.SESSION], headers[constants.USER],
+                                                     int(headers[constants.CHUNK]), int(headers[constants.OFFSET]),
+                                                     headers[constants.CHUNK_CHECKSUM], file)
+    elif method == constants.UPLOAD_STATUS:
+        return UploadSessionRequestHandler.status(headers[constants.SESSION], headers[constants.USER])
+    elif method == constants.UPLOAD_COMMIT:
+        return UploadSessionRequestHandler.commit(headers[constants.SESSION], headers[constants.USER])
+
+    return message_serializer.build_response(codes.INVALID_FORMAT, file_size=0), b''
+
+
+def receive_message(frame_reader: FrameReader, binary: bool = None) -> tuple:
+    """
+    Reads the next frame from the connection.
+    The first bytes must arrive within the idle timeout, the rest of the
+    frame within the header timeout.
+    :param frame_reader: FrameReader of the connection
+    :param binary: True if the connection uses the binary framing, None if no frame was received yet,
+    in which case the framing is decided by the start of this frame
+    :return: (full message, checksum, message without the checksum, binary), the messages are
+    memoryviews valid until the next read from frame_reader
+    :raises socket.timeout: if the client is idle or too slow
+    :raises EOFError: if the client closed the connection
+    """
+    if frame_reader.buffered() == 0:
+        frame_reader.fill(timeouts.Deadline(timeouts.idle_timeout()))
+
+    deadline = timeouts.Deadline(timeouts.header_timeout())
+    if binary is None:
+        binary = frame_reader.starts_with(binary_format.MAGIC, deadline)
+
+    if binary:
+        return frame_reader.read_binary_frame(deadline) + (True,)
+    return frame_reader.read_frame(deadline) + (False,)
+
+
+def is_correct_checksum(checksum: bytes, message_no_checksum: bytes, binary: bool = False,
+                        algorithm: str = None) -> bool:
     """
     compares the checksum provided to the server generated checksum
     :param checksum:
     :param message_no_checksum:
+    :param binary: True if the checksum is the raw digest of a binary frame
+    :param algorithm: integrity algorithm of the connection, None for sha256
     :return: true if checksums are the same
     """
-    decoded_checksum = checksum.decode()
-    generated_checksum = hashlib.sha256(message_no_checksum).hexdigest()
-    return decoded_checksum == generated_checksum
+    if binary:
+        return binary_format.is_correct_digest(checksum, message_no_checksum, algorithm)
+    return integrity.is_correct_checksum(checksum, message_no_checksum, algorithm)
 
 
 if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='TOKDOC protocol server')
+    argument_parser.add_argument('--mode', choices=(SERIAL_MODE, ASYNCIO_MODE),
+                                 default=os.getenv('SERVER_MODE', SERIAL_MODE),
+                                 help='serve connections one at a time (serial) or concurrently (asyncio)')
+    arguments = argument_parser.parse_args()
+
     try:
         database.connect()
-        launch()
+        schema.migrate()
+        tokens.load()
+        if arguments.mode == ASYNCIO_MODE:
+            import async_server
+            async_server.launch()
+        else:
+            launch()
+        writer.stop()
         database.disconnect()
     except KeyboardInterrupt:
+        writer.stop()
         database.disconnect()
@@ -0,0 +1,145 @@
+"""
+Pre-fork supervisor for the TOKDOC server.
+Forks a number of worker processes that share the listening port, either
+through SO_REUSEPORT or through a socket inherited from the supervisor,
+and restarts any worker that dies. Every worker opens its own database
+connection.
+"""
+import argparse
+import os
+import signal
+import socket
+import time
+
+from dotenv import load_dotenv
+
+import server
+from Utilities import database_manager as database
+from Utilities import schema
+from Utilities import writer
+from Utilities import tokens
+
+RESTART_DELAY = 1  # seconds to wait before restarting a worker that died
+
+workers = {}  # pid -> worker number
+shutting_down = False
+
+
+def run_worker(mode: str, server_socket):
+    """
+    Runs the server in a forked worker process. Never returns.
+    :param mode: server.SERIAL_MODE or server.ASYNCIO_MODE
+    :param server_socket: the inherited listening socket, or None to bind with SO_REUSEPORT
+    """
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if server_socket is None:
+            server_socket = server.create_server_socket(reuse_port=True)
+
+        database.connect()
+        schema.migrate()
+        tokens.load()
+        if mode == server.ASYNCIO_MODE:
+            import async_server
+            async_server.launch(server_socket)
+        else:
+            server.launch(server_socket)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print('Worker', os.getpid(), 'failed:', e)
+        exit_code = 1
+    finally:
+        writer.stop()
+        database.disconnect()
+        os._exit(exit_code)
+
+
+def spawn_worker(number: int, mode: str, server_socket) -> int:
+    """
+    Forks a worker process
+    :param number: the worker number, used for logging
+    :param mode: server.SERIAL_MODE or server.ASYNCIO_MODE
+    :param server_socket: the inherited listening socket, or None to bind with SO_REUSEPORT
+    :return: int -> pid of the worker
+    """
+    pid = os.fork()
+    if pid == 0:
+        run_worker(mode, server_socket)
+
+    workers[pid] = number
+    print('Started worker', number, 'with pid', pid)
+    return pid
+
+
+def stop_workers(signal_number, frame):
+    """
+    Signal handler that forwards the shutdown signal to every worker
+    """
+    global shutting_down
+    shutting_down = True
+    for pid in list(workers):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def supervise(worker_count: int, mode: str, reuse_port: bool):
+    """
+    Starts the workers and restarts them when they die, until the supervisor is stopped
+    :param worker_count: number of worker processes
+    :param mode: server.SERIAL_MODE or server.ASYNCIO_MODE
+    :param reuse_port: bind a socket per worker with SO_REUSEPORT instead of sharing one
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('The supervisor requires os.fork, run server.py directly on this platform')
+
+    if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+        print('SO_REUSEPORT is not supported on this platform, sharing an inherited socket instead')
+        reuse_port = False
+
+    server_socket = None if reuse_port else server.create_server_socket()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    for number in range(worker_count):
+        spawn_worker(number, mode, server_socket)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        number = workers.pop(pid, None)
+        if number is None or shutting_down:
+            continue
+
+        print('Worker', number, 'with pid', pid, 'died with status', status, 'restarting')
+        time.sleep(RESTART_DELAY)
+        if not shutting_down:
+            spawn_worker(number, mode, server_socket)
+
+    if server_socket is not None:
+        server_socket.close()
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='TOKDOC protocol server supervisor')
+    argument_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                                 help='number of worker processes (defaults to the number of cores)')
+    argument_parser.add_argument('--mode', choices=(server.SERIAL_MODE, server.ASYNCIO_MODE),
+                                 default=os.getenv('SERVER_MODE', server.ASYNCIO_MODE),
+                                 help='how each worker serves its connections')
+    argument_parser.add_argument('--shared-socket', action='store_true',
+                                 help='share one inherited socket instead of binding with SO_REUSEPORT')
+    arguments = argument_parser.parse_args()
+
+    load_dotenv()
+    supervise(arguments.workers, arguments.mode, not arguments.shared_socket)
@@ -0,0 +1,268 @@
+"""
+Sets up a fresh SQLite database and storage directory for a test,
+and a server to send requests to for the tests that need one
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import async_server
+import server
+from RequestHandlers import authentication
+from Utilities import acl
+from Utilities import binary_format
+from Utilities import codes
+from Utilities import constants
+from Utilities import database_manager as database
+from Utilities import integrity
+from Utilities import schema
+from Utilities import storage
+from Utilities import tokens
+from Utilities import writer
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Every test gets its own database and storage directory, migrated to the latest schema
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        environment = {
+            'DATABASE_BACKEND': database.SQLITE_BACKEND,
+            'DATABASE_PATH': os.path.join(self.directory, 'test.db'),
+            'STORAGE_DIRECTORY': self.directory,
+            'SERVER_KEY': 'test server key',
+        }
+        patcher = mock.patch.dict(os.environ, environment)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tokens.signers = None
+        # a token revoked by one test must not be revoked in the next
+        tokens.revoked.clear()
+        self.addCleanup(tokens.revoked.clear)
+
+        acl.index = None
+        database.connect()
+        schema.migrate()
+
+    def tearDown(self):
+        writer.stop()
+        database.disconnect()
+        acl.index = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def register(self, email: str) -> int:
+        """
+        :param email:
+        :return: int -> user_id of the new user
+        """
+        return writer.write(authentication.register_user, email, 'password')
+
+    def incoming(self, content: bytes) -> storage.IncomingFile:
+        """
+        :param content:
+        :return: storage.IncomingFile holding the content, as if it had been received
+        """
+        incoming_file = storage.IncomingFile()
+        self.addCleanup(incoming_file.discard)
+        incoming_file.write(content)
+        incoming_file.finish()
+        return incoming_file
+
+
+class ServerTestCase(DatabaseTestCase):
+    """
+    Runs a server on a local port for a test, in serial mode unless the test class sets
+    SERVER_MODE to server.ASYNCIO_MODE. Requests are sent as text frames.
+    """
+    SERVER_MODE = server.SERIAL_MODE
+
+    def setUp(self):
+        super().setUp()
+        self.loop_errors = []
+
+        self.server_socket = socket.create_server(('127.0.0.1', 0))
+        if self.SERVER_MODE == server.ASYNCIO_MODE:
+            self.start_async_server()
+        else:
+            self.start_serial_server()
+
+    def start_serial_server(self):
+        """
+        Accepts connections on the server socket and serves them one at a time
+        """
+        def accept():
+            while True:
+                try:
+                    connection_socket, client_address = self.server_socket.accept()
+                except OSError:
+                    return
+                server.handle_connection(connection_socket, client_address)
+
+        thread = threading.Thread(target=accept, daemon=True)
+        thread.start()
+
+        def stop():
+            # closing alone does not wake up a blocked accept()
+            self.server_socket.shutdown(socket.SHUT_RDWR)
+            self.server_socket.close()
+            thread.join(timeout=5)
+        self.addCleanup(stop)
+
+    def start_async_server(self):
+        """
+        Serves connections on the server socket from an event loop in another thread,
+        recording the exceptions the loop would only log
+        """
+        loop = asyncio.new_event_loop()
+        loop.set_exception_handler(lambda loop, context: self.loop_errors.append(context))
+        async_server.executor = ThreadPoolExecutor(max_workers=async_server.EXECUTOR_WORKERS)
+        tokdoc_server = loop.run_until_complete(asyncio.start_server(async_server.handle_client,
+                                                                     sock=self.server_socket))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            async def close():
+                tokdoc_server.close()
+                await tokdoc_server.wait_closed()
+                # the clients are closed by now, so their connections end on their own
+                connections = asyncio.all_tasks() - {asyncio.current_task()}
+                if connections:
+                    await asyncio.wait(connections, timeout=5)
+                await asyncio.sleep(0)
+            asyncio.run_coroutine_threadsafe(close(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            loop.close()
+            async_server.executor.shutdown(wait=True)
+        self.addCleanup(stop)
+
+    def connect(self) -> socket.socket:
+        """
+        :return: socket connected to the server, closed at cleanup
+        """
+        client = socket.create_connection(self.server_socket.getsockname(), timeout=10)
+        self.addCleanup(client.close)
+        return client
+
+    def authenticate(self, client: socket.socket, email: str, password: str = 'password') -> str:
+        """
+        Registers or logs in a user on a connection
+        :param client: socket connected to the server
+        :param email:
+        :param password:
+        :return: str -> the access key of the user
+        """
+        client.sendall(text_frame(constants.AUTH + ' ' + email + ' ' + password))
+        status, values = read_response(client)
+        self.assertEqual(codes.SUCCESS.code, status)
+        return values[-1]
+
+
+def text_frame(method_line: str, headers: dict = None, file_size: int = None) -> bytes:
+    """
+    :param method_line: e.g. 'DATA LIST 127.0.0.1:3000'
+    :param headers: header name -> value
+    :param file_size: FILE_SIZE of the request, None for requests without a file
+    :return: bytes -> the request as a text frame, checksummed with sha256
+    """
+    message = '{START}\r\n\r\n{{START METHOD}}\r\n' + method_line + '\r\n{{END METHOD}}\r\n\r\n'
+    if headers:
+        message += '{{START HEADERS}}\r\n'
+        message += ''.join(name + ':' + str(value) + '\r\n' for name, value in headers.items())
+        message += '{{END HEADERS}}\r\n\r\n'
+    if file_size is not None:
+        message += '{{START FILE}}\r\nFILE_SIZE:' + str(file_size) + '\r\n{{END FILE}}\r\n\r\n'
+    message += '{END}'
+
+    message_no_checksum = (str(len(message.encode())).ljust(16) + '\r\n' + message).encode()
+    return hashlib.sha256(message_no_checksum).hexdigest().encode() + b'\r\n' + message_no_checksum
+
+
+def data_frame(method: str, email: str, access_key: str, filename: str = None, headers: dict = None,
+               file_size: int = 0) -> bytes:
+    """
+    :param method: e.g. constants.UPLOAD
+    :param email:
+    :param access_key:
+    :param filename: None for methods without a file name
+    :param headers: headers sent after USER and ACCESS_KEY
+    :param file_size: FILE_SIZE of the request
+    :return: bytes -> a DATA request as a text frame
+    """
+    method_line = ' '.join(filter(None, (constants.DATA, method, '127.0.0.1:3000', filename)))
+    request_headers = {constants.USER: email, constants.ACCESS_KEY: access_key}
+    request_headers.update(headers or {})
+    return text_frame(method_line, request_headers, file_size)
+
+
+def receive_exactly(client: socket.socket, size: int) -> bytes:
+    """
+    :param client: socket connected to the server
+    :param size: bytes to receive
+    :return: bytes -> exactly size bytes
+    :raises EOFError: if the server closes the connection first
+    """
+    received = bytearray()
+    while len(received) < size:
+        data = client.recv(size - len(received))
+        if not data:
+            raise EOFError(bytes(received))
+        received += data
+    return bytes(received)
+
+
+def read_response(client: socket.socket, algorithm: str = None) -> tuple:
+    """
+    Reads a text response, but not the data sent after it
+    :param client: socket connected to the server
+    :param algorithm: integrity algorithm the response is checked with, None for sha256
+    :return: (int status code, list of the values after the status)
+    """
+    checksum = receive_exactly(client, server.CHECKSUM_CRLF_LENGTH)[:constants.CHECKSUM_LENGTH]
+    size_line = receive_exactly(client, server.MESSAGE_SIZE_CRLF_LENGTH)
+    message = receive_exactly(client, int(size_line))
+    if checksum != integrity.frame_checksum(size_line + message, algorithm):
+        raise ValueError('Response checksum does not match')
+
+    line = message.decode().split('{{START RESPONSE}}\r\n')[1].split('\r\n')[0]
+    code, _, rest = line.partition(' ')
+    values = rest.rsplit('"', 1)[-1].split()
+    return int(code), values
+
+
+def read_binary_response(client: socket.socket, algorithm: str = None) -> tuple:
+    """
+    Reads a response of the binary framing, but not the data sent after it
+    :param client: socket connected to the server
+    :param algorithm: integrity algorithm the response is checked with, None for sha256
+    :return: (int status code, list of the values after the status, size of the response data)
+    """
+    header = receive_exactly(client, binary_format.RESPONSE_HEADER.size)
+    magic, version, status, flags, value_count, values_length, data_size = \
+        binary_format.RESPONSE_HEADER.unpack(header)
+    if magic != binary_format.MAGIC or version != binary_format.VERSION:
+        raise ValueError('Invalid binary response header')
+
+    encoded_values = receive_exactly(client, values_length)
+    digest = receive_exactly(client, binary_format.DIGEST_SIZE)
+    if not binary_format.is_correct_digest(digest, header + encoded_values, algorithm):
+        raise ValueError('Response digest does not match')
+
+    values = []
+    offset = 0
+    for value in range(value_count):
+        value_length, = binary_format.VALUE_HEADER.unpack_from(encoded_values, offset)
+        offset += binary_format.VALUE_HEADER.size
+        values.append(encoded_values[offset:offset + value_length].decode())
+        offset += value_length
+    return status, values, data_size
@@ -0,0 +1,39 @@
+"""
+Tests that DOWNLOAD authorizes the same files that LIST shows
+"""
+from RequestHandlers import list as list_handler
+from RequestHandlers import upload
+from Utilities import acl
+from Utilities import database_manager as database
+from tests.helpers import DatabaseTestCase
+
+
+class MayReadTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for email in ('owner@x.com', 'friend@x.com', 'stranger@x.com'):
+            self.register(email)
+        upload.save_incoming_file('public.txt', 'owner@x.com', None, self.incoming(b'public'))
+        upload.save_incoming_file('private.txt', 'owner@x.com', ['friend@x.com'], self.incoming(b'private'))
+
+    def listed(self, email: str) -> set:
+        with database.connection():
+            return {row['resource_path'] for row in list_handler.return_list(email)}
+
+    def readable(self, email: str) -> set:
+        with database.connection():
+            return {path for path in ('public.txt', 'private.txt') if acl.may_read(email, path)}
+
+    def test_owner_may_read_private_files(self):
+        self.assertEqual(self.readable('owner@x.com'), {'public.txt', 'private.txt'})
+
+    def test_granted_user_may_read(self):
+        self.assertEqual(self.readable('friend@x.com'), {'public.txt', 'private.txt'})
+
+    def test_other_users_may_read_public_files_only(self):
+        self.assertEqual(self.readable('stranger@x.com'), {'public.txt'})
+
+    def test_download_agrees_with_list(self):
+        for email in ('owner@x.com', 'friend@x.com', 'stranger@x.com'):
+            self.assertEqual(self.readable(email), self.listed(email), email)
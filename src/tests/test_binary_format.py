@@ -0,0 +1,106 @@
+"""
+Tests that binary frames parse to the same requests as text frames, and that
+a connection speaking the binary framing is answered in it
+"""
+import os
+import unittest
+
+import server
+from Utilities import binary_format
+from Utilities import codes
+from Utilities import constants
+from Utilities import message_parser
+from Utilities import message_serializer
+from tests import helpers
+from tests.helpers import ServerTestCase
+
+
+class BinaryFormatTest(unittest.TestCase):
+
+    def assertSameRequest(self, binary_frame: bytes, text_frame: bytes):
+        binary_request = message_parser.parse_binary(binary_frame)
+        text_request = message_parser.parse(text_frame)
+        for attribute in message_parser.Message.__slots__:
+            self.assertEqual(getattr(binary_request, attribute), getattr(text_request, attribute), attribute)
+
+    def test_auth(self):
+        self.assertSameRequest(
+            binary_format.build_request(constants.AUTH, {constants.AUTH_EMAIL_KEY: 'owner@x.com',
+                                                         constants.AUTH_PASSWORD_KEY: 'secret'}),
+            helpers.text_frame(constants.AUTH + ' owner@x.com secret'))
+
+    def test_upload(self):
+        headers = {constants.USER: 'owner@x.com', constants.ACCESS_KEY: 'key',
+                   constants.AUTHORIZED: 'friend@x.com,other@x.com'}
+        fields = dict(headers, ip='127.0.0.1', port=3000, file_name='{a}.txt')
+
+        self.assertSameRequest(
+            binary_format.build_request(constants.UPLOAD, fields, 42),
+            helpers.data_frame(constants.UPLOAD, 'owner@x.com', 'key', '{a}.txt',
+                               {constants.AUTHORIZED: '(friend@x.com,other@x.com)'}, 42))
+
+    def test_fields_round_trip(self):
+        fields = {'name': 'value', 'empty': '', 'unicode': 'dépôt'}
+        encoded = binary_format.encode_fields(fields)
+
+        self.assertEqual(binary_format.decode_fields(encoded, len(fields)), fields)
+        with self.assertRaises(ValueError):
+            binary_format.decode_fields(encoded + b'\0', len(fields))
+
+    def test_unsupported_frames(self):
+        frame = binary_format.build_request(constants.LIST, {})
+        with self.assertRaises(ValueError):
+            message_parser.parse_binary(b'XX' + frame[2:])
+        with self.assertRaises(ValueError):
+            message_parser.parse_binary(frame[:2] + bytes([binary_format.VERSION + 1]) + frame[3:])
+        with self.assertRaises(TypeError):
+            message_parser.parse_binary(frame[:3] + bytes([99]) + frame[4:])
+
+    def test_response_round_trip(self):
+        response = message_serializer.build_response(codes.PARTIAL_CONTENT, file_size=10, content_range=(5, 100))
+        frame = response.encode(10, binary=True)
+
+        header = binary_format.RESPONSE_HEADER.unpack_from(frame)
+        self.assertEqual(header[:3], (binary_format.MAGIC, binary_format.VERSION, codes.PARTIAL_CONTENT.code))
+        self.assertEqual(header[4:], (3, len(binary_format.encode_values(['10', '5', '100'])), 10))
+        self.assertTrue(binary_format.is_correct_digest(frame[-binary_format.DIGEST_SIZE:],
+                                                        frame[:-binary_format.DIGEST_SIZE]))
+
+
+class BinaryConnectionTest(ServerTestCase):
+
+    def request(self, client, method: str, fields: dict, body: bytes = b'', algorithm: str = None) -> tuple:
+        """
+        :param algorithm: integrity algorithm of the connection, None for sha256
+        :return: (status code, response values, response data)
+        """
+        client.sendall(binary_format.build_request(method, fields, len(body), algorithm) + body)
+        # the algorithm a request asks for applies from its response on
+        algorithm = fields.get(constants.INTEGRITY, algorithm)
+        status, values, data_size = helpers.read_binary_response(client, algorithm)
+        return status, values, helpers.receive_exactly(client, data_size)
+
+    def test_session(self):
+        client = self.connect()
+        status, values, data = self.request(client, constants.AUTH, {constants.AUTH_EMAIL_KEY: 'owner@x.com',
+                                                                     constants.AUTH_PASSWORD_KEY: 'password'})
+        self.assertEqual(status, codes.SUCCESS.code)
+        user = {constants.USER: 'owner@x.com', constants.ACCESS_KEY: values[0]}
+
+        content = os.urandom(1000)
+        status, values, data = self.request(client, constants.UPLOAD, dict(user, file_name='a.bin'), content)
+        self.assertEqual(status, codes.SUCCESS.code)
+
+        status, values, data = self.request(client, constants.LIST, user)
+        self.assertEqual((status, data), (codes.SUCCESS.code, b'a.bin'))
+
+        status, values, data = self.request(client, constants.DOWNLOAD,
+                                            dict(user, file_name='a.bin', **{constants.INTEGRITY: 'blake2b'}))
+        self.assertEqual((status, data), (codes.SUCCESS.code, content))
+
+        status, values, data = self.request(client, constants.EXIT, user, algorithm='blake2b')
+        self.assertEqual(status, codes.SUCCESS.code)
+
+
+class AsyncBinaryConnectionTest(BinaryConnectionTest):
+    SERVER_MODE = server.ASYNCIO_MODE
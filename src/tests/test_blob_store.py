@@ -0,0 +1,93 @@
+"""
+Tests of the life of a blob, from the first upload of its content to its deletion
+"""
+import hashlib
+import os
+
+from RequestHandlers import upload
+from Utilities import blob_store
+from Utilities import codes
+from Utilities import database_manager as database
+from tests.helpers import DatabaseTestCase
+
+
+class BlobLifecycleTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.register('a@x.com')
+        self.register('b@x.com')
+
+    def reference_count(self, blob_hash: str):
+        with database.connection():
+            return database.query_scalar("SELECT reference_count FROM Blobs WHERE blob_hash = %s", (blob_hash,))
+
+    def save(self, filename: str, email: str, content: bytes) -> codes.Status:
+        return upload.save_incoming_file(filename, email, None, self.incoming(content))
+
+    def test_same_content_is_stored_once(self):
+        blob_hash = hashlib.sha256(b'shared').hexdigest()
+        self.assertEqual(self.save('a.txt', 'a@x.com', b'shared'), codes.SUCCESS)
+        self.assertEqual(self.save('b.txt', 'b@x.com', b'shared'), codes.SUCCESS)
+
+        self.assertEqual(self.reference_count(blob_hash), 2)
+        directory = os.path.dirname(blob_store.blob_path(blob_hash))
+        self.assertEqual(os.listdir(directory), [blob_hash])
+
+    def test_hash_only_upload_references_stored_content(self):
+        blob_hash = hashlib.sha256(b'shared').hexdigest()
+        self.save('a.txt', 'a@x.com', b'shared')
+
+        self.assertEqual(upload.save_to_db('b.txt', 'b@x.com', None, blob_hash), codes.SUCCESS)
+        self.assertEqual(self.reference_count(blob_hash), 2)
+
+    def test_hash_only_upload_of_unknown_content(self):
+        blob_hash = hashlib.sha256(b'never sent').hexdigest()
+        self.assertEqual(upload.save_to_db('a.txt', 'a@x.com', None, blob_hash), codes.CONTENT_NOT_FOUND)
+        self.assertIsNone(self.reference_count(blob_hash))
+
+    def test_replaced_blob_is_deleted_after_commit(self):
+        old_hash = hashlib.sha256(b'old').hexdigest()
+        new_hash = hashlib.sha256(b'new').hexdigest()
+        self.save('a.txt', 'a@x.com', b'old')
+        cached_path = os.path.join(os.path.dirname(blob_store.blob_path(old_hash)), old_hash + '.zlib6')
+        with open(cached_path, 'wb') as cached_file:
+            cached_file.write(b'compressed')
+
+        self.assertEqual(self.save('a.txt', 'a@x.com', b'new'), codes.SUCCESS)
+
+        self.assertIsNone(self.reference_count(old_hash))
+        self.assertFalse(os.path.exists(blob_store.blob_path(old_hash)))
+        self.assertFalse(os.path.exists(cached_path))
+        self.assertEqual(self.reference_count(new_hash), 1)
+        self.assertTrue(os.path.exists(blob_store.blob_path(new_hash)))
+
+    def test_blob_still_referenced_is_kept(self):
+        blob_hash = hashlib.sha256(b'shared').hexdigest()
+        self.save('a.txt', 'a@x.com', b'shared')
+        self.save('b.txt', 'b@x.com', b'shared')
+
+        self.save('a.txt', 'a@x.com', b'other')
+
+        self.assertEqual(self.reference_count(blob_hash), 1)
+        self.assertTrue(os.path.exists(blob_store.blob_path(blob_hash)))
+
+    def test_reupload_of_the_same_content_keeps_the_blob(self):
+        blob_hash = hashlib.sha256(b'same').hexdigest()
+        self.save('a.txt', 'a@x.com', b'same')
+        self.save('a.txt', 'a@x.com', b'same')
+
+        self.assertEqual(self.reference_count(blob_hash), 1)
+        self.assertTrue(os.path.exists(blob_store.blob_path(blob_hash)))
+
+    def test_missing_blob_file_is_restored_from_the_upload(self):
+        blob_hash = hashlib.sha256(b'lost').hexdigest()
+        self.save('a.txt', 'a@x.com', b'lost')
+        os.remove(blob_store.blob_path(blob_hash))
+
+        self.assertEqual(upload.save_to_db('b.txt', 'b@x.com', None, blob_hash), codes.CONTENT_NOT_FOUND)
+        self.assertEqual(self.save('b.txt', 'b@x.com', b'lost'), codes.SUCCESS)
+
+        self.assertEqual(self.reference_count(blob_hash), 2)
+        with open(blob_store.blob_path(blob_hash), 'rb') as blob:
+            self.assertEqual(blob.read(), b'lost')
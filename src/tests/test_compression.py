@@ -0,0 +1,122 @@
+"""
+Tests the negotiation of compression codecs, compressed downloads and the
+limit on how far a compressed upload may expand
+"""
+import os
+import unittest
+import zlib
+from unittest import mock
+
+from RequestHandlers import download
+from RequestHandlers import upload
+from Utilities import compression
+from Utilities import constants
+from Utilities import database_manager as database
+from Utilities import storage
+from tests.helpers import DatabaseTestCase
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def negotiate(self, value: str):
+        return compression.negotiate({constants.COMPRESSION: value})
+
+    def test_no_header(self):
+        self.assertIsNone(compression.negotiate({}))
+
+    def test_first_supported_codec_is_used(self):
+        self.assertEqual(self.negotiate('br,lzma:3,zlib'), ('lzma', 3))
+        self.assertIsNone(self.negotiate('br,zstd'))
+
+    def test_level_is_kept_in_range(self):
+        self.assertEqual(self.negotiate('zlib'), ('zlib', 6))
+        self.assertEqual(self.negotiate('zlib:42'), ('zlib', 9))
+        self.assertEqual(self.negotiate('bz2:0'), ('bz2', 1))
+        self.assertEqual(self.negotiate('zlib:fast'), ('zlib', 6))
+
+    def test_original_size(self):
+        self.assertEqual(compression.original_size({constants.ORIGINAL_SIZE: '10'}), 10)
+        self.assertIsNone(compression.original_size({constants.ORIGINAL_SIZE: 'ten'}))
+        self.assertIsNone(compression.original_size({}))
+
+
+class CompressedUploadTest(DatabaseTestCase):
+
+    def receive(self, body: bytes, codec: str = 'zlib', max_size: int = None) -> storage.IncomingFile:
+        incoming_file = storage.IncomingFile(codec, max_size=max_size)
+        self.addCleanup(incoming_file.discard)
+        # in small pieces, as it would arrive
+        for start in range(0, len(body), 100):
+            incoming_file.write(body[start:start + 100])
+        incoming_file.finish()
+        return incoming_file
+
+    def test_body_is_decompressed(self):
+        content = os.urandom(1000) * 50
+        for codec in compression.LEVELS:
+            stream_compressor = compression.compressor(codec, 1)
+            incoming_file = self.receive(stream_compressor.compress(content) + stream_compressor.flush(), codec)
+
+            self.assertTrue(incoming_file.valid, codec)
+            self.assertEqual(incoming_file.size, len(content), codec)
+            self.assertEqual(incoming_file.hexdigest(), self.incoming(content).hexdigest(), codec)
+
+    def test_body_may_not_expand_past_its_original_size(self):
+        body = zlib.compress(bytes(10000))
+
+        self.assertTrue(self.receive(body, max_size=10000).valid)
+        self.assertFalse(self.receive(body, max_size=9999).valid)
+
+    def test_body_may_not_expand_past_the_limit(self):
+        body = zlib.compress(bytes(10000))
+
+        with mock.patch.dict(os.environ, {'MAX_DECOMPRESSED_SIZE': '9999'}):
+            self.assertFalse(self.receive(body).valid)
+            # the client cannot raise the limit with ORIGINAL_SIZE
+            self.assertFalse(self.receive(body, max_size=10000).valid)
+
+    def test_invalid_or_truncated_body(self):
+        self.assertFalse(self.receive(b'not compressed').valid)
+        self.assertFalse(self.receive(zlib.compress(bytes(10000))[:-4]).valid)
+        self.assertFalse(self.receive(zlib.compress(bytes(10000)), 'br').valid)
+
+
+class CompressedDownloadTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.register('owner@x.com')
+        self.content = b'compressible ' * 1000
+        upload.save_incoming_file('a.txt', 'owner@x.com', None, self.incoming(self.content))
+        upload.save_incoming_file('a.png', 'owner@x.com', None, self.incoming(self.content))
+
+    def download(self, filename: str) -> tuple:
+        """
+        :return: (response values, response data)
+        """
+        with database.connection():
+            response, outgoing_file = download.response('owner@x.com', filename, None, ('zlib', 6))
+        self.addCleanup(outgoing_file.close)
+        return response.values, b''.join(bytes(chunk) for chunk in outgoing_file.chunks())
+
+    def wait_for_compression(self):
+        # the pool has a single worker, so the copies asked for before are made first
+        compression.pool().submit(lambda: None).result()
+
+    def test_compressed_copy_is_sent_once_it_is_made(self):
+        values, data = self.download('a.txt')
+        self.assertEqual(values, [str(len(self.content))])
+        self.assertEqual(data, self.content)
+
+        self.wait_for_compression()
+        values, data = self.download('a.txt')
+        self.assertEqual(values, [str(len(data)), 'zlib:6', str(len(self.content))])
+        self.assertEqual(zlib.decompress(data), self.content)
+
+    def test_compressed_types_are_sent_as_they_are(self):
+        self.download('a.png')
+        self.wait_for_compression()
+
+        values, data = self.download('a.png')
+        self.assertEqual(values, [str(len(self.content))])
+        self.assertEqual(data, self.content)
@@ -0,0 +1,34 @@
+"""
+Tests that a client disconnecting part way through an upload only ends its own connection
+"""
+import socket
+
+import server
+from Utilities import codes
+from Utilities import constants
+from tests import helpers
+from tests.helpers import ServerTestCase
+
+
+class DisconnectTest(ServerTestCase):
+
+    def test_disconnect_in_the_middle_of_a_body(self):
+        client = self.connect()
+        access_key = self.authenticate(client, 'owner@x.com')
+        client.sendall(helpers.data_frame(constants.UPLOAD, 'owner@x.com', access_key, 'a.txt', file_size=1000) +
+                       bytes(10))
+        client.shutdown(socket.SHUT_WR)
+
+        # the connection is closed without a response
+        self.assertEqual(client.recv(1), b'')
+
+        # and the server goes on serving other clients
+        other_client = self.connect()
+        access_key = self.authenticate(other_client, 'owner@x.com')
+        other_client.sendall(helpers.data_frame(constants.LIST, 'owner@x.com', access_key))
+        self.assertEqual(helpers.read_response(other_client)[0], codes.NO_FILES_FOUND.code)
+        self.assertEqual(self.loop_errors, [])
+
+
+class AsyncDisconnectTest(DisconnectTest):
+    SERVER_MODE = server.ASYNCIO_MODE
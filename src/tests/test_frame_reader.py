@@ -0,0 +1,82 @@
+"""
+Tests that FrameReader hands out whole frames and bodies however the bytes arrive
+"""
+import socket
+import unittest
+
+from Utilities import binary_format
+from Utilities import constants
+from Utilities.frame_reader import FrameReader, MAX_FRAME_SIZE
+from tests import helpers
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client, server_end = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.addCleanup(server_end.close)
+        self.reader = FrameReader(server_end, buffer_size=32)
+
+    def test_pipelined_frames_and_body(self):
+        first = helpers.text_frame(constants.EXIT)
+        second = helpers.text_frame('DATA LIST 127.0.0.1:3000', {constants.USER: 'owner@x.com'}, 0)
+        self.client.sendall(first + second + b'body')
+
+        frame, checksum, message_no_checksum = self.reader.read_frame()
+        self.assertEqual(bytes(frame), first)
+        self.assertEqual(bytes(checksum), first[:constants.CHECKSUM_LENGTH])
+        self.assertEqual(bytes(message_no_checksum), first[constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH:])
+
+        self.assertEqual(bytes(self.reader.read_frame()[0]), second)
+
+        body = bytearray(4)
+        self.assertEqual(self.reader.read_into(memoryview(body)), 4)
+        self.assertEqual(body, b'body')
+
+    def test_frame_larger_than_the_buffer(self):
+        frame = helpers.text_frame(constants.AUTH + ' owner@x.com ' + 'p' * 1000)
+        self.client.sendall(frame)
+
+        self.assertEqual(bytes(self.reader.read_frame()[0]), frame)
+
+    def test_binary_frame(self):
+        frame = binary_format.build_request(constants.LIST, {constants.USER: 'owner@x.com'})
+        self.client.sendall(frame + helpers.text_frame(constants.EXIT))
+
+        self.assertTrue(self.reader.starts_with(binary_format.MAGIC))
+        full_message, digest, message_no_digest = self.reader.read_binary_frame()
+        self.assertEqual(bytes(full_message), frame)
+        self.assertEqual(bytes(digest), frame[-binary_format.DIGEST_SIZE:])
+        self.assertFalse(self.reader.starts_with(binary_format.MAGIC))
+
+    def test_closed_between_frames(self):
+        self.client.sendall(helpers.text_frame(constants.EXIT))
+        self.client.close()
+
+        self.reader.read_frame()
+        with self.assertRaises(EOFError):
+            self.reader.read_frame()
+
+    def test_closed_in_the_middle_of_a_frame(self):
+        self.client.sendall(helpers.text_frame(constants.EXIT)[:-1])
+        self.client.close()
+
+        with self.assertRaises(ConnectionAbortedError):
+            self.reader.read_frame()
+
+    def test_closed_in_the_middle_of_a_body(self):
+        self.client.sendall(b'bod')
+        self.client.close()
+
+        with self.assertRaises(ConnectionAbortedError):
+            self.reader.read_into(memoryview(bytearray(4)))
+
+    def test_message_size_too_large(self):
+        frame = helpers.text_frame(constants.EXIT)
+        size_start = constants.CHECKSUM_LENGTH + constants.CRLF_LENGTH
+        self.client.sendall(frame[:size_start] + str(MAX_FRAME_SIZE + 1).ljust(16).encode() +
+                            frame[size_start + constants.MESSAGE_SIZE_LENGTH:])
+
+        with self.assertRaises(ValueError):
+            self.reader.read_frame()
@@ -0,0 +1,49 @@
+"""
+Tests that an upload asking for an unsupported integrity algorithm is refused
+without its body being read as the next request
+"""
+import server
+from Utilities import codes
+from Utilities import constants
+from tests import helpers
+from tests.helpers import ServerTestCase
+
+
+class UnsupportedIntegrityTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+        self.access_key = self.authenticate(self.client, 'owner@x.com')
+
+    def upload(self, body: bytes, algorithm: str) -> bytes:
+        return helpers.data_frame(constants.UPLOAD, 'owner@x.com', self.access_key, 'a.txt',
+                                  {constants.INTEGRITY: algorithm}, len(body)) + body
+
+    def test_refused_body_is_drained(self):
+        self.client.sendall(self.upload(b'{START}', 'md5') +
+                            helpers.data_frame(constants.LIST, 'owner@x.com', self.access_key))
+
+        self.assertEqual(helpers.read_response(self.client)[0], codes.INVALID_FORMAT.code)
+        # the body was not taken for a frame, and the connection still uses sha256
+        self.assertEqual(helpers.read_response(self.client)[0], codes.NO_FILES_FOUND.code)
+
+    def test_large_refused_body_closes_the_connection(self):
+        self.client.sendall(self.upload(bytes(server.MAX_DRAINED_BODY + 1), 'md5'))
+
+        self.assertEqual(helpers.read_response(self.client)[0], codes.INVALID_FORMAT.code)
+        try:
+            received = self.client.recv(1)
+        except ConnectionResetError:
+            # the body the server did not read resets the connection
+            received = b''
+        self.assertEqual(received, b'')
+
+    def test_supported_algorithm_is_used_from_the_response(self):
+        self.client.sendall(self.upload(b'abc', 'blake2b'))
+
+        self.assertEqual(helpers.read_response(self.client, 'blake2b')[0], codes.SUCCESS.code)
+
+
+class AsyncUnsupportedIntegrityTest(UnsupportedIntegrityTest):
+    SERVER_MODE = server.ASYNCIO_MODE
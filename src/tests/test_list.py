@@ -0,0 +1,89 @@
+"""
+Tests that a LIST advertises exactly the names it sends, so that pipelined requests stay in step
+"""
+import server
+from RequestHandlers import list as list_handler
+from RequestHandlers import upload
+from Utilities import codes
+from Utilities import constants
+from Utilities import database_manager as database
+from tests import helpers
+from tests.helpers import DatabaseTestCase, ServerTestCase
+
+
+class ListSizeTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.register('owner@x.com')
+
+    def test_size_is_the_size_of_the_names(self):
+        for filename in ('a.txt', 'b.txt', 'c.txt'):
+            upload.save_incoming_file(filename, 'owner@x.com', None, self.incoming(filename.encode()))
+
+        with database.connection():
+            response, files = list_handler.response('owner@x.com')
+
+        self.assertEqual(files, b'a.txt\r\nb.txt\r\nc.txt')
+        self.assertEqual(int(response.values[0]), len(files))
+
+    def test_empty_list_has_no_size(self):
+        with database.connection():
+            response, files = list_handler.response('owner@x.com')
+
+        self.assertIs(response.status, codes.NO_FILES_FOUND)
+        self.assertEqual(files, b'')
+
+
+class ListPageTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for email in ('owner@x.com', 'friend@x.com', 'stranger@x.com'):
+            self.register(email)
+        upload.save_incoming_file('public.txt', 'owner@x.com', None, self.incoming(b'public'))
+        upload.save_incoming_file('shared.txt', 'owner@x.com', ['friend@x.com'], self.incoming(b'shared'))
+        upload.save_incoming_file('private.txt', 'owner@x.com', ['owner@x.com'], self.incoming(b'private'))
+        upload.save_incoming_file('mine.txt', 'friend@x.com', ['friend@x.com'], self.incoming(b'mine'))
+
+    def pages(self, email: str) -> list:
+        pages = []
+        list_filters = {'page_size': 1}
+        with database.connection():
+            while True:
+                response, files = list_handler.response(email, list_filters=list_filters)
+                if files:
+                    pages.append(files.decode())
+                if len(response.values) < 2:
+                    return pages
+                list_filters = {'page_size': 1, 'cursor': int(response.values[1])}
+
+    def test_pages_list_every_visible_file_once_in_upload_order(self):
+        self.assertEqual(self.pages('owner@x.com'), ['public.txt', 'shared.txt', 'private.txt'])
+        self.assertEqual(self.pages('friend@x.com'), ['public.txt', 'shared.txt', 'mine.txt'])
+        self.assertEqual(self.pages('stranger@x.com'), ['public.txt'])
+
+
+class PipelinedListTest(ServerTestCase):
+
+    def test_request_after_list_is_read_in_step(self):
+        client = self.connect()
+        access_key = self.authenticate(client, 'owner@x.com')
+        client.sendall(helpers.data_frame(constants.UPLOAD, 'owner@x.com', access_key, 'a.txt', file_size=3) + b'abc')
+        self.assertEqual(helpers.read_response(client)[0], codes.SUCCESS.code)
+
+        # both requests are sent before either response is read
+        client.sendall(helpers.data_frame(constants.LIST, 'owner@x.com', access_key) +
+                       helpers.data_frame(constants.DOWNLOAD, 'owner@x.com', access_key, 'a.txt'))
+
+        status, values = helpers.read_response(client)
+        self.assertEqual(status, codes.SUCCESS.code)
+        self.assertEqual(helpers.receive_exactly(client, int(values[0])), b'a.txt')
+
+        status, values = helpers.read_response(client)
+        self.assertEqual(status, codes.SUCCESS.code)
+        self.assertEqual(helpers.receive_exactly(client, int(values[0])), b'abc')
+
+
+class AsyncPipelinedListTest(PipelinedListTest):
+    SERVER_MODE = server.ASYNCIO_MODE
@@ -0,0 +1,73 @@
+"""
+Tests that requests are parsed in a single pass into a Message, whatever
+the names and header values contain
+"""
+import unittest
+
+from Utilities import constants
+from Utilities import message_parser
+from tests import helpers
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_auth(self):
+        request = message_parser.parse(helpers.text_frame(constants.AUTH + ' owner@x.com secret'))
+
+        self.assertEqual(request.method, constants.AUTH)
+        self.assertEqual(request.parameters, {constants.METHOD_KEY: constants.AUTH,
+                                              constants.AUTH_EMAIL_KEY: 'owner@x.com',
+                                              constants.AUTH_PASSWORD_KEY: 'secret'})
+        self.assertEqual(request.headers, {})
+
+    def test_upload(self):
+        frame = helpers.data_frame(constants.UPLOAD, 'owner@x.com', 'key', 'a.txt',
+                                   {constants.AUTHORIZED: '(friend@x.com,other@x.com)'}, 42)
+        request = message_parser.parse(frame)
+
+        self.assertEqual(request.method_group, constants.DATA)
+        self.assertEqual(request.method, constants.UPLOAD)
+        self.assertEqual(request.parameters, {constants.METHOD_GROUP_KEY: constants.DATA,
+                                              constants.METHOD_KEY: constants.UPLOAD,
+                                              'ip': '127.0.0.1', 'port': 3000, 'file_name': 'a.txt'})
+        self.assertEqual(request.headers, {constants.USER: 'owner@x.com', constants.ACCESS_KEY: 'key',
+                                           constants.AUTHORIZED: ['friend@x.com', 'other@x.com']})
+        self.assertEqual(request.file_size, 42)
+
+    def test_braces_in_names_and_header_values(self):
+        for name in ('{a}.txt', 'a}}.txt', '{{a.txt', '{START}.txt', '{END}'):
+            frame = helpers.data_frame(constants.DOWNLOAD, 'owner@x.com', 'key', name, {constants.PREFIX: name})
+            request = message_parser.parse(frame)
+
+            self.assertEqual(request.parameters['file_name'], name)
+            self.assertEqual(request.headers[constants.PREFIX], name)
+            self.assertEqual(request.file_size, 0)
+
+    def test_frame_may_be_a_view(self):
+        frame = helpers.data_frame(constants.LIST, 'owner@x.com', 'key')
+
+        for view in (bytearray(frame), memoryview(frame)):
+            self.assertEqual(message_parser.parse(view).to_dict(), message_parser.parse(frame).to_dict())
+
+    def test_parse_message_returns_the_dictionary_form(self):
+        frame = helpers.data_frame(constants.LIST, 'owner@x.com', 'key')
+
+        self.assertEqual(message_parser.parse_message(frame.decode()), {
+            constants.PARAMETERS_KEY: {constants.METHOD_GROUP_KEY: constants.DATA,
+                                       constants.METHOD_KEY: constants.LIST, 'ip': '127.0.0.1', 'port': 3000},
+            constants.HEADERS: {constants.USER: 'owner@x.com', constants.ACCESS_KEY: 'key'},
+            constants.FILE_SIZE_KEY: 0,
+        })
+
+    def test_malformed_messages(self):
+        with self.assertRaises(ValueError):
+            message_parser.parse(helpers.text_frame(constants.EXIT).replace(b'{{START METHOD}}', b'{{START MTHOD}}'))
+        with self.assertRaises(ValueError):
+            # a DATA request without a file section
+            message_parser.parse(helpers.text_frame('DATA LIST 127.0.0.1:3000', {constants.USER: 'owner@x.com'}))
+        with self.assertRaises(ValueError):
+            # a header without a value separator
+            frame = helpers.data_frame(constants.LIST, 'owner@x.com', 'key', headers={'BROKEN': ''})
+            message_parser.parse(frame.replace(b'BROKEN:', b'BROKEN'))
+        with self.assertRaises(TypeError):
+            message_parser.parse(helpers.text_frame('SEND a.txt'))
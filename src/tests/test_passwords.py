@@ -0,0 +1,129 @@
+"""
+Tests password hashing and verification, the cache of verified credentials,
+and how AUTH uses them
+"""
+import os
+import unittest
+from unittest import mock
+
+from RequestHandlers import authentication
+from Utilities import codes
+from Utilities import database_manager as database
+from Utilities import passwords
+from Utilities import writer
+from tests.helpers import DatabaseTestCase
+
+
+class PasswordTest(unittest.TestCase):
+
+    def test_hash_is_salted_scrypt(self):
+        stored = passwords.hash_password('secret')
+
+        algorithm, cost, salt, derived = stored.split(passwords.SEPARATOR)
+        self.assertEqual((algorithm, int(cost)), (passwords.SCRYPT, passwords.SCRYPT_COST))
+        self.assertNotEqual(passwords.hash_password('secret'), stored)
+        self.assertTrue(passwords.is_hashed(stored))
+
+    def test_verify(self):
+        stored = passwords.hash_password('secret')
+
+        self.assertTrue(passwords.verify_password('secret', stored))
+        self.assertFalse(passwords.verify_password('Secret', stored))
+
+    def test_verify_pbkdf2(self):
+        salt = os.urandom(passwords.SALT_SIZE)
+        derived = passwords.derive('secret', salt, passwords.PBKDF2, 1000)
+        stored = passwords.SEPARATOR.join((passwords.PBKDF2, '1000', passwords.encode(salt), passwords.encode(derived)))
+
+        self.assertTrue(passwords.verify_password('secret', stored))
+        self.assertFalse(passwords.verify_password('other', stored))
+
+    def test_verify_plain_text_and_malformed_passwords(self):
+        self.assertFalse(passwords.is_hashed('secret'))
+        self.assertTrue(passwords.verify_password('secret', 'secret'))
+        self.assertFalse(passwords.verify_password('other', 'secret'))
+        self.assertFalse(passwords.verify_password('secret', passwords.SCRYPT + '$x$y'))
+
+
+class CredentialCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        passwords.verified.clear()
+        self.addCleanup(passwords.verified.clear)
+
+    def test_remembered_credentials(self):
+        passwords.remember('owner@x.com', 'secret', 'stored')
+
+        self.assertTrue(passwords.is_remembered('owner@x.com', 'secret', 'stored'))
+        self.assertFalse(passwords.is_remembered('owner@x.com', 'other', 'stored'))
+        self.assertFalse(passwords.is_remembered('other@x.com', 'secret', 'stored'))
+        self.assertNotIn(b'secret', repr(passwords.verified).encode())
+
+    def test_changed_password_is_forgotten(self):
+        passwords.remember('owner@x.com', 'secret', 'stored')
+
+        self.assertFalse(passwords.is_remembered('owner@x.com', 'secret', 'changed'))
+        self.assertFalse(passwords.is_remembered('owner@x.com', 'secret', 'stored'))
+
+    def test_credentials_expire(self):
+        with mock.patch.dict(os.environ, {'CREDENTIAL_CACHE_TTL': '-1'}):
+            passwords.remember('owner@x.com', 'secret', 'stored')
+
+        self.assertFalse(passwords.is_remembered('owner@x.com', 'secret', 'stored'))
+
+    def test_least_recently_used_credentials_are_dropped(self):
+        with mock.patch.dict(os.environ, {'CREDENTIAL_CACHE_SIZE': '2'}):
+            passwords.remember('first@x.com', 'secret', 'stored')
+            passwords.remember('second@x.com', 'secret', 'stored')
+            passwords.is_remembered('first@x.com', 'secret', 'stored')
+            passwords.remember('third@x.com', 'secret', 'stored')
+
+        self.assertEqual(list(passwords.verified), ['first@x.com', 'third@x.com'])
+
+
+class AuthenticationTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        passwords.verified.clear()
+        self.addCleanup(passwords.verified.clear)
+
+    def auth(self, email: str, password: str):
+        with database.connection():
+            response, data = authentication.response(email, password)
+        return response.status
+
+    def stored(self, email: str) -> str:
+        # waits for the password updates submitted before
+        writer.write(lambda: None)
+        with database.connection():
+            return authentication.find_user(email)['password']
+
+    def test_new_user_is_registered_with_a_hash(self):
+        self.assertIs(self.auth('owner@x.com', 'secret'), codes.SUCCESS)
+
+        stored = self.stored('owner@x.com')
+        self.assertTrue(passwords.is_hashed(stored))
+        self.assertTrue(passwords.verify_password('secret', stored))
+
+    def test_wrong_password(self):
+        self.auth('owner@x.com', 'secret')
+        passwords.verified.clear()
+
+        self.assertIs(self.auth('owner@x.com', 'other'), codes.INCORRECT_CREDENTIALS)
+
+    def test_remembered_credentials_are_not_hashed_again(self):
+        self.auth('owner@x.com', 'secret')
+
+        with mock.patch.object(passwords, 'verify_password', return_value=False) as verify_password:
+            self.assertIs(self.auth('owner@x.com', 'secret'), codes.SUCCESS)
+            self.assertIs(self.auth('owner@x.com', 'other'), codes.INCORRECT_CREDENTIALS)
+        self.assertEqual(verify_password.call_count, 1)
+
+    def test_plain_text_password_is_replaced_by_its_hash(self):
+        self.register('owner@x.com')
+        self.assertEqual(self.stored('owner@x.com'), 'password')
+
+        self.assertIs(self.auth('owner@x.com', 'password'), codes.SUCCESS)
+
+        self.assertTrue(passwords.verify_password('password', self.stored('owner@x.com')))
@@ -0,0 +1,71 @@
+"""
+Tests that a DOWNLOAD with a RANGE header sends that part of the file, and the
+requests that follow it on the connection are read in step
+"""
+import os
+
+import server
+from Utilities import codes
+from Utilities import constants
+from tests import helpers
+from tests.helpers import ServerTestCase
+
+
+class RangeTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(1000)
+        self.client = self.connect()
+        self.access_key = self.authenticate(self.client, 'owner@x.com')
+        self.client.sendall(helpers.data_frame(constants.UPLOAD, 'owner@x.com', self.access_key, 'a.bin',
+                                               file_size=len(self.content)) + self.content)
+        self.assertEqual(helpers.read_response(self.client)[0], codes.SUCCESS.code)
+
+    def download(self, file_range: str) -> tuple:
+        """
+        :param file_range: value of the RANGE header
+        :return: (status code, response values, response data)
+        """
+        self.client.sendall(helpers.data_frame(constants.DOWNLOAD, 'owner@x.com', self.access_key, 'a.bin',
+                                               {constants.RANGE: file_range}))
+        status, values = helpers.read_response(self.client)
+        data = helpers.receive_exactly(self.client, int(values[0])) if values else b''
+        return status, values, data
+
+    def test_range(self):
+        status, values, data = self.download('100,10')
+
+        self.assertEqual(status, codes.PARTIAL_CONTENT.code)
+        self.assertEqual(values, ['10', '100', '1000'])
+        self.assertEqual(data, self.content[100:110])
+
+    def test_range_to_the_end_of_the_file(self):
+        for file_range in ('990', '990,', '990,5000'):
+            status, values, data = self.download(file_range)
+
+            self.assertEqual(status, codes.PARTIAL_CONTENT.code, file_range)
+            self.assertEqual(values, ['10', '990', '1000'], file_range)
+            self.assertEqual(data, self.content[990:], file_range)
+
+    def test_empty_range_at_the_end_of_the_file(self):
+        status, values, data = self.download('1000')
+
+        self.assertEqual(status, codes.PARTIAL_CONTENT.code)
+        self.assertEqual(values, ['0', '1000', '1000'])
+
+    def test_range_after_the_end_of_the_file(self):
+        status, values, data = self.download('1001')
+
+        self.assertEqual(status, codes.RANGE_NOT_SATISFIABLE.code)
+        self.assertEqual(data, b'')
+
+    def test_invalid_range(self):
+        for file_range in ('-1', '1,-1', '1,2,3', 'a'):
+            status, values, data = self.download(file_range)
+
+            self.assertEqual(status, codes.INVALID_FORMAT.code, file_range)
+
+
+class AsyncRangeTest(RangeTest):
+    SERVER_MODE = server.ASYNCIO_MODE
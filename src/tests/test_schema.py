@@ -0,0 +1,20 @@
+"""
+Tests that the statements run by the request handlers are answered from an index
+"""
+from RequestHandlers import list as list_handler
+from Utilities import database_manager as database
+from Utilities import schema
+from tests.helpers import DatabaseTestCase
+
+
+class QueryPlanTest(DatabaseTestCase):
+
+    def test_hot_queries_do_not_scan_tables(self):
+        with database.connection():
+            self.assertEqual(schema.check_query_plans(), [])
+
+    def test_list_queries_are_checked(self):
+        hot_queries = {query for query, values in schema.HOT_QUERIES}
+        for list_filters in ({}, {'cursor': 0}):
+            query, values = list_handler.visible_query(0, list_filters, 'resource_id, resource_path', 1)
+            self.assertIn(query, hot_queries)
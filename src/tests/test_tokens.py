@@ -0,0 +1,91 @@
+"""
+Tests that access tokens are verified, expire and are revoked in memory,
+and that an EXIT revokes the token it carries in either framing
+"""
+import os
+import unittest
+from unittest import mock
+
+import server
+from Utilities import binary_format
+from Utilities import codes
+from Utilities import constants
+from Utilities import message_parser
+from Utilities import tokens
+from tests import helpers
+
+
+class TokenTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'SERVER_KEY': 'test server key'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tokens.signers = None
+        tokens.revoked.clear()
+        self.addCleanup(tokens.revoked.clear)
+
+    def test_token_is_valid_for_its_user(self):
+        token = tokens.issue(7, 'owner@x.com')
+
+        self.assertEqual(tokens.verify(token, 'owner@x.com'), 7)
+        self.assertIsNone(tokens.verify(token, 'other@x.com'))
+
+    def test_tampered_token_is_not_valid(self):
+        version, user_id, expiry, signature = tokens.issue(7, 'owner@x.com').split(tokens.SEPARATOR)
+
+        tampered = tokens.SEPARATOR.join((version, '8', expiry, signature))
+        self.assertIsNone(tokens.verify(tampered, 'owner@x.com'))
+        self.assertIsNone(tokens.verify('not a token', 'owner@x.com'))
+
+    def test_token_expires(self):
+        with mock.patch.dict(os.environ, {'TOKEN_TTL': '-1'}):
+            token = tokens.issue(7, 'owner@x.com')
+
+        self.assertIsNone(tokens.verify(token, 'owner@x.com'))
+
+    def test_revoked_token_is_not_valid(self):
+        token = tokens.issue(7, 'owner@x.com')
+        other_token = tokens.issue(8, 'other@x.com')
+
+        tokens.revoke(token)
+
+        self.assertIsNone(tokens.verify(token, 'owner@x.com'))
+        self.assertEqual(tokens.verify(other_token, 'other@x.com'), 8)
+
+    def test_token_issued_after_a_revocation_is_valid(self):
+        tokens.revoke(tokens.issue(7, 'owner@x.com'))
+
+        # within the same second
+        token = tokens.issue(7, 'owner@x.com')
+        self.assertEqual(tokens.verify(token, 'owner@x.com'), 7)
+
+    def test_tokens_of_the_replaced_key_stay_valid_for_one_rotation(self):
+        token = tokens.issue(7, 'owner@x.com')
+
+        tokens.rotate('second key')
+        self.assertEqual(tokens.verify(token, 'owner@x.com'), 7)
+
+        tokens.rotate('third key')
+        self.assertIsNone(tokens.verify(token, 'owner@x.com'))
+
+    def exit(self, request: message_parser.Message):
+        response, content = server.process_request(request)
+        self.assertIs(response.status, codes.SUCCESS)
+
+    def test_text_exit_revokes_its_token(self):
+        token = tokens.issue(7, 'owner@x.com')
+        frame = helpers.text_frame(constants.EXIT, {constants.USER: 'owner@x.com', constants.ACCESS_KEY: token})
+
+        self.exit(message_parser.parse(frame))
+
+        self.assertIsNone(tokens.verify(token, 'owner@x.com'))
+
+    def test_binary_exit_revokes_its_token(self):
+        token = tokens.issue(7, 'owner@x.com')
+        frame = binary_format.build_request(constants.EXIT, {constants.USER: 'owner@x.com',
+                                                             constants.ACCESS_KEY: token})
+
+        self.exit(message_parser.parse_binary(frame))
+
+        self.assertIsNone(tokens.verify(token, 'owner@x.com'))
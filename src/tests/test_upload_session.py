@@ -0,0 +1,88 @@
+"""
+Tests that chunked upload sessions assemble the file once every chunk has arrived,
+and only for the user who began them
+"""
+import hashlib
+import os
+
+from RequestHandlers import download
+from RequestHandlers import upload_session
+from Utilities import codes
+from Utilities import database_manager as database
+from tests.helpers import DatabaseTestCase
+
+CHUNK_SIZE = upload_session.MIN_CHUNK_SIZE
+
+
+class UploadSessionTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.register('owner@x.com')
+        self.register('other@x.com')
+        self.content = os.urandom(2 * CHUNK_SIZE + 10)
+        with database.connection():
+            response, self.session_id = upload_session.begin('a.bin', 'owner@x.com', None, len(self.content),
+                                                             CHUNK_SIZE)
+        self.assertIs(response.status, codes.SUCCESS)
+
+    def put_chunk(self, number: int, email: str = 'owner@x.com', content: bytes = None):
+        offset = number * CHUNK_SIZE
+        chunk = self.content[offset:offset + CHUNK_SIZE]
+        response, data = upload_session.put_chunk(self.session_id, email, number, offset,
+                                                  hashlib.sha256(chunk).hexdigest(), self.incoming(content or chunk))
+        return response.status
+
+    def missing(self, email: str = 'owner@x.com') -> tuple:
+        response, missing = upload_session.status(self.session_id, email)
+        return response.status, missing
+
+    def commit(self, email: str = 'owner@x.com') -> tuple:
+        with database.connection():
+            response, missing = upload_session.commit(self.session_id, email)
+        return response.status, missing
+
+    def test_chunks_in_any_order_are_committed(self):
+        for number in (2, 0, 1):
+            self.assertIs(self.put_chunk(number), codes.SUCCESS)
+        self.assertEqual(self.missing(), (codes.SUCCESS, ''))
+
+        self.assertEqual(self.commit(), (codes.SUCCESS, ''))
+
+        with database.connection():
+            outgoing_file, size = download.send('a.bin')
+        self.addCleanup(outgoing_file.close)
+        self.assertEqual(b''.join(bytes(chunk) for chunk in outgoing_file.chunks()), self.content)
+
+    def test_incomplete_session_is_not_committed(self):
+        self.put_chunk(1)
+
+        self.assertEqual(self.missing(), (codes.SUCCESS, '0\r\n2'))
+        self.assertEqual(self.commit(), (codes.UPLOAD_INCOMPLETE, '0\r\n2'))
+
+    def test_session_is_committed_once(self):
+        for number in range(3):
+            self.put_chunk(number)
+
+        self.assertIs(self.commit()[0], codes.SUCCESS)
+        self.assertIs(self.commit()[0], codes.UPLOAD_SESSION_NOT_FOUND)
+
+    def test_session_of_another_user_is_not_found(self):
+        for number in range(3):
+            self.put_chunk(number)
+
+        self.assertIs(self.put_chunk(0, 'other@x.com'), codes.UPLOAD_SESSION_NOT_FOUND)
+        self.assertIs(self.missing('other@x.com')[0], codes.UPLOAD_SESSION_NOT_FOUND)
+        self.assertIs(self.commit('other@x.com')[0], codes.UPLOAD_SESSION_NOT_FOUND)
+        self.assertIs(self.commit()[0], codes.SUCCESS)
+
+    def test_unknown_session_is_not_found(self):
+        for session_id in ('0' * 32, '../' + self.session_id, ''):
+            self.session_id = session_id
+            self.assertIs(self.missing()[0], codes.UPLOAD_SESSION_NOT_FOUND, session_id)
+
+    def test_corrupted_or_misplaced_chunk_is_refused(self):
+        self.assertIs(self.put_chunk(0, content=bytes(CHUNK_SIZE)), codes.MESSAGE_CORRUPTED)
+        self.assertIs(self.put_chunk(2, content=bytes(11)), codes.INVALID_FORMAT)
+        self.assertIs(self.put_chunk(3), codes.INVALID_FORMAT)
+        self.assertEqual(self.missing(), (codes.SUCCESS, '0\r\n1\r\n2'))
@@ -0,0 +1,88 @@
+"""
+Tests of the single writer and of the upload write it runs
+"""
+import hashlib
+import os
+
+from RequestHandlers import upload
+from Utilities import blob_store
+from Utilities import codes
+from Utilities import database_manager as database
+from Utilities import writer
+from tests.helpers import DatabaseTestCase
+
+
+def insert_user(email: str, fail: bool = False):
+    """
+    Write that adds a user, and fails after the insert when asked to
+    :param email:
+    :param fail:
+    """
+    database.query("INSERT INTO Users (email, password) VALUES (%s, %s)", (email, 'password'))
+    if fail:
+        raise RuntimeError('write failed after its insert')
+    return email
+
+
+class WriterTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # the writes submitted together are committed in one batch
+        os.environ['GROUP_COMMIT_DELAY'] = '0.05'
+
+    def emails(self) -> set:
+        with database.connection():
+            return {row['email'] for row in database.query("SELECT email FROM Users")}
+
+    def test_write_returns_the_result_once_committed(self):
+        self.assertEqual(writer.write(insert_user, 'a@x.com'), 'a@x.com')
+        self.assertEqual(self.emails(), {'a@x.com'})
+
+    def test_failed_write_is_rolled_back_alone(self):
+        futures = [writer.submit(insert_user, 'a@x.com'),
+                   writer.submit(insert_user, 'b@x.com', True),
+                   writer.submit(insert_user, 'c@x.com')]
+
+        self.assertEqual(futures[0].result(), 'a@x.com')
+        with self.assertRaises(RuntimeError):
+            futures[1].result()
+        self.assertEqual(futures[2].result(), 'c@x.com')
+        self.assertEqual(self.emails(), {'a@x.com', 'c@x.com'})
+
+
+class UploadWriteTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.register('owner@x.com')
+
+    def stored_hash(self, filename: str) -> str:
+        with database.connection():
+            return database.query_scalar("SELECT blob_hash FROM Resources WHERE resource_path = %s", (filename,))
+
+    def test_failed_reupload_keeps_the_old_blob(self):
+        old = b'old content'
+        new = b'new content'
+        self.assertEqual(upload.save_incoming_file('a.txt', 'owner@x.com', None, self.incoming(old)), codes.SUCCESS)
+
+        # the authorized user does not exist, so the write fails after the new content was received
+        with self.assertRaises(RuntimeError):
+            upload.save_incoming_file('a.txt', 'owner@x.com', ['missing@x.com'], self.incoming(new))
+
+        old_hash = hashlib.sha256(old).hexdigest()
+        new_hash = hashlib.sha256(new).hexdigest()
+        self.assertEqual(self.stored_hash('a.txt'), old_hash)
+        with open(blob_store.blob_path(old_hash), 'rb') as blob:
+            self.assertEqual(blob.read(), old)
+        # the received content is not left behind
+        self.assertFalse(os.path.exists(blob_store.blob_path(new_hash)))
+
+    def test_name_taken_by_another_user(self):
+        self.register('other@x.com')
+        self.assertEqual(upload.save_incoming_file('a.txt', 'owner@x.com', None, self.incoming(b'mine')),
+                         codes.SUCCESS)
+        self.assertEqual(upload.save_incoming_file('a.txt', 'other@x.com', None, self.incoming(b'theirs')),
+                         codes.FILE_NAME_TAKEN)
+        self.assertEqual(self.stored_hash('a.txt'), hashlib.sha256(b'mine').hexdigest())
+        self.assertFalse(os.path.exists(blob_store.blob_path(hashlib.sha256(b'theirs').hexdigest())))